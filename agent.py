@@ -1,7 +1,45 @@
 
-def interact(policy, game, model=None):
+def interact(policy, game, model=None, log=None):
     action = policy.get_action(game, model)
     if action is not None:
         observed_state = game.accept(action)
+        # report of the decision (policies with stats enabled), it is passed
+        # to the model and to the log function
+        report = getattr(policy, "report", None)
         if model is not None:
-            model.update(observed_state)
+            model.update(observed_state, action, game, report)
+        if log is not None and report is not None:
+            log(report)
+
+
+def play_many(policy, make_game, games_num, pool_size=256, make_model=None):
+    # plays games_num games, pool_size of them at a time, the actions of all
+    # the games of the pool are chosen by one call of policy.get_actions(games)
+    # (policies without get_actions choose them game by game)
+    # make_game, make_model: functions of the index of the game, a finished
+    #   game is replaced by the next one
+    # yields (index, game, model) of every game when it is finished, in the
+    # order they finish
+    pool = []
+    started = 0
+    while pool or started < games_num:
+        while len(pool) < pool_size and started < games_num:
+            model = make_model(started) if make_model is not None else None
+            pool.append((started, make_game(started), model))
+            started += 1
+        games = [game for _, game, _ in pool]
+        if hasattr(policy, "get_actions"):
+            actions = policy.get_actions(games)
+        else:
+            actions = [policy.get_action(game, model)
+                       for _, game, model in pool]
+        playing = []
+        for (index, game, model), action in zip(pool, actions):
+            if action is None:
+                yield index, game, model
+                continue
+            observed_state = game.accept(action)
+            if model is not None:
+                model.update(observed_state, action, game)
+            playing.append((index, game, model))
+        pool = playing
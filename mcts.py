@@ -1,29 +1,95 @@
+import math
 import random
+import time
+from array import array
+
+from two048.game import pack_board, unpack_board
+from two048.heuristics import get_heuristic
+from two048.stats import Stats, decision_report, instrument
+from two048.transposition import canonical_key
+
+
+# Monte Carlo tree search with explicit chance nodes
+#
+# the tree alternates two kinds of nodes:
+#   decision node - state of the game before a move, its children are chance
+#     nodes, one for each possible action
+#   chance node - afterstate (the state after the move and before the new
+#     tile), its children are decision nodes, one for each new tile that has
+#     been sampled so far
+# a leaf is evaluated by an estimate of the final score of the game from its
+# state (by default the final score of a random playout, see the leaf
+# evaluators below), node values are the averages of the leaf values
 
 
 class Tree:
 
-    def __init__(self, state, parent=None):
-        # how to pass game here? attach separate game instance to each node?
-        # or add methods to game that take state as input to make moves?
+    def __init__(self, state, score, parent=None, action=None,
+                 is_chance=False):
+        # the game is not stored in the nodes, a single scratch game is set
+        # to the node state when it is needed (see set_game)
         self.state = state
+        self.score = score
         self.parent = parent
-        self.statistics = None
+        # action that leads from the parent to the chance node
+        self.action = action
+        self.is_chance = is_chance
+        # node statistics
+        self.visits = 0
+        self.value_sum = 0
+        self.max_value = None
+        # decision node: list of chance nodes
+        # chance node: dict of decision nodes by the state
         self.children = None
         self.children_iterator = None
         self.unvisited_child = None
         self.is_expanded = False
         self.is_terminal = False
 
+    def get_value(self):
+        return self.value_sum / self.visits if self.visits else 0
+
+    def update(self, value):
+        self.visits += 1
+        self.value_sum += value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+
+    def backpropagate(self, value):
+        node = self
+        while node is not None:
+            node.update(value)
+            node = node.parent
+
+    def set_game(self, game):
+        game.set_state(self.state[:])
+        game.set_value(self.score)
+
     def generate_children(self, game):
-        pass
+        # chance nodes for all the possible actions of the decision node
+        self.set_game(game)
+        actions = game.get_possible_actions()
+        self.children = []
+        for action in actions:
+            self.set_game(game)
+            game.change_state(action)
+            game.update_score()
+            self.children.append(Tree(game.get_state(), game.get_value(),
+                                      parent=self, action=action,
+                                      is_chance=True))
+        self.children_iterator = iter(self.children)
+        self.unvisited_child = next(self.children_iterator, None)
+        self.is_terminal = not self.children
+        self.is_expanded = self.is_terminal
 
-    def get_unvisited_child(self):
+    def get_unvisited_child(self, game):
         if self.is_terminal:
             return None
         else:
             if self.unvisited_child is None:
-                self.generate_children()
+                self.generate_children(game)
+                if self.is_terminal:
+                    return None
             leaf = self.unvisited_child
             try:
                 self.unvisited_child = self.children_iterator.__next__()
@@ -31,31 +97,762 @@ class Tree:
                 self.is_expanded = True
             return leaf
 
+    def sample_child(self, game):
+        # sample the new tile of the chance node with the game rules
+        # returns the decision node and if it was just created
+        if self.children is None:
+            self.children = {}
+        self.set_game(game)
+        game.generate_tile()
+        state = game.get_state()
+        key = tuple(state)
+        child = self.children.get(key)
+        if child is not None:
+            return child, False
+        child = Tree(state, self.score, parent=self)
+        self.children[key] = child
+        return child, True
+
+    def find_child(self, state):
+        # decision node of the chance node with the given state (if sampled)
+        if not self.children:
+            return None
+        return self.children.get(tuple(state))
+
+    def get_canonical_key(self):
+        return canonical_key(self.state)
+
+    def get_action_statistics(self):
+        # visits and values of the actions of the decision node
+        return {child.action: {"visits": child.visits,
+                               "value": child.get_value(),
+                               "max_value": child.max_value}
+                for child in self.children or ()}
+
+
+def ucb1(visits, child, exploration, bounds, prior):
+    if child.visits == 0:
+        return math.inf
+    return (normalize(child.get_value(), bounds) +
+            exploration * math.sqrt(math.log(visits) / child.visits))
+
 
-def expand(root, game):
+def puct(visits, child, exploration, bounds, prior):
+    return (normalize(child.get_value(), bounds) +
+            exploration * prior * math.sqrt(visits) / (1 + child.visits))
+
+
+selection_rules = {"ucb1": ucb1, "puct": puct}
+
+
+def normalize(value, bounds):
+    # scores are unbounded, values are scaled to [0, 1] by the smallest and
+    # the largest value seen in the tree so that the exploration constant does
+    # not depend on the stage of the game
+    low, high = bounds
+    if high <= low:
+        return 0.5
+    return (value - low) / (high - low)
+
+
+def select(node, exploration, bounds, rule=ucb1, rng=random):
+    # uniform prior over the children, ties are broken by rng
+    children = node.children
+    prior = 1 / len(children)
+    visits = node.visits
+    best_children = []
+    best_value = -math.inf
+    for child in children:
+        value = rule(visits, child, exploration, bounds, prior)
+        if value > best_value:
+            best_children = [child]
+            best_value = value
+        elif value == best_value:
+            best_children.append(child)
+    return rng.choice(best_children)
+
+
+def expand(root, game, exploration=1.0, bounds=(0, 0), rule=ucb1):
     # traverse the tree down from the root until not fully expanded node found
-    # and expand this node - return new unvisited leaf
-    # TODO what if the selected node is terminal?
+    # and expand this node - return new unvisited leaf (decision node)
+    # if the traversal ends in a terminal node, the terminal node is returned
+    # to be evaluated again
     node = root
-    while not node.is_terminal and node.is_expanded:
-        # select best child according to UCB1
-        node = None
-    leaf = node.get_unvisited_child()
-    return leaf
+    while True:
+        if node.is_chance:
+            node, is_new = node.sample_child(game)
+            if is_new:
+                return node
+        elif node.is_terminal:
+            return node
+        elif not node.is_expanded:
+            leaf = node.get_unvisited_child(game)
+            if leaf is None:
+                return node
+            # the new chance node is evaluated through its first sampled state
+            node, _ = leaf.sample_child(game)
+            return node
+        else:
+            node = select(node, exploration, bounds, rule, game.rng)
+
+
+def evaluate(leaf, game, rollout_policy=None):
+    # perform playout simulation from the state of the leaf with the rollout
+    # policy (random moves drawn from the rng of the game if None), returns
+    # the final score
+    leaf.set_game(game)
+    while True:
+        if rollout_policy is None:
+            actions = game.get_possible_actions()
+            action = game.rng.choice(actions) if actions else None
+        else:
+            action = rollout_policy.get_action(game, None)
+        if action is None:
+            return game.get_value()
+        game.accept(action)
+
+
+def backpropagate(node, value):
+    node.backpropagate(value)
+
+
+# batches of at least this many leaves of a tree store are backpropagated
+# with numpy
+vectorized_backpropagation = 32
+
+
+def backpropagate_many(leaves, values):
+    if (len(leaves) >= vectorized_backpropagation and
+            isinstance(leaves[0], Node)):
+        leaves[0].store.backpropagate_many([leaf.index for leaf in leaves],
+                                           values)
+    else:
+        for leaf, value in zip(leaves, values):
+            leaf.backpropagate(value)
+
+
+# leaf evaluators - evaluate(leaves, game) returns the estimates of the final
+# scores of the games from the states of a batch of leaves (Tree or Node),
+# the game is a scratch game of the search that can be set to any state
+
+class RolloutEvaluator:
+    # final score of a playout to the end of the game
+    #   rollout_policy - policy of the playouts (random moves if None), any
+    #     policy with get_action(game, model)
+
+    def __init__(self, rollout_policy=None):
+        self.rollout_policy = rollout_policy
+
+    def evaluate(self, leaves, game):
+        return [evaluate(leaf, game, self.rollout_policy) for leaf in leaves]
+
+
+class TruncatedRolloutEvaluator:
+    # score after a playout of at most depth moves plus the heuristic value
+    # of the state the playout is cut off at (no heuristic value if the game
+    # ends)
+    #   heuristic - function of (state, size) or a name from two048.heuristics
+
+    def __init__(self, depth=10, heuristic="combined", rollout_policy=None):
+        self.depth = depth
+        self.heuristic = get_heuristic(heuristic)
+        self.rollout_policy = rollout_policy
+
+    def evaluate(self, leaves, game):
+        values = []
+        for leaf in leaves:
+            leaf.set_game(game)
+            for _ in range(self.depth):
+                if self.rollout_policy is None:
+                    actions = game.get_possible_actions()
+                    action = game.rng.choice(actions) if actions else None
+                else:
+                    action = self.rollout_policy.get_action(game, None)
+                if action is None:
+                    break
+                game.accept(action)
+            value = game.get_value()
+            if not game.is_finished():
+                value += self.heuristic(game.get_state(), game.size)
+            values.append(value)
+        return values
+
+
+class HeuristicEvaluator(TruncatedRolloutEvaluator):
+    # score of the leaf plus the heuristic value of its state, no playout
+
+    def __init__(self, heuristic="combined"):
+        super().__init__(depth=0, heuristic=heuristic)
+
+
+class ValueEvaluator:
+    # score of the leaf plus a learned value of its state: the best sum of
+    # the 2048 score of a move and the value of its afterstate (0 if the game
+    # ends), the afterstates of all the leaves of the batch are valued in a
+    # single call (requires numpy)
+    #   model - afterstate value model with evaluate(boards) that returns the
+    #     values of the (N, size * size) array of the boards, e.g.
+    #     two048.ntuple.NTupleNetwork, or the path of saved n-tuple weights
+
+    def __init__(self, model):
+        if isinstance(model, str):
+            from two048.ntuple import NTupleNetwork
+
+            model = NTupleNetwork.load(model)
+        self.model = model
+
+    def evaluate(self, leaves, game):
+        import numpy as np
+        from two048.batch import legal_actions, move_boards
+
+        lines = np.array([game.index_sequences[action]
+                          for action in game.ActionSpace], dtype=np.intp)
+        boards = np.array([leaf.state for leaf in leaves], dtype=np.uint8)
+        num_actions = len(lines)
+        moved, rewards = move_boards(
+            np.repeat(boards, num_actions, axis=0),
+            np.tile(np.arange(num_actions), len(boards)), lines)
+        legal = legal_actions(boards, lines)
+        values = np.where(legal.ravel(), rewards + self.model.evaluate(moved),
+                          -np.inf).reshape(legal.shape).max(axis=1)
+        values[~legal.any(axis=1)] = 0
+        return [leaf.score + value for leaf, value in zip(leaves, values)]
+
+
+def count_nodes(root):
+    # number of the nodes of the tree
+    if isinstance(root, Node):
+        return root.store.size
+    nodes = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        children = node.children
+        if isinstance(children, dict):
+            children = children.values()
+        stack.extend(children or ())
+    return nodes
+
+
+# node flags of the tree store
+CHANCE = 1
+GENERATED = 2  # children of the decision node are generated
+EXPANDED = 4
+TERMINAL = 8
 
 
-def evaluate(leaf):
-    # perform playout simulation or in some other way evaluate the unvisited
-    # tree node
-    # returns statistics
-    pass
+class TreeStore:
+    # arena of the search tree nodes: node data lives in preallocated typed
+    # buffers indexed by the node index, the buffers grow geometrically
+    #
+    # children of a decision node are allocated together and occupy
+    # first_child .. first_child + num_children - 1, children of a chance node
+    # are added as they are sampled and linked through next_sibling
+    # states are stored as packed boards (4 bits per tile, see
+    # two048.game.pack_board), in a 64 bit buffer for boards of up to 16
+    # tiles and in a list of python ints for the larger boards, the first
+    # state with a tile that does not fit into 4 bits switches the store to a
+    # list of state tuples (packed is False)
 
+    def __init__(self, num_tiles, action_space, capacity=1024):
+        self.num_tiles = num_tiles
+        self.action_space = action_space
+        self.size = 0
+        self.capacity = 0
+        self.visits = array("q")
+        self.value_sum = array("d")
+        self.max_value = array("d")
+        self.score = array("q")
+        self.parent = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.num_children = array("B")
+        self.visited_children = array("B")
+        self.action = array("B")
+        self.flags = array("B")
+        self.keys = array("Q") if num_tiles <= 16 else []
+        self.packed = True
+        self.grow(capacity)
 
-def backpropagate(node):
-    statistics = node.statistics
-    node = node.parent
-    while node is not None:
-        node.update(statistics)
-        node = node.parent
+    def buffers(self):
+        return (self.visits, self.value_sum, self.max_value, self.score,
+                self.parent, self.first_child, self.next_sibling,
+                self.num_children, self.visited_children, self.action,
+                self.flags, self.keys)
 
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        for buffer in self.buffers():
+            if isinstance(buffer, array):
+                buffer.frombytes(bytes(extra * buffer.itemsize))
+            else:
+                buffer.extend([0] * extra)
+        self.capacity = capacity
+
+    def add_node(self, state, score, parent=-1, action=0, flags=0):
+        if self.size == self.capacity:
+            self.grow(2 * self.capacity)
+        index = self.size
+        self.size += 1
+        self.keys[index] = self.get_key(state)
+        self.score[index] = score
+        self.parent[index] = parent
+        self.first_child[index] = -1
+        self.next_sibling[index] = -1
+        self.action[index] = action
+        self.flags[index] = flags
+        return index
+
+    def get_key(self, state):
+        if self.packed:
+            try:
+                return pack_board(state)
+            except ValueError:
+                self.unpack_keys()
+        return tuple(state)
+
+    def unpack_keys(self):
+        self.keys = [tuple(unpack_board(key, self.num_tiles))
+                     for key in self.keys[:self.size]]
+        self.keys.extend([None] * (self.capacity - self.size))
+        self.packed = False
+
+    def get_state(self, index):
+        if self.packed:
+            return unpack_board(self.keys[index], self.num_tiles)
+        return list(self.keys[index])
+
+    def find_child(self, index, state):
+        # sampled decision node of the chance node by its state
+        key = self.get_key(state)
+        child = self.first_child[index]
+        while child >= 0:
+            if self.keys[child] == key:
+                return child
+            child = self.next_sibling[child]
+        return -1
+
+    def children(self, index):
+        child = self.first_child[index]
+        if self.flags[index] & CHANCE:
+            children = []
+            while child >= 0:
+                children.append(child)
+                child = self.next_sibling[child]
+            return children
+        return range(child, child + self.num_children[index])
+
+    def update(self, index, value):
+        if not self.visits[index] or value > self.max_value[index]:
+            self.max_value[index] = value
+        self.visits[index] += 1
+        self.value_sum[index] += value
+
+    def backpropagate(self, index, value):
+        parent = self.parent
+        while index >= 0:
+            self.update(index, value)
+            index = parent[index]
+
+    def backpropagate_many(self, indices, values):
+        # backpropagate the values of many leaves at once, the statistics of
+        # all the nodes on the paths are updated with numpy in one pass per
+        # tree level
+        import numpy as np
+
+        indices = np.array(indices, dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        size = self.size
+        # the views have to be released before the buffers can grow again
+        visits = np.frombuffer(self.visits, dtype=np.int64)[:size]
+        value_sum = np.frombuffer(self.value_sum, dtype=np.float64)[:size]
+        max_value = np.frombuffer(self.max_value, dtype=np.float64)[:size]
+        parent = np.frombuffer(self.parent, dtype=np.int32)[:size]
+        while len(indices):
+            first_visit = visits[indices] == 0
+            max_value[indices[first_visit]] = values[first_visit]
+            np.add.at(visits, indices, 1)
+            np.add.at(value_sum, indices, values)
+            np.maximum.at(max_value, indices, values)
+            indices = parent[indices].astype(np.int64)
+            values = values[indices >= 0]
+            indices = indices[indices >= 0]
+        del visits, value_sum, max_value, parent
+
+    def extract(self, index):
+        # new store with the subtree of the node (the node becomes the root),
+        # used to drop the rest of the tree when the search moves on
+        store = TreeStore(self.num_tiles, self.action_space,
+                          capacity=max(1024, self.capacity))
+        mapping = {index: store.add_node(self.get_state(index),
+                                         self.score[index],
+                                         flags=self.flags[index])}
+        queue = [index]
+        while queue:
+            old = queue.pop()
+            new = mapping[old]
+            store.visits[new] = self.visits[old]
+            store.value_sum[new] = self.value_sum[old]
+            store.max_value[new] = self.max_value[old]
+            store.num_children[new] = self.num_children[old]
+            store.visited_children[new] = self.visited_children[old]
+            children = list(self.children(old))
+            if not children:
+                continue
+            # decision children have to stay contiguous and chance children
+            # keep their sibling order
+            previous = -1
+            for child in children:
+                new_child = store.add_node(
+                    self.get_state(child), self.score[child], new,
+                    self.action[child], self.flags[child])
+                mapping[child] = new_child
+                if previous < 0:
+                    store.first_child[new] = new_child
+                else:
+                    store.next_sibling[previous] = new_child
+                previous = new_child
+                queue.append(child)
+        return store
+
+    def memory_size(self):
+        # bytes used by the node buffers
+        return sum(buffer.itemsize * len(buffer) if isinstance(buffer, array)
+                   else 8 * len(buffer) for buffer in self.buffers())
+
+
+class Node:
+    # thin view of a node of the tree store with the interface of Tree
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other):
+        return (isinstance(other, Node) and other.store is self.store and
+                other.index == self.index)
+
+    def __hash__(self):
+        return hash(self.index)
+
+    @property
+    def state(self):
+        return self.store.get_state(self.index)
+
+    @property
+    def score(self):
+        return self.store.score[self.index]
+
+    @property
+    def parent(self):
+        parent = self.store.parent[self.index]
+        return Node(self.store, parent) if parent >= 0 else None
+
+    @property
+    def action(self):
+        action = self.store.action[self.index]
+        return self.store.action_space(action) if action else None
+
+    @property
+    def is_chance(self):
+        return bool(self.store.flags[self.index] & CHANCE)
+
+    @property
+    def is_expanded(self):
+        return bool(self.store.flags[self.index] & EXPANDED)
+
+    @property
+    def is_terminal(self):
+        return bool(self.store.flags[self.index] & TERMINAL)
+
+    @property
+    def visits(self):
+        return self.store.visits[self.index]
+
+    @property
+    def value_sum(self):
+        return self.store.value_sum[self.index]
+
+    @property
+    def max_value(self):
+        if not self.store.visits[self.index]:
+            return None
+        return self.store.max_value[self.index]
+
+    @property
+    def children(self):
+        store = self.store
+        if not store.flags[self.index] & (CHANCE | GENERATED):
+            return None
+        return [Node(store, child) for child in store.children(self.index)]
+
+    def get_value(self):
+        visits = self.store.visits[self.index]
+        return self.store.value_sum[self.index] / visits if visits else 0
+
+    def update(self, value):
+        self.store.update(self.index, value)
+
+    def backpropagate(self, value):
+        self.store.backpropagate(self.index, value)
+
+    def set_game(self, game):
+        game.set_state(self.store.get_state(self.index))
+        game.set_value(self.store.score[self.index])
+
+    def generate_children(self, game):
+        store = self.store
+        index = self.index
+        state = store.get_state(index)
+        score = store.score[index]
+        game.set_state(state[:])
+        game.set_value(score)
+        actions = game.get_possible_actions()
+        first_child = store.size
+        for action in actions:
+            game.set_state(state[:])
+            game.set_value(score)
+            game.change_state(action)
+            game.update_score()
+            store.add_node(game.get_state(), game.get_value(), index,
+                           action.value, CHANCE)
+        store.num_children[index] = len(actions)
+        store.flags[index] |= GENERATED
+        if actions:
+            store.first_child[index] = first_child
+        else:
+            store.flags[index] |= TERMINAL | EXPANDED
+
+    def get_unvisited_child(self, game):
+        store = self.store
+        index = self.index
+        if not store.flags[index] & GENERATED:
+            self.generate_children(game)
+        if store.flags[index] & TERMINAL:
+            return None
+        visited = store.visited_children[index]
+        store.visited_children[index] = visited + 1
+        if visited + 1 == store.num_children[index]:
+            store.flags[index] |= EXPANDED
+        return Node(store, store.first_child[index] + visited)
+
+    def sample_child(self, game):
+        store = self.store
+        index = self.index
+        self.set_game(game)
+        game.generate_tile()
+        state = game.get_state()
+        child = store.find_child(index, state)
+        if child >= 0:
+            return Node(store, child), False
+        child = store.add_node(state, store.score[index], index)
+        store.next_sibling[child] = store.first_child[index]
+        store.first_child[index] = child
+        return Node(store, child), True
+
+    def find_child(self, state):
+        child = self.store.find_child(self.index, state)
+        return Node(self.store, child) if child >= 0 else None
+
+    def get_canonical_key(self):
+        store = self.store
+        if store.packed and store.num_tiles == 16:
+            return canonical_key(store.keys[self.index])
+        return canonical_key(store.get_state(self.index))
+
+    def get_action_statistics(self):
+        return {child.action: {"visits": child.visits,
+                               "value": child.get_value(),
+                               "max_value": child.max_value}
+                for child in self.children or ()}
+
+
+class MCTS:
+    # Monte Carlo tree search policy
+    #   iterations - number of playouts per move
+    #   time_budget_ms - time budget of a move (None - no limit), the search
+    #     stops after the iteration that runs out of time (or after
+    #     iterations)
+    #   exploration - exploration constant of the selection rule (values are
+    #     normalized to [0, 1])
+    #   selection - "ucb1" or "puct"
+    #   rollout_policy - policy of the playouts (random moves if None), any
+    #     policy with get_action(game, model)
+    #   evaluator - leaf evaluator (None - RolloutEvaluator(rollout_policy))
+    #   batch_size - number of leaves that are selected before they are
+    #     evaluated and backpropagated together (leaves of a batch are
+    #     selected with the statistics of the previous batches)
+    #   reuse_tree - keep the subtree of the observed state between the moves
+    #   compact - keep the nodes in a TreeStore instead of Tree objects
+    #   transpositions - two048.transposition.TranspositionTable shared by the
+    #     searches (None - no sharing), it keeps the playout score gains of
+    #     the leaves by their canonical board, a leaf whose board has at least
+    #     transposition_samples playouts in the table is evaluated by their
+    #     average instead of a new playout
+    #   rng - source of the new tiles, the playouts and the tie breaks of the
+    #     search (None - the rng of the game)
+    #   stats - keep the report of the last decision in report (see
+    #     two048.stats.decision_report, None without stats), nodes are the
+    #     nodes of the tree after the search
+    # the action with the most visits is chosen
+
+    def __init__(self, iterations=1000, exploration=1.0, selection="ucb1",
+                 rollout_policy=None, reuse_tree=True, compact=True,
+                 transpositions=None, transposition_samples=8,
+                 time_budget_ms=None, rng=None, evaluator=None,
+                 batch_size=1, stats=False):
+        self.iterations = iterations
+        self.time_budget_ms = time_budget_ms
+        self.exploration = exploration
+        self.selection = selection
+        self.rollout_policy = rollout_policy
+        self.evaluator = evaluator
+        self.batch_size = batch_size
+        self.reuse_tree = reuse_tree
+        self.compact = compact
+        self.transpositions = transpositions
+        self.transposition_samples = transposition_samples
+        self.rng = rng
+        self.stats = stats
+        self.report = None
+        self.root = None
+        self.bounds = None
+
+    def configure(self, iterations=None, exploration=None, selection=None,
+                  rollout_policy=None, reuse_tree=None, compact=None,
+                  transpositions=None, transposition_samples=None,
+                  time_budget_ms=None, rng=None, evaluator=None,
+                  batch_size=None, stats=None):
+        if iterations is not None:
+            self.iterations = iterations
+        if time_budget_ms is not None:
+            self.time_budget_ms = time_budget_ms
+        if exploration is not None:
+            self.exploration = exploration
+        if selection is not None:
+            self.selection = selection
+        if rollout_policy is not None:
+            self.rollout_policy = rollout_policy
+        if evaluator is not None:
+            self.evaluator = evaluator
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if stats is not None:
+            self.stats = stats
+        if reuse_tree is not None:
+            self.reuse_tree = reuse_tree
+        if compact is not None:
+            self.compact = compact
+        if transpositions is not None:
+            self.transpositions = transpositions
+        if transposition_samples is not None:
+            self.transposition_samples = transposition_samples
+        if rng is not None:
+            self.rng = rng
+
+    def get_root(self, game):
+        # subtree of the observed state if the previous move of this policy
+        # led to it, new tree otherwise
+        state = game.get_state()
+        root = self.root
+        if (self.reuse_tree and root is not None and
+                isinstance(root, Node) == self.compact):
+            root = root.find_child(state)
+            if root is not None and root.score == game.get_value():
+                if self.compact:
+                    return Node(root.store.extract(root.index), 0)
+                root.parent = None
+                return root
+        self.bounds = None
+        if self.compact:
+            store = TreeStore(len(state), game.ActionSpace)
+            return Node(store, store.add_node(state, game.get_value()))
+        return Tree(state, game.get_value())
+
+    def get_action(self, game, _):
+        self.report = None
+        if self.stats:
+            start = time.perf_counter()
+            engine_stats = Stats()
+            scratch_game = instrument(game, engine_stats)
+        else:
+            scratch_game = game.clone()
+        root = self.get_root(game)
+        if self.rng is not None:
+            scratch_game.rng = self.rng
+        if root.children is None:
+            root.generate_children(scratch_game)
+        if root.is_terminal:
+            self.root = None
+            return None
+        rule = selection_rules[self.selection]
+        bounds = self.bounds
+        deadline = None
+        if self.time_budget_ms is not None:
+            deadline = time.perf_counter() + self.time_budget_ms / 1000
+        iterations = 0
+        while iterations < self.iterations:
+            leaves = [expand(root, scratch_game, self.exploration,
+                             bounds or (0, 0), rule)
+                      for _ in range(min(self.batch_size,
+                                         self.iterations - iterations))]
+            values = self.evaluate(leaves, scratch_game)
+            backpropagate_many(leaves, values)
+            iterations += len(leaves)
+            if bounds is None:
+                bounds = (min(values), max(values))
+            else:
+                bounds = (min(bounds[0], min(values)),
+                          max(bounds[1], max(values)))
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        self.bounds = bounds
+        best_child = max(root.children,
+                         key=lambda child: (child.visits, child.get_value()))
+        # the chance node is the root of the next search
+        self.root = best_child
+        if self.stats:
+            self.report = decision_report(
+                self, best_child.action, time.perf_counter() - start,
+                root.get_action_statistics(), engine_stats,
+                iterations=iterations, nodes=count_nodes(root))
+        return best_child.action
 
+    def evaluate(self, leaves, game):
+        # values of the leaves, the leaves without enough samples in the
+        # transposition table are evaluated together by the evaluator
+        evaluator = self.evaluator
+        if evaluator is None:
+            evaluator = RolloutEvaluator(self.rollout_policy)
+        table = self.transpositions
+        if table is None:
+            return evaluator.evaluate(leaves, game)
+        # the table keeps the score gained after the leaf, the same board can
+        # be reached with different scores
+        values = [None] * len(leaves)
+        entries = []
+        # entries stored by this batch (a batch can have the same board twice)
+        new_entries = {}
+        for i, leaf in enumerate(leaves):
+            key = leaf.get_canonical_key()
+            entry = table.get(key)
+            if entry is not None and entry[0] >= self.transposition_samples:
+                values[i] = leaf.score + entry[1] / entry[0]
+            else:
+                entries.append((i, key, entry))
+        evaluated = evaluator.evaluate([leaves[i] for i, _, _ in entries],
+                                       game) if entries else []
+        for (i, key, entry), value in zip(entries, evaluated):
+            values[i] = value
+            gain = value - leaves[i].score
+            if entry is None:
+                entry = new_entries.get(key)
+            if entry is None:
+                new_entries[key] = table.put(key, gain)
+            else:
+                entry[0] += 1
+                entry[1] += gain
+        return values
@@ -1,44 +1,580 @@
-import random
+import math
+import time
 import agent
+from two048.game import AfterstateCache, RandomStream, draw_seed
+from two048.heuristics import get_heuristic
+from two048.stats import (Stats, decision_report, instrument,
+                          sample_statistics)
+from two048.transposition import canonical_key
 
 
 class Random:
+    # rng: source of the moves, random.Random or two048.game.RandomStream
+    #   instance (None - the rng of the game)
+    def __init__(self, rng=None):
+        self.rng = rng
+
     def get_action(self, game, _):
         actions = game.get_possible_actions()
-        return random.choice(actions) if actions else None
+        if not actions:
+            return None
+        rng = game.rng if self.rng is None else self.rng
+        return rng.choice(actions)
+
+
+# boards of this size and up play the playouts of PureMCTS in batches by
+# default, a move of the list engine visits every cell in python while a
+# batch moves all its boards with a few numpy operations (see the large.*
+# benchmarks of two048.bench)
+batched_size = 8
 
 
 class PureMCTS:
-    def __init__(self, samples=100):
+    # samples: number of random playouts per action
+    # batched: play the playouts of all actions in lockstep as one
+    #   two048.batch.BatchGame instead of game by game (requires numpy),
+    #   None - batched on the boards of batched_size and up
+    # workers: number of processes the playouts of a decision are sharded
+    #   across (None - play in this process), the process pool is persistent
+    #   and shared by all the policies with the same number of workers
+    # time_budget_ms: time budget of a move (None - no limit), the playouts
+    #   are played in rounds of round_samples per action and the clock is
+    #   checked between the rounds, samples is the upper limit of the playouts
+    #   per action (the first round is always played)
+    # racing: after every round drop the actions whose confidence interval
+    #   (mean +- confidence standard errors) lies below the interval of
+    #   another action, the search stops when one action is left
+    # rng: source of the playouts and of the tie breaks (None - the rng of
+    #   the game), the seeds of the batched playouts and of the worker shards
+    #   are drawn from it
+    # stats: keep the report of the last decision in report (see
+    #   two048.stats.decision_report, None without stats), the engine
+    #   operations of the playouts are counted and timed only when they are
+    #   played in this process game by game
+    # afterstates: capacity of the two048.game.AfterstateCache shared by the
+    #   playouts of a decision when they are played in this process game by
+    #   game (None - no cache), a game that has its own cache (kept for the
+    #   whole game) uses it instead, the random playouts of midgame states
+    #   rarely meet a board twice (about 1% hits), so the cache pays off only
+    #   when the moves are expensive or the playouts are short
+    def __init__(self, samples=100, batched=None, workers=None,
+                 time_budget_ms=None, racing=False, round_samples=10,
+                 confidence=2.0, rng=None, stats=False, afterstates=None):
         self.samples = samples
-        self.playout_policy = Random()
+        self.batched = batched
+        self.workers = workers
+        self.time_budget_ms = time_budget_ms
+        self.racing = racing
+        self.round_samples = round_samples
+        self.confidence = confidence
+        self.rng = rng
+        self.stats = stats
+        self.afterstates = afterstates
+        self.report = None
 
-    def configure(self, samples=None):
+    def configure(self, samples=None, batched=None, workers=None,
+                  time_budget_ms=None, racing=None, round_samples=None,
+                  confidence=None, rng=None, stats=None, afterstates=None):
         if samples is not None:
             self.samples = samples
+        if batched is not None:
+            self.batched = batched
+        if workers is not None:
+            self.workers = workers
+        if time_budget_ms is not None:
+            self.time_budget_ms = time_budget_ms
+        if racing is not None:
+            self.racing = racing
+        if round_samples is not None:
+            self.round_samples = round_samples
+        if confidence is not None:
+            self.confidence = confidence
+        if rng is not None:
+            self.rng = rng
+        if stats is not None:
+            self.stats = stats
+        if afterstates is not None:
+            self.afterstates = afterstates
 
     def get_action(self, game, _):
+        self.report = None
         actions = game.get_possible_actions()
         if not actions:
             return None
+        in_process = not self.workers and not self.is_batched(game)
+        if (in_process and self.afterstates is not None and
+                game.afterstates is None):
+            game = game.clone()
+            game.afterstates = AfterstateCache(self.afterstates)
+        if self.stats:
+            start = time.perf_counter()
+            engine_stats = None
+            if in_process:
+                engine_stats = Stats()
+                game = instrument(game, engine_stats)
+        if self.time_budget_ms is None and not self.racing:
+            scores = self.play(game, actions, [self.samples] * len(actions))
+            candidates = range(len(actions))
+        else:
+            scores, candidates = self.race(game, actions)
+        action = self.choose(game, actions, scores, candidates)
+        if self.stats:
+            playouts = sum(len(action_scores) for action_scores in scores)
+            self.report = decision_report(
+                self, action, time.perf_counter() - start,
+                {action: sample_statistics(action_scores)
+                 for action, action_scores in zip(actions, scores)},
+                engine_stats, playouts=playouts)
+            if in_process and game.afterstates is not None:
+                self.report["afterstates"] = game.afterstates.get_report()
+        return action
+
+    def get_actions(self, games):
+        # actions of many games (None for the finished games), the batched
+        # playouts of all the games are played as one batch (see
+        # agent.play_many)
+        if (not games or not self.is_batched(games[0]) or self.workers or
+                self.racing or self.stats or self.time_budget_ms is not None):
+            return [self.get_action(game, None) for game in games]
+        all_actions = [game.get_possible_actions() for game in games]
+        playout_games = [game for game, actions in zip(games, all_actions)
+                         for _ in actions]
+        if not playout_games:
+            return [None] * len(games)
+        scores = play_batched(
+            playout_games, [action for actions in all_actions
+                            for action in actions],
+            [self.samples] * len(playout_games),
+            self.get_rng(playout_games[0]))
+        chosen = []
+        start = 0
+        for game, actions in zip(games, all_actions):
+            if not actions:
+                chosen.append(None)
+                continue
+            chosen.append(self.choose(game, actions,
+                                      scores[start:start + len(actions)],
+                                      range(len(actions))))
+            start += len(actions)
+        return chosen
+
+    def choose(self, game, actions, scores, candidates):
+        # candidate action with the largest average score (ties are broken
+        # randomly)
         max_value = 0
         best_actions = []
+        for i in candidates:
+            value = sum(scores[i]) / len(scores[i]) if scores[i] else 0
+            if value == max_value:
+                best_actions.append(actions[i])
+            elif value > max_value:
+                best_actions = [actions[i]]
+                max_value = value
+        return self.get_rng(game).choice(best_actions)
+
+    def get_rng(self, game):
+        return game.rng if self.rng is None else self.rng
+
+    def race(self, game, actions):
+        # play the playouts in rounds until the time budget or the samples are
+        # exhausted (or until racing leaves a single action)
+        # returns the scores of the playouts and the indices of the remaining
+        # actions
+        deadline = None
+        if self.time_budget_ms is not None:
+            deadline = time.perf_counter() + self.time_budget_ms / 1000
+        scores = [[] for _ in actions]
+        remaining = list(range(len(actions)))
+        while len(remaining) > 1 or not scores[remaining[0]]:
+            samples = [min(self.round_samples, self.samples - len(scores[i]))
+                       for i in remaining]
+            if not any(samples):
+                break
+            round_start = time.perf_counter()
+            round_scores = self.play(game, [actions[i] for i in remaining],
+                                     samples)
+            for i, action_scores in zip(remaining, round_scores):
+                scores[i] += action_scores
+            if self.racing:
+                remaining = self.eliminate(scores, remaining)
+            # the next round is not started if it would not finish in time
+            now = time.perf_counter()
+            if deadline is not None and 2 * now - round_start >= deadline:
+                break
+        return scores, remaining
+
+    def eliminate(self, scores, remaining):
+        intervals = {}
+        for i in remaining:
+            if len(scores[i]) < 2:
+                return remaining
+            mean, half_width = confidence_interval(scores[i], self.confidence)
+            intervals[i] = (mean - half_width, mean + half_width)
+        best_lower = max(lower for lower, _ in intervals.values())
+        return [i for i in remaining if intervals[i][1] >= best_lower]
+
+    def play(self, game, actions, samples):
+        if self.workers:
+            return self.play_parallel(game, actions, samples)
+        return play(game, actions, samples, self.is_batched(game),
+                    self.get_rng(game))
+
+    def is_batched(self, game):
+        if self.batched is None:
+            return game.size >= batched_size
+        return self.batched
+
+    def play_parallel(self, game, actions, samples):
+        # split the playouts into one shard per worker, every shard gets its
+        # own seed drawn from the rng, so that the result is reproducible for
+        # the same seed and the same number of workers
+        seeds = RandomStream(draw_seed(self.get_rng(game)))
+        state = game.get_state()
+        futures = []
+        for shard_samples in split_samples(samples, self.workers):
+            futures.append(get_pool(self.workers).submit(
+                play_shard, type(game), state, game.get_value(), game.size,
+                game.p4, game.scoring, [action.value for action in actions],
+                shard_samples, self.is_batched(game), seeds.getrandbits(64)))
+        scores = [[] for _ in actions]
+        for future in futures:
+            for i, shard_scores in enumerate(future.result()):
+                scores[i] += shard_scores
+        return scores
+
+
+def confidence_interval(values, confidence):
+    # mean and half width of the interval of confidence standard errors
+    count = len(values)
+    mean = sum(values) / count
+    variance = sum((value - mean) ** 2 for value in values) / (count - 1)
+    return mean, confidence * math.sqrt(variance / count)
+
+
+class NTupleValue:
+    # one ply search with a learned value of the afterstates (boards after a
+    # move, before the new tile): the action with the largest sum of the score
+    # of the move and the value of its afterstate (requires numpy)
+    #   network - two048.ntuple.NTupleNetwork or the path of its saved weights
+    #     (memory mapped read only, see two048.ntuple)
+    #   rng - source of the tie breaks (None - the rng of the game)
+
+    def __init__(self, network, rng=None):
+        from two048.ntuple import NTupleNetwork
+
+        if isinstance(network, str):
+            network = NTupleNetwork.load(network)
+        self.network = network
+        self.rng = rng
+
+    def get_action(self, game, _):
+        return self.get_actions([game])[0]
+
+    def get_actions(self, games):
+        # actions of many games (None for the finished games), the
+        # afterstates of all the games are valued in one call of the network
+        # (see agent.play_many)
+        import numpy as np
+
+        all_actions = []
+        after_states = []
+        rewards = []
+        for game in games:
+            actions = game.get_possible_actions()
+            all_actions.append(actions)
+            for action in actions:
+                after_game = game.clone()
+                after_game.change_state(action)
+                after_states.append(after_game.get_state())
+                rewards.append(after_game.delta)
+        if not after_states:
+            return [None] * len(games)
+        values = np.add(rewards, self.network.evaluate(
+            np.array(after_states, dtype=np.uint8))).tolist()
+        chosen = []
+        start = 0
+        for game, actions in zip(games, all_actions):
+            if not actions:
+                chosen.append(None)
+                continue
+            game_values = values[start:start + len(actions)]
+            start += len(actions)
+            max_value = max(game_values)
+            best_actions = [action for action, value
+                            in zip(actions, game_values) if value == max_value]
+            rng = game.rng if self.rng is None else self.rng
+            chosen.append(rng.choice(best_actions))
+        return chosen
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Expectimax:
+    # depth limited expectimax search: max nodes over the actions, chance
+    # nodes over the empty positions and the new tiles weighted by their
+    # probabilities (see Game.get_new_tiles)
+    #   depth - number of moves to look ahead, including the chosen move
+    #   heuristic - static evaluation added to the score at the leaves, a
+    #     function of (state, size) or a name from two048.heuristics
+    #   min_probability - chance nodes reached with a smaller probability are
+    #     evaluated by the heuristic instead of being expanded
+    #   time_budget_ms - time budget of a move (None - no limit), the search
+    #     is deepened one move at a time up to depth and the action of the
+    #     deepest completed search is returned
+    #   transpositions - two048.transposition.TranspositionTable that keeps
+    #     the values of the chance nodes between the searches (None - values
+    #     are memoized within one search only)
+    #   rng - source of the tie breaks (None - the rng of the game)
+    #   stats - keep the report of the last decision in report (see
+    #     two048.stats.decision_report, None without stats), the values of
+    #     the actions are those of the deepest completed search, nodes are
+    #     the chance nodes that were expanded
+    # values of the chance nodes are memoized by the canonical board as the
+    # score gained after the node, so they are shared between transpositions
+    # and symmetric boards
+
+    def __init__(self, depth=2, heuristic="combined", min_probability=1e-4,
+                 time_budget_ms=None, transpositions=None, rng=None,
+                 stats=False):
+        self.depth = depth
+        self.heuristic = get_heuristic(heuristic)
+        self.min_probability = min_probability
+        self.time_budget_ms = time_budget_ms
+        self.transpositions = transpositions
+        self.rng = rng
+        self.stats = stats
+        self.report = None
+        self.game = None
+        self.memo = None
+        self.values = None
+        self.deadline = None
+
+    def configure(self, depth=None, heuristic=None, min_probability=None,
+                  time_budget_ms=None, transpositions=None, rng=None,
+                  stats=None):
+        if depth is not None:
+            self.depth = depth
+        if heuristic is not None:
+            self.heuristic = get_heuristic(heuristic)
+        if min_probability is not None:
+            self.min_probability = min_probability
+        if time_budget_ms is not None:
+            self.time_budget_ms = time_budget_ms
+        if transpositions is not None:
+            self.transpositions = transpositions
+        if rng is not None:
+            self.rng = rng
+        if stats is not None:
+            self.stats = stats
+
+    def get_action(self, game, _):
+        self.report = None
+        actions = game.get_possible_actions()
+        if not actions:
+            return None
+        if self.stats:
+            start = time.perf_counter()
+            engine_stats = Stats()
+            self.game = instrument(game, engine_stats)
+            nodes = 0
+            completed_depth = 0
+        else:
+            self.game = game.clone()
+        self.values = None
+        state = game.get_state()
+        score = game.get_value()
+        if self.time_budget_ms is None:
+            self.deadline = None
+            depths = [self.depth]
+        else:
+            self.deadline = time.perf_counter() + self.time_budget_ms / 1000
+            depths = range(1, self.depth + 1)
+        best_action = actions[0]
+        for depth in depths:
+            self.memo = {}
+            try:
+                best_action = self.search(state, score, actions, depth)
+            except SearchTimeout:
+                break
+            finally:
+                if self.stats:
+                    nodes += len(self.memo)
+            if self.stats:
+                completed_depth = depth
+        if self.stats:
+            self.report = decision_report(
+                self, best_action, time.perf_counter() - start,
+                {action: {"value": value}
+                 for action, value in (self.values or {}).items()},
+                engine_stats, nodes=nodes)
+            self.report["depth"] = completed_depth
+        self.game = None
+        self.memo = None
+        return best_action
+
+    def search(self, state, score, actions, depth):
+        max_value = -math.inf
+        best_actions = []
+        values = {}
         for action in actions:
-            value = 0
-            for _ in range(self.samples):
-                playout_game = game.clone()
-                playout_game.accept(action)
-                while not playout_game.is_finished():
-                    agent.interact(self.playout_policy, playout_game)
-                value += playout_game.get_value()
-            value /= self.samples
+            after_state, after_score = self.move(state, score, action)
+            value = self.chance_value(after_state, after_score, depth - 1, 1)
+            values[action] = value
             if value == max_value:
                 best_actions.append(action)
             elif value > max_value:
                 best_actions = [action]
                 max_value = value
-        return random.choice(best_actions)
+        self.values = values
+        rng = self.game.rng if self.rng is None else self.rng
+        return rng.choice(best_actions)
+
+    def move(self, state, score, action):
+        game = self.game
+        game.set_state(state[:])
+        game.set_value(score)
+        game.change_state(action)
+        game.update_score()
+        return game.get_state(), game.get_value()
+
+    def max_value(self, state, score, depth, probability):
+        max_value = None
+        for action in self.game.ActionSpace:
+            after_state, after_score = self.move(state, score, action)
+            if after_state == state:
+                continue
+            value = self.chance_value(after_state, after_score, depth,
+                                      probability)
+            if max_value is None or value > max_value:
+                max_value = value
+        # no heuristic bonus for the terminal states
+        return score if max_value is None else max_value
+
+    def chance_value(self, state, score, depth, probability):
+        empty_indices = [i for i, tile in enumerate(state)
+                         if tile == self.game.empty_tile]
+        if (depth == 0 or probability < self.min_probability or
+                not empty_indices):
+            return score + self.heuristic(state, self.game.size)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        key = canonical_key(state)
+        gain = self.memo.get((key, depth))
+        if gain is not None:
+            return score + gain
+        table = self.transpositions
+        if table is not None:
+            entry = table.get(key)
+            if entry is not None and entry[2] >= depth:
+                return score + entry[1]
+
+        value = 0
+        for tile, tile_probability in self.game.get_new_tiles():
+            if not tile_probability:
+                continue
+            branch_probability = (probability * tile_probability /
+                                  len(empty_indices))
+            for i in empty_indices:
+                state[i] = tile
+                value += tile_probability * self.max_value(
+                    state[:], score, depth - 1, branch_probability)
+                state[i] = self.game.empty_tile
+        value /= len(empty_indices)
+
+        self.memo[(key, depth)] = value - score
+        if table is not None:
+            table.put(key, value - score, depth=depth)
+        return value
+
+
+def play(game, actions, samples, batched, rng):
+    # final scores of the random playouts after each of the actions with the
+    # given number of samples for each action, the new tiles and the moves of
+    # the playouts are drawn from rng
+    if batched:
+        return play_batched([game] * len(actions), actions, samples, rng)
+    playout_policy = Random(rng)
+    scores = []
+    for action, num_samples in zip(actions, samples):
+        action_scores = []
+        for _ in range(num_samples):
+            playout_game = game.clone()
+            playout_game.rng = rng
+            playout_game.accept(action)
+            while not playout_game.is_finished():
+                agent.interact(playout_policy, playout_game)
+            action_scores.append(playout_game.get_value())
+        scores.append(action_scores)
+    return scores
+
+
+def play_batched(games, actions, samples, rng):
+    # playouts of the actions in one batch, games[i] is the game of actions[i]
+    # (the games have to have the same configuration)
+    import numpy as np
+    from two048.batch import BatchGame
+
+    # numpy generator is seeded from rng so that the playouts are reproducible
+    # with the seed of the game
+    rng = np.random.default_rng(draw_seed(rng))
+    game = games[0]
+    playouts = BatchGame(
+        np.repeat([playout_game.get_state() for playout_game in games],
+                  samples, axis=0),
+        size=game.size, probability_of_4=game.p4, scoring=game.scoring,
+        scores=np.repeat([playout_game.get_value() for playout_game in games],
+                         samples))
+    playouts.step(np.repeat([action.value - 1 for action in actions],
+                            samples))
+    playouts.spawn_tiles(rng)
+    scores = playouts.rollout_until_terminal(rng)
+    bounds = np.cumsum(samples)[:-1]
+    return [part.tolist() for part in np.split(scores, bounds)]
+
+
+def play_shard(engine, state, score, size, probability_of_4, scoring,
+               action_values, samples, batched, seed):
+    # playouts of one shard in a worker process, the game is rebuilt from its
+    # configuration instead of pickled with its (large) rules
+    rng = RandomStream(seed)
+    game = engine(size=size, probability_of_4=probability_of_4, state=state,
+                  scoring=scoring, rng=rng)
+    game.set_value(score)
+    actions = [game.ActionSpace(value) for value in action_values]
+    return play(game, actions, samples, batched, rng)
+
+
+def split_samples(samples, num_shards):
+    # split the playouts (samples of every action) into contiguous shards of
+    # nearly equal size, returns the number of samples of every action in each
+    # shard
+    starts = [sum(samples[:i]) for i in range(len(samples) + 1)]
+    total = starts[-1]
+    bounds = [total * i // num_shards for i in range(num_shards + 1)]
+    shards = []
+    for start, stop in zip(bounds, bounds[1:]):
+        shards.append([max(0, min(stop, starts[i + 1]) - max(start, starts[i]))
+                       for i in range(len(samples))])
+    return shards
+
+
+# process pools by the number of workers, shared by all the policies and kept
+# alive between the moves and the games
+pools = {}
+
 
+def get_pool(workers):
+    # multiprocessing is imported only by the policies that use the workers
+    from concurrent.futures import ProcessPoolExecutor
 
+    if workers not in pools:
+        pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return pools[workers]
 
 
+def shutdown_pools():
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
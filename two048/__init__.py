@@ -0,0 +1,51 @@
+import importlib
+
+
+# the game engines and the tools around them, import two048 imports none of
+# the submodules: they are imported when they are first used (two048.batch,
+# two048.display, ... need numpy or matplotlib, a worker that plays games
+# needs only two048.game), e.g.
+#   import two048
+#   game = two048.Game()  # imports two048.game
+#   two048.display.Display()  # imports two048.display and matplotlib
+
+
+submodules = ("batch", "bench", "display", "evaluate", "game", "heuristics",
+              "model", "ntuple", "recorder", "server", "stats", "sweep",
+              "transposition")
+
+# names of the package and their submodules
+exports = {
+    "Game": "game", "BitboardGame": "game", "AfterstateCache": "game",
+    "RandomStream": "game", "derive_seed": "game", "get_engine": "game",
+    "Model": "model",
+    "BatchGame": "batch",
+    "Display": "display", "Renderer": "display",
+    "evaluate_policy": "evaluate",
+    "NTupleNetwork": "ntuple",
+    "TrajectoryRecorder": "recorder", "TrajectoryReader": "recorder",
+    "TranspositionTable": "transposition",
+    "GameServer": "server",
+    "run_sweep": "sweep",
+}
+
+__all__ = sorted(exports)
+
+
+def __getattr__(name):
+    # the submodule or the name exported from it, imported on first use (the
+    # import makes the submodule an attribute of the package, the exported
+    # names are kept in the package)
+    if name in submodules:
+        return importlib.import_module("." + name, __name__)
+    if name in exports:
+        module = importlib.import_module("." + exports[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                   name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(submodules) | set(exports))
@@ -0,0 +1,175 @@
+import numpy as np
+
+from .game import Game, get_rules
+
+
+class BatchGame:
+    # a batch of games with the same configuration played in lockstep
+    #
+    # boards of the games are the rows of (N, size * size) uint8 array in the
+    # same layout as Game.state, actions are given as indices of the members of
+    # Game.ActionSpace (action.value - 1), negative action means that the game
+    # does not move
+    # all operations work on the whole array at once, the cost of a move per
+    # board grows slowly with the size, so the games on large boards (8x8 and
+    # up) are played in batches rather than by a single game engine, e.g. the
+    # playouts of policy.PureMCTS are batched there by default
+
+    def __init__(self, boards, size=4, probability_of_4=0.1, scoring="2048",
+                 scores=0):
+        self.boards = np.array(boards, dtype=np.uint8).reshape(
+            -1, size * size)
+        self.size = size
+        self.p4 = probability_of_4
+        self.scoring = scoring
+        # 2048 scores are accumulated move by move, threes scores are computed
+        # from the boards
+        self.score = np.zeros(len(self.boards), dtype=np.int64)
+        self.score += scores
+        self.move_count = np.zeros(len(self.boards), dtype=np.int64)
+
+        # board indices of the lines (rows or columns ordered in the direction
+        # of the move) for each action: (4, size, size) array
+        index_sequences = get_rules(Game, size, probability_of_4,
+                                    scoring).index_sequences
+        self.lines = np.array([index_sequences[action]
+                               for action in Game.ActionSpace], dtype=np.intp)
+
+    @classmethod
+    def from_game(cls, game, num_games):
+        # num_games copies of the current state of the game
+        return cls(np.tile(game.get_state(), (num_games, 1)), size=game.size,
+                   probability_of_4=game.p4, scoring=game.scoring,
+                   scores=game.get_value())
+
+    def __len__(self):
+        return len(self.boards)
+
+    def step(self, actions):
+        # apply one action per board, returns mask of the boards that changed
+        actions = np.asarray(actions)
+        boards, delta = move_boards(self.boards, actions, self.lines)
+        changed = (boards != self.boards).any(axis=1)
+        self.boards = boards
+        self.score += delta
+        return changed
+
+    def legal_mask(self):
+        # (N, 4) boolean array of the actions that change the boards
+        return legal_actions(self.boards, self.lines)
+
+    def is_finished(self):
+        return ~self.legal_mask().any(axis=1)
+
+    def spawn_tiles(self, rng, mask=None):
+        # place one new tile at a random empty position of every board (or of
+        # the boards selected by the mask)
+        self.boards = spawn_tiles(self.boards, rng, self.p4, mask)
+
+    def scores(self):
+        if self.scoring == "threes":
+            return threes_tile_scores[self.boards].sum(axis=1)
+        return self.score.copy()
+
+    def rollout_until_terminal(self, rng, policy="random"):
+        # play all the games to the end, returns the final scores
+        # policy is "random" or a function that takes (boards, legal mask) and
+        # returns the actions
+        alive = np.arange(len(self.boards))
+        while True:
+            boards = self.boards[alive]
+            legal = legal_actions(boards, self.lines)
+            playing = legal.any(axis=1)
+            if not playing.all():
+                alive = alive[playing]
+                boards = boards[playing]
+                legal = legal[playing]
+            if not len(alive):
+                break
+            if policy == "random":
+                actions = random_actions(legal, rng)
+            else:
+                actions = policy(boards, legal)
+            boards, delta = move_boards(boards, actions, self.lines)
+            self.boards[alive] = spawn_tiles(boards, rng, self.p4)
+            self.score[alive] += delta
+            self.move_count[alive] += 1
+        return self.scores()
+
+
+# threes score of every possible tile (3^(n - 1) - 1 for the tile 2^n)
+threes_tile_scores = np.array(
+    [0] + [pow(3, tile - 1) - 1 for tile in range(1, 40)] + [0] * 216,
+    dtype=np.int64)
+
+
+def slide_lines(lines):
+    # slide the tiles of every line towards its first tile, (M, L) array
+    # returns the moved lines and the 2048 score of the merges of each line
+    # tiles do not merge recursively (see Game.change_state)
+    moved = compact_lines(lines)
+    score = np.zeros(len(lines), dtype=np.int64)
+    for i in range(lines.shape[1] - 1):
+        tile = moved[:, i]
+        merged = (tile != Game.empty_tile) & (tile == moved[:, i + 1])
+        if merged.any():
+            tile += merged
+            moved[merged, i + 1] = Game.empty_tile
+            score += np.left_shift(1, tile.astype(np.int64)) * merged
+    return compact_lines(moved), score
+
+
+def compact_lines(lines):
+    # move the nonempty tiles to the beginning of the lines keeping their order
+    order = np.argsort(lines == Game.empty_tile, axis=1, kind="stable")
+    return np.take_along_axis(lines, order, axis=1)
+
+
+def move_boards(boards, actions, lines):
+    # apply one action per board, returns new boards and score deltas
+    boards = boards.copy()
+    delta = np.zeros(len(boards), dtype=np.int64)
+    selected = np.flatnonzero(actions >= 0)
+    if not len(selected):
+        return boards, delta
+    # lines of every selected board ordered according to its action
+    size = lines.shape[1]
+    rows = selected[:, None, None]
+    indices = lines[actions[selected]]
+    moved, score = slide_lines(boards[rows, indices].reshape(-1, size))
+    boards[rows, indices] = moved.reshape(-1, size, size)
+    delta[selected] = score.reshape(-1, size).sum(axis=1)
+    return boards, delta
+
+
+def legal_actions(boards, lines):
+    # a line changes in a move iff there is a tile behind an empty tile or two
+    # equal adjacent tiles in the direction of the move
+    tiles = boards[:, lines]  # (N, 4, size, size)
+    front = tiles[..., :-1]
+    back = tiles[..., 1:]
+    changed = ((front == Game.empty_tile) & (back != Game.empty_tile) |
+               (front != Game.empty_tile) & (front == back))
+    return changed.any(axis=(2, 3))
+
+
+def random_actions(legal, rng):
+    # uniformly random legal action for each board, -1 if there is none
+    keys = np.where(legal, rng.random(legal.shape), -1.0)
+    actions = keys.argmax(axis=1)
+    actions[~legal.any(axis=1)] = -1
+    return actions
+
+
+def spawn_tiles(boards, rng, probability_of_4, mask=None):
+    # same distribution of new tiles as in Game.generate_tile
+    empty = boards == Game.empty_tile
+    if mask is not None:
+        empty &= np.asarray(mask)[:, None]
+    keys = np.where(empty, rng.random(boards.shape), -1.0)
+    positions = keys.argmax(axis=1)
+    tiles = np.where(rng.random(len(boards)) < probability_of_4, 2, 1)
+    selected = np.flatnonzero(empty.any(axis=1))
+    boards = boards.copy()
+    boards[selected, positions[selected]] = tiles[selected]
+    return boards
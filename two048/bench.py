@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import agent
+import mcts
+import policy
+from .game import Game, BitboardGame, RandomStream
+from .batch import BatchGame, random_actions
+
+
+# performance benchmarks of the engines, the playouts, the search policies
+# and whole games, the results are written as json and can be compared with
+# the results of an earlier run (the baseline)
+#
+# usage from the repository root:
+#   python -m two048.bench --output bench.json
+#   python -m two048.bench --baseline bench.json --tolerance 0.2
+# the exit status is 1 if a benchmark is slower than its baseline by more
+# than the tolerance
+#
+# the startup benchmarks start fresh interpreters, the imports of the modules
+# of the worker processes are included (numpy and matplotlib are not imported
+# by them)
+
+
+engines = {"list": Game, "bitboard": BitboardGame}
+
+
+def measure(run, repeat):
+    # operations per second of the fastest of repeat runs, run plays the
+    # benchmark once and returns the number of operations
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operations = run()
+        rate = operations / (time.perf_counter() - start)
+        if best is None or rate > best:
+            best = rate
+    return best
+
+
+def midgame_states(engine, size, count, seed=0):
+    # states of the games played by random moves (about the first half of a
+    # game), the operations of the engines are measured on them
+    states = []
+    rng = RandomStream(seed)
+    while len(states) < count:
+        game = engine(size=size, rng=rng)
+        while not game.is_finished() and rng.random() > 0.01:
+            game.accept(rng.choice(game.get_possible_actions()))
+            states.append(game.get_state())
+    return states[:count]
+
+
+def engine_benchmarks(engine, count):
+    # the operations of the engine on count states, every state is set with
+    # all four actions (the cost of set_state is included)
+    states = midgame_states(engine, 4, count)
+    game = engine(rng=RandomStream(0))
+    actions = list(game.ActionSpace)
+
+    def change_state():
+        for state in states:
+            for action in actions:
+                game.set_state(state[:])
+                game.change_state(action)
+        return len(states) * len(actions)
+
+    def is_state_changed():
+        for state in states:
+            game.set_state(state[:])
+            for action in actions:
+                game.is_state_changed(action)
+        return len(states) * len(actions)
+
+    def accept():
+        for state in states:
+            for action in actions:
+                game.set_state(state[:])
+                game.accept(action)
+        return len(states) * len(actions)
+
+    def clone():
+        for state in states:
+            game.set_state(state[:])
+            for _ in actions:
+                game.clone()
+        return len(states) * len(actions)
+
+    return {"change_state": (change_state, "moves"),
+            "is_state_changed": (is_state_changed, "checks"),
+            "accept": (accept, "moves"), "clone": (clone, "clones")}
+
+
+def playout_benchmark(engine, size, count):
+    # random playouts from the initial state to the end of the game
+    def playouts():
+        rng = RandomStream(size)
+        random_policy = policy.Random()
+        for _ in range(count):
+            game = engine(size=size, rng=rng)
+            while not game.is_finished():
+                agent.interact(random_policy, game)
+        return count
+    return playouts
+
+
+def batch_playout_benchmark(size, count):
+    import numpy as np
+
+    def playouts():
+        batch = BatchGame(np.zeros((count, size * size), dtype=np.uint8),
+                          size=size)
+        rng = np.random.default_rng(size)
+        batch.spawn_tiles(rng)
+        batch.rollout_until_terminal(rng)
+        return count
+    return playouts
+
+
+def large_board_benchmark(engine, size, count):
+    # random moves on a crowded board (the tiles are random, a fifth of the
+    # cells is empty), the game is restarted from the board when it ends
+    rng = RandomStream(size)
+    state = [0 if rng.random() < 0.2 else rng.randrange(1, 8)
+             for _ in range(size * size)]
+
+    def moves():
+        game = engine(size=size, state=state[:], rng=RandomStream(0))
+        for _ in range(count):
+            if game.is_finished():
+                game.set_state(state[:])
+            game.accept(game.rng.choice(game.get_possible_actions()))
+        return count
+    return moves
+
+
+def large_batch_benchmark(size, num_games, count):
+    # random moves of num_games games on the crowded board in lockstep
+    import numpy as np
+
+    rng = RandomStream(size)
+    state = [0 if rng.random() < 0.2 else rng.randrange(1, 8)
+             for _ in range(size * size)]
+
+    def moves():
+        batch = BatchGame(np.tile(state, (num_games, 1)), size=size)
+        rng = np.random.default_rng(size)
+        for _ in range(count):
+            batch.step(random_actions(batch.legal_mask(), rng))
+            batch.spawn_tiles(rng)
+        return num_games * count
+    return moves
+
+
+def startup_benchmark(modules, count):
+    # interpreters that import the modules, started from the repository root
+    # (the directory of policy.py)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def starts():
+        for _ in range(count):
+            subprocess.run([sys.executable, "-c",
+                            "import " + ", ".join(modules)],
+                           cwd=root, check=True)
+        return count
+    return starts
+
+
+def worker_benchmark(count):
+    # worker processes of evaluate started by spawn (the default start method
+    # on macOS and Windows: the worker imports the modules of its task) that
+    # play one game of the random policy on a 3x3 board each
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    from .evaluate import play_game
+
+    def starts():
+        for seed in range(count):
+            with ProcessPoolExecutor(max_workers=1,
+                                     mp_context=get_context("spawn")) as pool:
+                pool.submit(play_game, "policy.Random", None, "list",
+                            {"size": 3}, 0, seed).result()
+        return count
+    return starts
+
+
+def decision_benchmark(make_policy, count):
+    # decisions of the policy in count midgame states
+    states = midgame_states(BitboardGame, 4, count, seed=1)
+
+    def decisions():
+        decision_policy = make_policy()
+        for state in states:
+            game = BitboardGame(state=state, rng=RandomStream(0))
+            decision_policy.get_action(game, None)
+        return count
+    return decisions
+
+
+def game_benchmark(make_policy, count):
+    # whole games of the policy
+    def games():
+        game_policy = make_policy()
+        for seed in range(count):
+            game = BitboardGame(rng=RandomStream(seed))
+            while not game.is_finished():
+                agent.interact(game_policy, game)
+        return count
+    return games
+
+
+def get_benchmarks(quick=False):
+    # name -> (run, unit) of all the benchmarks, quick runs use fewer
+    # operations
+    scale = 1 if quick else 10
+    benchmarks = {}
+    for engine_name, engine in engines.items():
+        for name, benchmark in engine_benchmarks(engine, 100 * scale).items():
+            benchmarks["engine.{}.{}".format(engine_name, name)] = benchmark
+    for size in range(3, 7):
+        benchmarks["playout.list.size{}".format(size)] = (
+            playout_benchmark(Game, size, 2 * scale), "playouts")
+    benchmarks["playout.bitboard.size4"] = (
+        playout_benchmark(BitboardGame, 4, 2 * scale), "playouts")
+    for size in range(3, 7):
+        benchmarks["playout.batch.size{}".format(size)] = (
+            batch_playout_benchmark(size, 100 * scale), "playouts")
+    # the moves of the list engine and of the batches on large boards
+    for size in (8, 16, 32):
+        benchmarks["large.list.size{}".format(size)] = (
+            large_board_benchmark(Game, size, 50 * scale), "moves")
+        benchmarks["large.batch.size{}".format(size)] = (
+            large_batch_benchmark(size, 256, 2 * scale), "moves")
+    benchmarks["startup.import"] = (startup_benchmark(
+        ["two048", "two048.evaluate", "policy"], 2 * scale), "starts")
+    benchmarks["startup.worker.spawn"] = (worker_benchmark(2 * scale),
+                                          "starts")
+    for samples in (10, 50):
+        benchmarks["decision.pure_mcts.samples{}".format(samples)] = (
+            decision_benchmark(lambda samples=samples: policy.PureMCTS(
+                samples=samples), scale), "decisions")
+    benchmarks["decision.pure_mcts_batched.samples50"] = (
+        decision_benchmark(lambda: policy.PureMCTS(samples=50, batched=True),
+                           scale), "decisions")
+    benchmarks["decision.pure_mcts_afterstates.samples50"] = (
+        decision_benchmark(lambda: policy.PureMCTS(samples=50,
+                                                   afterstates=1 << 16),
+                           scale), "decisions")
+    game_policies = {
+        "random": policy.Random,
+        "expectimax_depth1": lambda: policy.Expectimax(depth=1),
+        "pure_mcts_samples1": lambda: policy.PureMCTS(samples=1),
+        "mcts_heuristic_iterations20": lambda: mcts.MCTS(
+            iterations=20, evaluator=mcts.HeuristicEvaluator())}
+    for name, make_policy in game_policies.items():
+        benchmarks["game.{}".format(name)] = (
+            game_benchmark(make_policy, 1 if quick else 3), "games")
+    return benchmarks
+
+
+def run_benchmarks(names=None, quick=False, repeat=3, progress=None):
+    # results of the benchmarks (all if names is None, or the benchmarks
+    # whose names start with one of the names)
+    results = {}
+    for name, (run, unit) in get_benchmarks(quick).items():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        if progress is not None:
+            progress(name)
+        results[name] = {"rate": measure(run, repeat), "unit": unit}
+    return {"results": results,
+            "python": platform.python_version(),
+            "platform": platform.platform(), "quick": quick}
+
+
+def compare(results, baseline, tolerance):
+    # (name, rate, baseline rate, ratio) of the benchmarks of both runs and
+    # the names of the benchmarks slower than the baseline by more than the
+    # tolerance (a fraction of the baseline rate)
+    comparison = []
+    regressions = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base_rate = baseline["results"][name]["rate"]
+        ratio = result["rate"] / base_rate
+        comparison.append((name, result["rate"], base_rate, ratio))
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+    return comparison, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m two048.bench",
+        description="benchmark the engines, the policies and whole games")
+    parser.add_argument("names", nargs="*",
+                        help="prefixes of the benchmarks to run, e.g. engine "
+                        "or playout.batch (all by default)")
+    parser.add_argument("--output", default=None, help="results file (json)")
+    parser.add_argument("--baseline", default=None,
+                        help="results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown relative to the baseline")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer operations per benchmark")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names, quick=args.quick, repeat=args.repeat,
+                             progress=lambda name: print(
+                                 name, file=sys.stderr, flush=True))
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline is None:
+        for name, result in results["results"].items():
+            print("{:45} {:14.1f} {}/s".format(name, result["rate"],
+                                               result["unit"]))
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    comparison, regressions = compare(results, baseline, args.tolerance)
+    for name, rate, base_rate, ratio in comparison:
+        print("{:45} {:14.1f} {:14.1f} {:7.2f}{}".format(
+            name, rate, base_rate, ratio,
+            "  REGRESSION" if name in regressions else ""))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
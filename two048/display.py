@@ -1,28 +1,60 @@
-from copy import copy
+import argparse
+import math
+import shutil
+import subprocess
+import sys
+import time
 import numpy as np
-from matplotlib import pyplot as plt
 
 
 # based on
 # https://github.com/anujgupta82/Musings
-# https://matplotlib.org/gallery/images_contours_and_fields/image_annotated_heatmap.html
+# the annotated heatmap of the matplotlib gallery, https://matplotlib.org/
+#   gallery/images_contours_and_fields/image_annotated_heatmap.html
 
 # to make the dynamic figure updates work one needs to cast
 # "%matplotlib notebook" magic in the notebook before plotting the figure
 
+# the image of the board and the texts of the tiles are created once, a frame
+# sets the data of the image and the texts of the tiles that changed, with
+# blitting the grid (background) is saved after a full draw of the figure and
+# a frame draws only the image and the texts over it
+#
+# Renderer draws the frames without a window (Agg backend) for videos of the
+# recorded games:
+#   python -m two048.display games.trj --game 0 --output game.gif
+#
+# matplotlib is imported by the first Display, not by the import of the module
+
 
 class Display:
     # visualize the game state (2048 board with numbered tiles) in jupyter
     # notebook
+    #   max_tile - tile of the last color of the colormap
+    #   blit - redraw only the image and the texts in a frame
+    #   figure - figure to draw on (None - new pyplot figure)
 
     def __init__(self, state_size=(4, 4), display_size=(8, 8),
                  colormap="magma_r", background_color="grey",
-                 textcolors=("black", "white"), text_threshold=None):
-        # copy to not modify the library colormap
-        self.cmap = copy(plt.cm.get_cmap(colormap))
-        self.cmap.set_bad(background_color)
+                 textcolors=("black", "white"), text_threshold=None,
+                 max_tile=16, fontsize=16, blit=True, figure=None):
+        import matplotlib
+        from matplotlib.collections import LineCollection
+
+        # copy of the library colormap with the background color of the
+        # masked (empty) tiles
+        self.cmap = matplotlib.colormaps[colormap].with_extremes(
+            bad=background_color)
 
-        self.fig, axes = plt.subplots(figsize=display_size)
+        if figure is None:
+            # pyplot (and its backend) is imported only for a figure of its
+            # own, the headless Renderer does not need it
+            from matplotlib import pyplot as plt
+
+            self.fig, axes = plt.subplots(figsize=display_size)
+        else:
+            self.fig = figure
+            axes = figure.add_subplot()
 
         # remove frame and ticks
         axes.set_frame_on(False)
@@ -31,60 +63,245 @@ class Display:
                          labelbottom=False, labeltop=False,
                          labelleft=False, labelright=False)
 
-        # set up the grid
-        # first axis in matrix (vertical) is y axis on the plot and second axis
-        # in matrix is x axis on the plot
-        axes.set_xticks(np.arange(state_size[1]+1)-.5, minor=True)
-        axes.set_yticks(np.arange(state_size[0]+1)-.5, minor=True)
-        axes.grid(which="minor", color=background_color, linestyle='-',
-                  linewidth=8)
-
         self.axes = axes
+        self.state_size = state_size
+        self.blit = blit
 
         # text color change threshold (to show light text on dark background
         # and vice versa)
         self.text_threshold = text_threshold
 
         self.text_kw = {'horizontalalignment': 'center',
-                        'verticalalignment': 'center', 'fontsize': 16}
+                        'verticalalignment': 'center', 'fontsize': fontsize}
         self.textcolors = textcolors
-        self.texts = []
 
-        empty_state = np.zeros(state_size, dtype=int)
-        self.draw(empty_state)
+        # the animated artists are skipped by the full draw of the figure,
+        # they are drawn over the saved background
+        self.state = np.zeros(state_size, dtype=int)
+        self.image = axes.imshow(np.ma.masked_equal(self.state, 0),
+                                 cmap=self.cmap, vmin=0, vmax=max_tile,
+                                 animated=blit)
+        # the grid is drawn over the image
+        # first axis in matrix (vertical) is y axis on the plot and second axis
+        # in matrix is x axis on the plot
+        rows, columns = state_size
+        vertical = [[(j - .5, -.5), (j - .5, rows - .5)]
+                    for j in range(columns + 1)]
+        horizontal = [[(-.5, i - .5), (columns - .5, i - .5)]
+                      for i in range(rows + 1)]
+        self.grid = LineCollection(vertical + horizontal,
+                                   colors=background_color, linewidths=8,
+                                   snap=False, animated=blit)
+        axes.add_collection(self.grid)
+        self.texts = [[axes.text(j, i, "", color=textcolors[0],
+                                 animated=blit, **self.text_kw)
+                       for j in range(columns)]
+                      for i in range(rows)]
+
+        self.background = None
+        if blit:
+            self.fig.canvas.mpl_connect("draw_event", self.on_draw)
+        self.fig.canvas.draw()
+
+    def on_draw(self, _):
+        # the figure was drawn (first shown or resized), the background is
+        # saved and the tiles are drawn over it
+        self.background = self.fig.canvas.copy_from_bbox(self.axes.bbox)
+        self.draw_tiles()
+
+    def draw_tiles(self):
+        self.axes.draw_artist(self.image)
+        self.axes.draw_artist(self.grid)
+        for row in self.texts:
+            for text in row:
+                if text.get_text():
+                    self.axes.draw_artist(text)
 
     def draw(self, state):
         # value 0 is masked in state so it is shown in background color on the
-        # plot (this is set by the call to colormap method set_bad() in init)
-        self.axes.imshow(np.ma.masked_equal(state, 0), cmap=self.cmap,
-                         vmin=0, vmax=16)
+        # plot (this is set by the colormap in init)
+        state = np.asarray(state).reshape(self.state_size)
+        self.image.set_data(np.ma.masked_equal(state, 0))
         self.annotate(state)
-        self.fig.canvas.draw()
+        canvas = self.fig.canvas
+        if self.blit and self.background is not None:
+            canvas.restore_region(self.background)
+            self.draw_tiles()
+            canvas.blit(self.axes.bbox)
+            canvas.flush_events()
+        else:
+            canvas.draw()
 
     def annotate(self, state):
-        # draw numbers (powers of 2) on the board tiles
-        for text in self.texts:
-            text.remove()
-        self.texts.clear()
-        for i in range(state.shape[0]):
-            for j in range(state.shape[1]):
-                if state[i, j] > 0:
-                    # first axis in matrix is y axis on the plot,
-                    # and second axis in matrix is x axis on the plot
-                    if self.text_threshold is None:
-                        text_color = self.textcolors[0]
-                    else:
-                        text_color = self.textcolors[state[i, j] >
-                                                     self.text_threshold]
-                    text = self.axes.text(j, i, 1 << state[i, j],
-                                          color=text_color, **self.text_kw)
-                    self.texts.append(text)
+        # update the numbers (powers of 2) of the tiles that changed since the
+        # last frame
+        for i, j in np.argwhere(state != self.state):
+            tile = int(state[i, j])
+            text = self.texts[i][j]
+            if tile > 0:
+                if self.text_threshold is None:
+                    text_color = self.textcolors[0]
+                else:
+                    text_color = self.textcolors[tile > self.text_threshold]
+                text.set_text(str(1 << tile))
+                text.set_color(text_color)
+            else:
+                text.set_text("")
+        self.state = state.copy()
+
+
+class Renderer:
+    # headless renderer of the states to RGB frames ((height, width, 3) uint8
+    # arrays) with the Agg backend, no pyplot figure or window is created
+    #   display_size, dpi - size of the frames in inches and dots per inch
+    #   display_kwargs - arguments of Display (colormap, text_threshold, ...)
+    #
+    # the drawing of the texts is slow, so the pixels of the inside of every
+    # cell (the grid lines are never covered) are kept for every tile drawn in
+    # the cell, a frame copies the previous frame and pastes the cells that
+    # changed, the board is drawn only when a cell gets a tile it did not
+    # have yet
+
+    def __init__(self, state_size=(4, 4), display_size=(4, 4), dpi=50,
+                 **display_kwargs):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        figure = Figure(figsize=display_size, dpi=dpi)
+        FigureCanvasAgg(figure)
+        # the numbers fill about half of the tiles
+        display_kwargs.setdefault("fontsize",
+                                  18 * display_size[0] / state_size[1])
+        self.display = Display(state_size, figure=figure, **display_kwargs)
+        self.state_size = state_size
+        self.cells = self.get_cells()
+        # pixels of the cells by (row, column, tile)
+        self.patches = {}
+        self.frame = None
+        self.state = None
+        # number of the frames drawn by matplotlib
+        self.draws = 0
+
+    def get_cells(self):
+        # (rows, columns) slices of the frame inside the cells: the pixels
+        # that are not fully covered by the grid lines (the lines are opaque
+        # and wider than the antialiasing of the image at the cell borders)
+        display = self.display
+        height = display.fig.canvas.get_width_height()[1]
+        # half of the grid line in pixels
+        half = display.grid.get_linewidth()[0] * display.fig.dpi / 72 / 2
+        transform = display.axes.transData
+        cells = {}
+        for i in range(self.state_size[0]):
+            for j in range(self.state_size[1]):
+                (x0, y0), (x1, y1) = transform.transform(
+                    [(j - .5, i - .5), (j + .5, i + .5)])
+                # the rows of the frame are counted from the top
+                top, bottom = height - max(y0, y1), height - min(y0, y1)
+                left, right = min(x0, x1), max(x0, x1)
+                cells[i, j] = (
+                    slice(math.floor(top + half), math.ceil(bottom - half)),
+                    slice(math.floor(left + half), math.ceil(right - half)))
+        return cells
+
+    def render(self, state):
+        state = np.asarray(state).reshape(self.state_size)
+        if self.state is None:
+            changed = list(self.cells)
+        else:
+            changed = [(i, j) for i, j in np.argwhere(state != self.state)]
+        keys = [(i, j, int(state[i, j])) for i, j in changed]
+        if self.frame is not None and all(key in self.patches
+                                          for key in keys):
+            frame = self.frame.copy()
+            for key in keys:
+                frame[self.cells[key[:2]]] = self.patches[key]
+        else:
+            self.display.draw(state)
+            self.draws += 1
+            frame = np.asarray(self.display.fig.canvas.buffer_rgba())
+            frame = frame[..., :3].copy()
+            for (i, j), cell in self.cells.items():
+                self.patches[i, j, int(state[i, j])] = frame[cell].copy()
+        self.frame = frame
+        self.state = state.copy()
+        return frame.copy()
+
+    def render_game(self, states):
+        # frames of the states of a game, e.g. TrajectoryReader.get_states
+        for state in states:
+            yield self.render(state)
+
+
+def save_frames(path, frames, fps=10):
+    # GIF (by pillow, a dependency of matplotlib) or a video in the format of
+    # the extension of the path (by ffmpeg), returns the number of frames
+    if path.lower().endswith(".gif"):
+        from PIL import Image
+
+        images = [Image.fromarray(frame) for frame in frames]
+        images[0].save(path, save_all=True, append_images=images[1:],
+                       duration=round(1000 / fps), loop=0)
+        return len(images)
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is needed to write {}".format(path))
+    frames = iter(frames)
+    frame = next(frames)
+    height, width, _ = frame.shape
+    process = subprocess.Popen(
+        [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo",
+         "-pix_fmt", "rgb24", "-s", "{}x{}".format(width, height),
+         "-r", str(fps), "-i", "-",
+         # the common codecs need even dimensions
+         "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", path],
+        stdin=subprocess.PIPE)
+    count = 0
+    try:
+        while frame is not None:
+            process.stdin.write(frame.tobytes())
+            count += 1
+            frame = next(frames, None)
+    finally:
+        process.stdin.close()
+        process.wait()
+    if process.returncode:
+        raise RuntimeError("ffmpeg failed to write {}".format(path))
+    return count
+
+
+def main(argv=None):
+    from .recorder import TrajectoryReader
+
+    parser = argparse.ArgumentParser(
+        prog="python -m two048.display",
+        description="render a recorded game to a GIF or a video")
+    parser.add_argument("trajectories", help="file of TrajectoryRecorder")
+    parser.add_argument("--game", type=int, default=0)
+    parser.add_argument("--output", required=True,
+                        help="GIF or video file (e.g. game.gif, game.mp4)")
+    parser.add_argument("--fps", type=float, default=10)
+    parser.add_argument("--dpi", type=int, default=50)
+    parser.add_argument("--text-threshold", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    reader = TrajectoryReader(args.trajectories)
+    states = reader.get_states(reader[args.game])
+    renderer = Renderer((reader.size, reader.size), dpi=args.dpi,
+                        text_threshold=args.text_threshold)
+    start = time.perf_counter()
+    count = save_frames(args.output, renderer.render_game(states), args.fps)
+    print("{} frames written in {:.2f} s".format(
+        count, time.perf_counter() - start), file=sys.stderr)
 
 
 def test():
-    import time
     display = Display(text_threshold=10)
     for i in range(4):
         state = np.random.randint(17, size=(4, 4), dtype=int)
         display.draw(state)
         time.sleep(2)
+
+
+if __name__ == "__main__":
+    main()
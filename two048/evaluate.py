@@ -0,0 +1,295 @@
+import argparse
+import ast
+import importlib
+import inspect
+import json
+import os
+import sys
+
+import agent
+from .game import RandomStream, derive_seed, engine_names, get_engine
+from .model import Model
+
+
+# evaluate a policy on a number of games, games can be played in parallel and
+# the results are written to disk game by game so that an interrupted run can
+# be resumed
+#
+# the worker processes import this module to play the games, numpy and the
+# process pool are imported only by the functions that need them, see the
+# startup benchmarks of two048.bench
+#
+# usage from the repository root:
+#   python -m two048.evaluate policy.PureMCTS --policy-kwargs samples=50 \
+#       --games 100 --workers 8 --output pure_mcts.jsonl
+
+
+def evaluate_policy(policy, games_num, policy_kwargs=None, seed=42,
+                    workers=None, output=None, engine="list", progress=None,
+                    pool_size=None, **game_kwargs):
+    # policy: policy instance (has to be picklable when workers are used) or
+    #   import path of the policy class, e.g. "policy.PureMCTS", instantiated
+    #   with policy_kwargs, an instance is recorded in the results file by
+    #   its class and its arguments (see describe_policy)
+    # seed: seed of the whole evaluation, every game gets its own seed derived
+    #   from it, so the results do not depend on the number of workers
+    # workers: number of processes to play the games in (None - play in this
+    #   process)
+    # output: path of the results file (json lines), finished games found in
+    #   the file are not played again
+    # progress: function called with (finished games, games_num) after every
+    #   game
+    # pool_size: number of games played at a time by agent.play_many (the
+    #   actions of the pool are chosen by one get_actions call of the policy),
+    #   None - the games are played one by one, with workers the pools are
+    #   played in the worker processes
+    # game_kwargs: arguments of the game (size, probability_of_4, scoring)
+    #
+    # returns arrays of score, largest tile and move count of every game
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    import numpy as np
+
+    description = policy
+    if output is not None and not isinstance(policy, str):
+        description = describe_policy(policy)
+    config = {"policy": description,
+              "policy_kwargs": policy_kwargs or {}, "seed": seed,
+              "engine": engine, "game_kwargs": game_kwargs}
+    if pool_size is not None:
+        config["pool_size"] = pool_size
+    seeds = game_seeds(seed, games_num)
+    results = load_results(output, config) if output is not None else {}
+    if output is not None:
+        if os.path.exists(output):
+            drop_incomplete_line(output)
+        results_file = open(output, "a")
+        if not results and not os.path.getsize(output):
+            results_file.write(json.dumps({"config": config}) + "\n")
+            results_file.flush()
+
+    def record(result):
+        results[result["game"]] = result
+        if output is not None:
+            results_file.write(json.dumps(result) + "\n")
+            results_file.flush()
+        if progress is not None:
+            progress(len(results), games_num)
+
+    remaining = [i for i in range(games_num) if i not in results]
+    try:
+        if workers is None and pool_size is None:
+            for i in remaining:
+                record(play_game(policy, policy_kwargs, engine, game_kwargs,
+                                 i, seeds[i]))
+        elif workers is None:
+            for result in play_games(policy, policy_kwargs, engine,
+                                     game_kwargs, remaining, seeds, pool_size):
+                record(result)
+        elif pool_size is not None:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(list_games, policy, policy_kwargs,
+                                       engine, game_kwargs,
+                                       remaining[start:start + pool_size],
+                                       seeds, pool_size)
+                           for start in range(0, len(remaining), pool_size)]
+                for future in as_completed(futures):
+                    for result in future.result():
+                        record(result)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(play_game, policy, policy_kwargs,
+                                       engine, game_kwargs, i, seeds[i])
+                           for i in remaining]
+                for future in as_completed(futures):
+                    record(future.result())
+    finally:
+        if output is not None:
+            results_file.close()
+
+    score = np.empty(games_num, dtype=int)
+    largest_tile = np.empty(games_num, dtype=int)
+    move_count = np.empty(games_num, dtype=int)
+    for i in range(games_num):
+        score[i] = results[i]["score"]
+        largest_tile[i] = results[i]["largest_tile"]
+        move_count[i] = results[i]["move_count"]
+    return score, largest_tile, move_count
+
+
+def game_seeds(seed, games_num):
+    # the seed of a game depends only on the seed of the run and the index of
+    # the game
+    return [derive_seed(seed, i) for i in range(games_num)]
+
+
+def load_results(path, config):
+    # finished games of an interrupted run, the run has to have the same
+    # configuration
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path) as results_file:
+        for line in results_file:
+            # the last line can be incomplete if the run was killed
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "config" in record:
+                if record["config"] != config:
+                    raise ValueError(
+                        "results in {} are from a different configuration: "
+                        "{}".format(path, record["config"]))
+            else:
+                results[record["game"]] = record
+    return results
+
+
+def drop_incomplete_line(path):
+    # the last line of a killed run can be incomplete, it is cut off so that
+    # the appended results start on a line of their own
+    with open(path, "r+b") as results_file:
+        results_file.truncate(results_file.read().rfind(b"\n") + 1)
+
+
+def describe_policy(value):
+    # json description of a policy instance by the import path of its class
+    # and the values of its constructor arguments (kept in the attributes of
+    # the same names), the values are described the same way, functions and
+    # classes by their import paths
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [describe_policy(item) for item in value]
+    named = value if inspect.isfunction(value) or inspect.isclass(value) \
+        else type(value)
+    path = "{}.{}".format(named.__module__, named.__qualname__)
+    if "<" in path:
+        raise ValueError("{!r} has no import path".format(value))
+    if named is value:
+        return path
+    arguments = {}
+    for name, parameter in inspect.signature(named).parameters.items():
+        if (parameter.kind in (parameter.VAR_POSITIONAL,
+                               parameter.VAR_KEYWORD) or
+                not hasattr(value, name)):
+            raise ValueError(
+                "{} can not be described by its arguments, pass the import "
+                "path of the policy and policy_kwargs to resume the "
+                "results".format(path))
+        arguments[name] = describe_policy(getattr(value, name))
+    return {"class": path, "arguments": arguments}
+
+
+# policies instantiated in this (worker) process, by their import path and
+# arguments
+policies = {}
+
+
+def make_policy(policy, policy_kwargs):
+    if not isinstance(policy, str):
+        return policy
+    key = (policy, repr(sorted((policy_kwargs or {}).items())))
+    if key not in policies:
+        module_name, class_name = policy.rsplit(".", 1)
+        policy_class = getattr(importlib.import_module(module_name),
+                               class_name)
+        policies[key] = policy_class(**(policy_kwargs or {}))
+    return policies[key]
+
+
+def play_game(policy, policy_kwargs, engine, game_kwargs, index, seed):
+    # the game and the policies that do not have their own rng draw from
+    # the stream of the game, the global random module is not used
+    policy = make_policy(policy, policy_kwargs)
+    game = get_engine(engine)(rng=RandomStream(seed), **game_kwargs)
+    model = Model()
+    while not game.is_finished():
+        agent.interact(policy, game, model)
+    return get_result(game, model, index, seed)
+
+
+def play_games(policy, policy_kwargs, engine, game_kwargs, indices, seeds,
+               pool_size):
+    # results of the games of the indices played by agent.play_many, in the
+    # order they finish
+    policy = make_policy(policy, policy_kwargs)
+    engine = get_engine(engine)
+    games = agent.play_many(
+        policy, lambda i: engine(rng=RandomStream(seeds[indices[i]]),
+                                 **game_kwargs),
+        len(indices), pool_size, lambda _: Model())
+    for i, game, model in games:
+        yield get_result(game, model, indices[i], seeds[indices[i]])
+
+
+def list_games(*args):
+    # play_games in a worker process
+    return list(play_games(*args))
+
+
+def get_result(game, model, index, seed):
+    return {"game": index, "seed": seed, "score": game.get_value(),
+            "largest_tile": max(game.get_state()),
+            "move_count": len(model.trajectory)}
+
+
+def parse_kwargs(items):
+    # name=value pairs, values are python literals or strings
+    kwargs = {}
+    for item in items:
+        name, value = item.split("=", 1)
+        try:
+            kwargs[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            kwargs[name] = value
+    return kwargs
+
+
+def main(argv=None):
+    import numpy as np
+
+    parser = argparse.ArgumentParser(
+        prog="python -m two048.evaluate",
+        description="evaluate a policy on a number of games")
+    parser.add_argument("policy", help="import path of the policy class, "
+                        "e.g. policy.PureMCTS")
+    parser.add_argument("--policy-kwargs", nargs="*", default=[],
+                        metavar="NAME=VALUE")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="number of games played at a time, the policy "
+                        "chooses the actions of all of them in one call")
+    parser.add_argument("--output", default=None,
+                        help="results file, an existing file is resumed")
+    parser.add_argument("--engine", choices=engine_names, default="list")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--probability-of-4", type=float, default=0.1)
+    parser.add_argument("--scoring", choices=["2048", "threes"],
+                        default="2048")
+    args = parser.parse_args(argv)
+
+    def progress(finished, games_num):
+        print("\r{}: {}/{} games finished".format(args.policy, finished,
+                                                  games_num),
+              end="", file=sys.stderr, flush=True)
+
+    score, largest_tile, move_count = evaluate_policy(
+        args.policy, args.games,
+        policy_kwargs=parse_kwargs(args.policy_kwargs),
+        seed=args.seed, workers=args.workers, output=args.output,
+        engine=args.engine, progress=progress, pool_size=args.pool_size,
+        size=args.size,
+        probability_of_4=args.probability_of_4, scoring=args.scoring)
+    print(file=sys.stderr)
+    print("average score: {}".format(np.mean(score)))
+    print("average largest tile: {}".format(
+        pow(2, int(np.round(np.mean(largest_tile))))))
+    print("average move count: {}".format(np.mean(move_count)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import random
+from collections import OrderedDict
 from enum import Enum
+from functools import lru_cache
 
 
 class Game:
@@ -11,49 +13,90 @@ class Game:
 
     empty_tile = 0
 
+    # if the engine needs the bitboard row tables in its rules
+    uses_row_tables = False
+
     def __init__(self, size=4, probability_of_4=0.1, state=None,
-                 scoring="2048"):
-        self.size = size
+                 scoring="2048", keep_prev_state=False, rng=None,
+                 afterstates=None):
+        # static data of the game configuration is shared by all the games
+        # with the same configuration
+        self.rules = get_rules(type(self), size, probability_of_4, scoring)
+        # AfterstateCache of the moves and the legal actions, shared by the
+        # clones of the game (None - no cache)
+        self.afterstates = afterstates
+        # source of the new tiles (and of the moves of the policies that do
+        # not have their own), random.Random or RandomStream instance, the
+        # global random module by default
+        self.rng = random if rng is None else rng
         self.score = 0
-        self.scoring = scoring
-        if scoring == "threes":
-            self.update_score = self.score_threes
-        else:
-            self.update_score = self.score_2048
-        self.p4 = probability_of_4
+        # score of the merges of the last move (collected by change_state)
+        self.delta = 0
 
+        # the state before the last move is kept only on request, the score
+        # does not need it
+        self.keep_prev_state = keep_prev_state
         self.prev_state = None
+        # empty cells of the state in ascending order and the legal actions
+        # of the state, kept up to date by the moves so that the board is not
+        # scanned again (None - not known yet)
+        self.empty_indices = None
+        self.possible_actions = None
+        # (index, tile) of the tile placed by the last generate_tile
+        self.new_tile = None
         if state is None:
             self.state = [self.empty_tile] * size * size
+            self.board_score = 0
             # make initial state nonempty so that game state can never be empty
             self.generate_tile()
         else:
             self.state = state
+            self.board_score = self.count_board_score()
 
-        # sequences of indices - rows or columns with indices ordered according
-        # to a certain move
-        # e. g. rows of indices from left to right for move to the left
-        self.index_sequences = {}
-        rows = [tuple([i * size + j for j in range(size)])
-                for i in range(size)]
-        columns = [tuple([i + j * size for j in range(size)])
-                   for i in range(size)]
-        self.index_sequences[self.ActionSpace.UP] = tuple(columns)
-        self.index_sequences[self.ActionSpace.DOWN] = tuple(
-            [tuple(reversed(col)) for col in columns])
-        self.index_sequences[self.ActionSpace.LEFT] = tuple(rows)
-        self.index_sequences[self.ActionSpace.RIGHT] = tuple(
-            [tuple(reversed(row)) for row in rows])
+    @property
+    def size(self):
+        return self.rules.size
+
+    @property
+    def p4(self):
+        return self.rules.p4
+
+    @property
+    def scoring(self):
+        return self.rules.scoring
+
+    @property
+    def index_sequences(self):
+        return self.rules.index_sequences
 
     def clone(self):
-        cloned_game = Game(size=self.size, probability_of_4=self.p4,
-                           state=self.state, scoring=self.scoring)
-        cloned_game.set_value(self.score)
+        # bypass __init__, the clone shares the rules and gets its own copy of
+        # the state
+        cloned_game = object.__new__(self.__class__)
+        cloned_game.rules = self.rules
+        cloned_game.rng = self.rng
+        cloned_game.afterstates = self.afterstates
+        cloned_game.score = self.score
+        cloned_game.delta = 0
+        cloned_game.keep_prev_state = False
+        cloned_game.prev_state = None
+        cloned_game.state = self.state[:]
+        cloned_game.board_score = self.board_score
+        empty_indices = self.empty_indices
+        cloned_game.empty_indices = (None if empty_indices is None else
+                                     empty_indices[:])
+        # the list of the legal actions is never changed in place
+        cloned_game.possible_actions = self.possible_actions
+        cloned_game.new_tile = None
         return cloned_game
 
     def actions(self):
         return iter(self.ActionSpace)
 
+    def get_new_tiles(self):
+        # (tile, probability) pairs of the tiles placed after a move
+        return self.rules.new_tiles
+
     def get_state(self):
         return self.state[:]
 
@@ -61,7 +104,23 @@ class Game:
         # return the value of the state (e.g. game score)
         return self.score
 
+    def get_empty_indices(self):
+        # indices of the empty cells in ascending order (the list is owned by
+        # the game and must not be modified)
+        if self.empty_indices is None:
+            self.empty_indices = [i for i, tile in enumerate(self.state)
+                                  if tile == self.empty_tile]
+        return self.empty_indices
+
     def is_state_changed(self, action):
+        if self.possible_actions is not None:
+            return action in self.possible_actions
+        if self.afterstates is not None:
+            return action in self.get_cached_actions()
+        return self.can_move(action)
+
+    def can_move(self, action):
+        # if the action changes the state (without the caches)
         for indices in self.index_sequences[action]:
             stop_i = 0
             stop_index = indices[stop_i]
@@ -79,20 +138,48 @@ class Game:
         return False
 
     def get_possible_actions(self):
-        return [action for action in self.ActionSpace
-                if self.is_state_changed(action)]
+        if self.possible_actions is None:
+            if self.afterstates is not None:
+                self.get_cached_actions()
+            else:
+                self.possible_actions = [action for action in self.ActionSpace
+                                         if self.can_move(action)]
+        return self.possible_actions[:]
+
+    def get_cached_actions(self):
+        # legal actions of the state from the afterstate cache (slot 0 of the
+        # entry of the board)
+        afterstates = self.afterstates
+        entry = afterstates.get_entry(bytes(self.state))
+        actions = entry[0]
+        if actions is None:
+            afterstates.misses += 1
+            actions = [action for action in self.ActionSpace
+                       if self.can_move(action)]
+            entry[0] = actions
+        else:
+            afterstates.hits += 1
+        self.possible_actions = actions
+        return actions
 
     def is_finished(self):
         # if any further interaction is possible (e.g. is the game finished?)
-        for action in self.ActionSpace:
-            if self.is_state_changed(action):
-                return False
-        else:
-            return True
+        # a tile can always slide towards an empty cell, only a full board
+        # (or an empty one) needs to be checked for merges
+        num_empty = len(self.get_empty_indices())
+        if 0 < num_empty < len(self.state):
+            return False
+        if self.possible_actions is None:
+            self.get_possible_actions()
+        return not self.possible_actions
 
     def set_state(self, state):
         self.prev_state = None
+        self.delta = 0
         self.state = state
+        self.empty_indices = None
+        self.possible_actions = None
+        self.board_score = self.count_board_score()
 
     def set_value(self, value=0):
         self.score = value
@@ -105,46 +192,67 @@ class Game:
         #   the resulting tile can not be merged further in the same move:
         #   4  0  2  2  ->  4  0  0  4  ->  0   0   4   4
         #
-        self.prev_state = self.state[:]
+        # the scores of the merges are summed up during the slide
+        state = self.state
+        if self.keep_prev_state:
+            self.prev_state = state[:]
+        afterstates = self.afterstates
+        if afterstates is not None:
+            entry = afterstates.get_entry(bytes(state))
+            afterstate = entry[action.value]
+            if afterstate is not None:
+                afterstates.hits += 1
+                tiles, delta, empty_indices = afterstate
+                state[:] = tiles
+                self.empty_indices = list(empty_indices)
+                self.possible_actions = None
+                self.delta = delta
+                self.board_score += delta
+                return
+            afterstates.misses += 1
+        merge_scores = self.rules.merge_scores
+        delta = 0
+        empty_indices = []
         for indices in self.index_sequences[action]:
             stop_i = 0
             stop_index = indices[stop_i]
             for index in indices[1:]:
-                tile = self.state[index]
+                tile = state[index]
                 if tile == self.empty_tile:
                     continue
-                self.state[index] = self.empty_tile
-                if self.state[stop_index] == self.empty_tile:
-                    self.state[stop_index] = tile
-                elif self.state[stop_index] == tile:
-                    self.state[stop_index] = increment(tile)
+                state[index] = self.empty_tile
+                if state[stop_index] == self.empty_tile:
+                    state[stop_index] = tile
+                elif state[stop_index] == tile:
+                    tile = increment(tile)
+                    state[stop_index] = tile
+                    delta += merge_scores[tile]
                     stop_i += 1
                     stop_index = indices[stop_i]
                 else:
                     stop_i += 1
                     stop_index = indices[stop_i]
-                    self.state[stop_index] = tile
+                    state[stop_index] = tile
+            # the cells behind the last tile of the line are empty
+            if state[stop_index] != self.empty_tile:
+                stop_i += 1
+            empty_indices += indices[stop_i:]
+        empty_indices.sort()
+        self.empty_indices = empty_indices
+        self.possible_actions = None
+        self.delta = delta
+        self.board_score += delta
+        if afterstates is not None:
+            entry[action.value] = (bytes(state), delta, tuple(empty_indices))
+
+    def update_score(self):
+        self.rules.update_score(self)
 
     def score_2048(self):
         # the score increases every time the two tiles are combined by the value
         # of the new tile
-        min_tile = increment(self.empty_tile)
-        prev_tiles = [tile for tile in self.prev_state if tile > min_tile]
-        prev_tiles.sort()
-        tiles = [tile for tile in self.state if tile > min_tile]
-        tiles.sort(reverse=True)
-        delta = 0
-        for tile in tiles:
-            if prev_tiles and tile == prev_tiles[-1]:
-                prev_tiles.pop()
-            else:
-                # this tile is from merging two lower level tiles
-                # in previous state
-                delta += 1 << tile
-                if prev_tiles:
-                    prev_tiles.pop()
-                    prev_tiles.pop()
-        self.score += delta
+        self.score += self.delta
+        self.delta = 0
 
     def score_threes(self):
         # each nonempty tile has a rank n:
@@ -152,23 +260,34 @@ class Game:
         # score of a state is the sum of the scores of tiles present on the
         # board:
         #   tile score = 3^(n - 1) - 1
-        score = 0
-        for tile in self.state:
-            if tile == self.empty_tile:
-                continue
-            score += pow(3, tile - 1) - 1
-        self.score = score
+        # the sum is kept up to date by the merges and the new tiles
+        self.score = self.board_score
+        self.delta = 0
+
+    def count_board_score(self):
+        # sum of the tile scores of the state (0 for 2048 scoring, there the
+        # score is not a function of the state)
+        if self.rules.scoring != "threes":
+            return 0
+        tile_scores = self.rules.tile_scores
+        return sum(tile_scores[tile] for tile in self.state)
 
     def generate_tile(self):
         # insert tile at random empty position
         # probabilities of the values of the new tile: {2: (1 - p), 4: p}
         tile = increment(self.empty_tile)  # tile 2
-        if random.random() > self.p4:
+        if self.rng.random() < self.p4:
             tile = increment(tile)  # tile 4
-        empty_indices = [i for i in range(len(self.state))
-                         if self.state[i] == self.empty_tile]
+        empty_indices = self.get_empty_indices()
         if empty_indices:
-            self.state[random.choice(empty_indices)] = tile
+            index = self.rng.choice(empty_indices)
+            empty_indices.remove(index)
+            self.state[index] = tile
+            self.board_score += self.rules.tile_scores[tile]
+            self.possible_actions = None
+            self.new_tile = (index, tile)
+        else:
+            self.new_tile = None
 
     def accept(self, action):
         self.change_state(action)
@@ -177,12 +296,545 @@ class Game:
         return self.state[:]
 
 
+class Rules:
+    # static data of the game configuration (immutable, shared between games):
+    #   size, probability of tile 4 and scoring of the game
+    #   index_sequences - sequences of indices, rows or columns with indices
+    #     ordered according to a certain move
+    #     e. g. rows of indices from left to right for move to the left
+    #   update_score - scoring function of the game engine
+    #   merge_scores - score of the merge that creates the tile
+    #   tile_scores - score of the tile on the board (threes scoring only)
+    #   new_tiles - (tile, probability) pairs of the tiles placed by
+    #     generate_tile
+    #   tables - row tables of the bitboard engine (None for other engines)
+
+    def __init__(self, engine, size, probability_of_4, scoring):
+        self.size = size
+        self.p4 = probability_of_4
+        self.scoring = scoring
+        if scoring == "threes":
+            self.update_score = engine.score_threes
+        else:
+            self.update_score = engine.score_2048
+        self.tables = get_row_tables() if engine.uses_row_tables else None
+        if self.tables is not None:
+            # row tables of the scores of the moves to the left and to the
+            # right (delta of the moves of the bitboard engine)
+            if scoring == "threes":
+                self.row_scores = (self.tables.threes_score,
+                                   self.tables.threes_score_right)
+            else:
+                self.row_scores = (self.tables.score, self.tables.score_right)
+        tile = increment(Game.empty_tile)
+        self.new_tiles = ((tile, 1 - probability_of_4),
+                          (increment(tile), probability_of_4))
+
+        # tiles up to rank size * size + 1 can appear in a game, the tables
+        # are larger so that any state can be set
+        tiles = range(size * size + 64)
+        if scoring == "threes":
+            # merging two tiles of rank n - 1 replaces two scores
+            # 3^(n - 2) - 1 by 3^(n - 1) - 1
+            self.tile_scores = [pow(3, tile - 1) - 1 if tile else 0
+                                for tile in tiles]
+            self.merge_scores = [pow(3, tile - 2) + 1 if tile > 1 else 0
+                                 for tile in tiles]
+        else:
+            self.tile_scores = [0] * len(tiles)
+            self.merge_scores = [1 << tile for tile in tiles]
+
+        actions = Game.ActionSpace
+        rows = [tuple([i * size + j for j in range(size)])
+                for i in range(size)]
+        columns = [tuple([i + j * size for j in range(size)])
+                   for i in range(size)]
+        self.index_sequences = {
+            actions.UP: tuple(columns),
+            actions.DOWN: tuple([tuple(reversed(col)) for col in columns]),
+            actions.LEFT: tuple(rows),
+            actions.RIGHT: tuple([tuple(reversed(row)) for row in rows]),
+        }
+
+
+@lru_cache(maxsize=None)
+def get_rules(engine, size, probability_of_4, scoring):
+    return Rules(engine, size, probability_of_4, scoring)
+
+
+class BitboardGame(Game):
+    # the same game on the 4x4 board packed into a single integer:
+    #   tile i of the list state is stored in the bits 4 * i .. 4 * i + 3,
+    #   so row r of the board is the 16 bit number (board >> 16 * r) & 0xFFFF
+    #   with the leftmost tile in the lowest bits
+    # moves, move legality and score updates are lookups in the precomputed
+    # row tables (see get_row_tables), columns are handled by transposing the
+    # board
+    # the largest representable tile is 15 (32768), two such tiles never merge
+
+    uses_row_tables = True
+
+    def __init__(self, size=4, probability_of_4=0.1, state=None,
+                 scoring="2048", keep_prev_state=False, rng=None,
+                 afterstates=None):
+        # the previous board is always kept, it costs nothing
+        if size != 4:
+            raise ValueError("bitboard engine supports only size 4 boards")
+        self.board = 0
+        self.prev_board = None
+        # board of the cached legal actions, the cache does not need to be
+        # invalidated when the board changes
+        self.actions_board = None
+        super().__init__(size=size, probability_of_4=probability_of_4,
+                         state=state, scoring=scoring,
+                         keep_prev_state=keep_prev_state, rng=rng,
+                         afterstates=afterstates)
+
+    @property
+    def state(self):
+        return unpack_board(self.board)
+
+    @state.setter
+    def state(self, state):
+        self.board = pack_board(state)
+
+    @property
+    def prev_state(self):
+        if self.prev_board is None:
+            return None
+        return unpack_board(self.prev_board)
+
+    @prev_state.setter
+    def prev_state(self, state):
+        self.prev_board = None if state is None else pack_board(state)
+
+    def clone(self):
+        # the packed board is immutable, so the clone can share it until one
+        # of the games makes a move
+        cloned_game = object.__new__(self.__class__)
+        cloned_game.rules = self.rules
+        cloned_game.rng = self.rng
+        cloned_game.afterstates = self.afterstates
+        cloned_game.score = self.score
+        cloned_game.board = self.board
+        cloned_game.prev_board = None
+        cloned_game.delta = 0
+        cloned_game.actions_board = self.actions_board
+        cloned_game.possible_actions = self.possible_actions
+        cloned_game.new_tile = None
+        return cloned_game
+
+    def get_state(self):
+        return unpack_board(self.board)
+
+    def set_state(self, state):
+        self.prev_board = None
+        self.board = pack_board(state)
+
+    def get_empty_indices(self):
+        board = self.board
+        empty_masks = self.rules.tables.empty_masks
+        empty_positions = self.rules.tables.empty_positions
+        return (empty_positions[0][empty_masks[board & 0xFFFF]] +
+                empty_positions[1][empty_masks[(board >> 16) & 0xFFFF]] +
+                empty_positions[2][empty_masks[(board >> 32) & 0xFFFF]] +
+                empty_positions[3][empty_masks[board >> 48]])
+
+    def is_state_changed(self, action):
+        board = self.board
+        if board == self.actions_board:
+            return action in self.possible_actions
+        if self.afterstates is not None:
+            return action in self.get_possible_actions()
+        if action is self.ActionSpace.LEFT:
+            changed = self.rules.tables.changed_left
+        elif action is self.ActionSpace.RIGHT:
+            changed = self.rules.tables.changed_right
+        elif action is self.ActionSpace.UP:
+            changed = self.rules.tables.changed_left
+            board = transpose(board)
+        else:
+            changed = self.rules.tables.changed_right
+            board = transpose(board)
+        return bool(changed[board & 0xFFFF] or
+                    changed[(board >> 16) & 0xFFFF] or
+                    changed[(board >> 32) & 0xFFFF] or
+                    changed[board >> 48])
+
+    def get_possible_actions(self):
+        board = self.board
+        if board == self.actions_board:
+            return self.possible_actions[:]
+        afterstates = self.afterstates
+        if afterstates is not None:
+            entry = afterstates.get_entry(board)
+            if entry[0] is not None:
+                afterstates.hits += 1
+                self.actions_board = board
+                self.possible_actions = entry[0]
+                return entry[0][:]
+            afterstates.misses += 1
+        changed_left = self.rules.tables.changed_left
+        changed_right = self.rules.tables.changed_right
+        row0, row1, row2, row3 = split_rows(board)
+        col0, col1, col2, col3 = split_rows(transpose(board))
+        actions = []
+        if (changed_right[row0] or changed_right[row1] or
+                changed_right[row2] or changed_right[row3]):
+            actions.append(self.ActionSpace.RIGHT)
+        if (changed_left[col0] or changed_left[col1] or
+                changed_left[col2] or changed_left[col3]):
+            actions.append(self.ActionSpace.UP)
+        if (changed_left[row0] or changed_left[row1] or
+                changed_left[row2] or changed_left[row3]):
+            actions.append(self.ActionSpace.LEFT)
+        if (changed_right[col0] or changed_right[col1] or
+                changed_right[col2] or changed_right[col3]):
+            actions.append(self.ActionSpace.DOWN)
+        self.actions_board = board
+        self.possible_actions = actions
+        if afterstates is not None:
+            entry[0] = actions
+        return actions[:]
+
+    def is_finished(self):
+        board = self.board
+        if board and has_empty_tile(board):
+            return False
+        if board != self.actions_board:
+            self.get_possible_actions()
+        return not self.possible_actions
+
+    def change_state(self, action):
+        self.prev_board = board = self.board
+        afterstates = self.afterstates
+        if afterstates is not None:
+            entry = afterstates.get_entry(board)
+            afterstate = entry[action.value]
+            if afterstate is not None:
+                afterstates.hits += 1
+                self.board, self.delta = afterstate
+                return
+            afterstates.misses += 1
+        rules = self.rules
+        if action is self.ActionSpace.LEFT:
+            self.board, self.delta = move_rows(
+                board, rules.tables.left, rules.row_scores[0])
+        elif action is self.ActionSpace.RIGHT:
+            self.board, self.delta = move_rows(
+                board, rules.tables.right, rules.row_scores[1])
+        elif action is self.ActionSpace.UP:
+            board, self.delta = move_rows(
+                transpose(board), rules.tables.left, rules.row_scores[0])
+            self.board = transpose(board)
+        else:
+            board, self.delta = move_rows(
+                transpose(board), rules.tables.right, rules.row_scores[1])
+            self.board = transpose(board)
+        if afterstates is not None:
+            entry[action.value] = (self.board, self.delta)
+
+    def score_2048(self):
+        # the score of the last move is collected from the row tables in
+        # change_state
+        self.score += self.delta
+        self.delta = 0
+
+    def score_threes(self):
+        threes = self.rules.tables.threes
+        board = self.board
+        self.score = (threes[board & 0xFFFF] + threes[(board >> 16) & 0xFFFF] +
+                      threes[(board >> 32) & 0xFFFF] + threes[board >> 48])
+        self.delta = 0
+
+    def generate_tile(self):
+        # same random draws as in Game.generate_tile so that both engines play
+        # the same game for the same seed
+        tile = increment(self.empty_tile)  # tile 2
+        if self.rng.random() < self.p4:
+            tile = increment(tile)  # tile 4
+        board = self.board
+        empty_indices = self.get_empty_indices()
+        if empty_indices:
+            index = self.rng.choice(empty_indices)
+            self.board = board | tile << 4 * index
+            self.new_tile = (index, tile)
+        else:
+            self.new_tile = None
+
+    def accept(self, action):
+        self.change_state(action)
+        self.update_score()
+        self.generate_tile()
+        return unpack_board(self.board)
+
+
+# names of the engines (see get_engine)
+engine_names = ("list", "bitboard")
+
+
+def get_engine(name):
+    # engine class by its name (the games on large boards are played in
+    # batches by two048.batch.BatchGame, it is not a single game engine)
+    if name == "list":
+        return Game
+    if name == "bitboard":
+        return BitboardGame
+    raise ValueError("unknown engine {}".format(name))
+
+
 def init_randomness(rseed=42):
     random.seed(rseed)
 
 
+class RandomStream(random.Random):
+    # random number generator of a single game (or worker), choice takes a
+    # single draw of random() (its bias is below 2^-50) and is about twice as
+    # fast as random.Random.choice
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+
+class AfterstateCache:
+    # bounded memo of the moves of the boards, shared by the games that are
+    # given the cache and by their clones (the games have to have the same
+    # engine and configuration):
+    #   the entry of a board (packed board of BitboardGame, bytes of the list
+    #   state of Game) is [legal actions, afterstate of the action 1, ...,
+    #   afterstate of the action 4], the slots are filled when they are first
+    #   needed, the afterstate is engine specific: (board, delta) of
+    #   BitboardGame and (tiles, delta, empty indices) of Game
+    # the least recently used board is evicted when the cache is full, hits
+    # and misses are counted by the slots that are looked up
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_entry(self, key):
+        # entry of the board, a new empty entry is stored if there is none
+        entries = self.entries
+        entry = entries.get(key)
+        if entry is None:
+            entry = [None] * (len(Game.ActionSpace) + 1)
+            entries[key] = entry
+            if len(entries) > self.capacity:
+                entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            entries.move_to_end(key)
+        return entry
+
+    def get_report(self):
+        return {"size": len(self.entries), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+def derive_seed(seed, *keys):
+    # independent seed for the stream identified by the keys (game index,
+    # worker index, ...) of the run with the seed, the same on every platform
+    # and in every process
+    return random.Random("/".join(map(str, (seed,) + keys))).getrandbits(64)
+
+
+def draw_seed(rng):
+    # seed of a new stream drawn from the generator
+    return int(rng.random() * (1 << 53))
+
+
+def has_empty_tile(board):
+    # if any of the 16 tiles of the packed board is 0: the bits of every tile
+    # are or-ed into its lowest bit
+    board |= board >> 2
+    board |= board >> 1
+    return (~board & 0x1111111111111111) != 0
+
+
 def increment(tile):
     return tile + 1
 
 
+max_bitboard_tile = 15
+
+
+# tile values to hex digits and back, packing and unpacking go through the hex
+# representation of the board so that the conversion is done in C
+# (tiles that do not fit into 4 bits are mapped to an invalid digit)
+hex_digits = bytes(b"0123456789abcdef" + b"x" * 240)
+hex_values = bytes(b"0123456789abcdef".find(bytes([i])) % 256
+                   for i in range(256))
+
+
+def pack_board(state):
+    # list state (or already packed board) to the packed integer board
+    if isinstance(state, int):
+        return state
+    try:
+        return int(bytes(state).translate(hex_digits)[::-1], 16)
+    except ValueError:
+        raise ValueError(
+            "tiles of the state {} do not fit into 4 bits".format(state))
+
+
+def unpack_board(board, num_tiles=16):
+    # packing works for any number of tiles, the bitboard engine uses 16
+    return list(format(board, "0{}x".format(num_tiles))[::-1].encode()
+                .translate(hex_values))
+
+
+def split_rows(board):
+    return (board & 0xFFFF, (board >> 16) & 0xFFFF, (board >> 32) & 0xFFFF,
+            board >> 48)
+
+
+def transpose(board):
+    # transpose 4x4 matrix of 4 bit tiles: swap 4 bit tiles within 2x2 blocks
+    # and then swap the off-diagonal 2x2 blocks
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    board = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = board & 0xFF00FF0000FF00FF
+    b2 = board & 0x00FF00FF00000000
+    b3 = board & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def mirror(board):
+    # reverse the order of the tiles in every row of 4x4 board
+    return (((board & 0x000F000F000F000F) << 12) |
+            ((board & 0x00F000F000F000F0) << 4) |
+            ((board & 0x0F000F000F000F00) >> 4) |
+            ((board & 0xF000F000F000F000) >> 12))
+
+
+def flip(board):
+    # reverse the order of the rows of 4x4 board
+    return (((board & 0xFFFF) << 48) | ((board & 0xFFFF0000) << 16) |
+            ((board >> 16) & 0xFFFF0000) | (board >> 48))
+
+
+def board_symmetries(board):
+    # all 8 rotations and reflections of 4x4 board
+    flipped = flip(board)
+    transposed = transpose(board)
+    flipped_transposed = flip(transposed)
+    return (board, mirror(board), flipped, mirror(flipped), transposed,
+            mirror(transposed), flipped_transposed, mirror(flipped_transposed))
+
+
+@lru_cache(maxsize=None)
+def symmetries(size):
+    # index permutations of the 8 rotations and reflections of the board
+    # (in the order of board_symmetries): tile i of the transformed state is
+    # tile permutation[i] of the state
+    identity = [(i, j) for i in range(size) for j in range(size)]
+    last = size - 1
+    transforms = [lambda i, j: (i, j), lambda i, j: (i, last - j),
+                  lambda i, j: (last - i, j),
+                  lambda i, j: (last - i, last - j),
+                  lambda i, j: (j, i), lambda i, j: (last - j, i),
+                  lambda i, j: (j, last - i),
+                  lambda i, j: (last - j, last - i)]
+    return tuple(tuple(size * k + l for k, l in (transform(i, j)
+                                                 for i, j in identity))
+                 for transform in transforms)
+
+
+def move_rows(board, rows, scores):
+    # move all four rows of the board with the given row table
+    # returns the new board and the score of the move
+    row0 = board & 0xFFFF
+    row1 = (board >> 16) & 0xFFFF
+    row2 = (board >> 32) & 0xFFFF
+    row3 = board >> 48
+    return ((rows[row0] | rows[row1] << 16 | rows[row2] << 32 |
+             rows[row3] << 48),
+            scores[row0] + scores[row1] + scores[row2] + scores[row3])
+
+
+class RowTables:
+    # precomputed results of a move for every possible 16 bit row:
+    #   left, right - the row after the move to the left (towards the lowest
+    #     bits) or to the right
+    #   score, score_right - the 2048 score of the move
+    #   threes_score, threes_score_right - the threes score of the move (the
+    #     change of the threes score of the tiles)
+    #   changed_left, changed_right - if the move changes the row
+    #   threes - the threes score of the tiles in the row
+    #   empty_masks - bit mask of the empty tiles in the row
+    # and empty_positions[r][mask] - board indices of the empty tiles given by
+    # the mask in the row r
+
+    def __init__(self):
+        num_rows = 1 << 16
+        self.left = [0] * num_rows
+        self.right = [0] * num_rows
+        self.score = [0] * num_rows
+        self.score_right = [0] * num_rows
+        self.threes_score = [0] * num_rows
+        self.threes_score_right = [0] * num_rows
+        self.changed_left = bytearray(num_rows)
+        self.changed_right = bytearray(num_rows)
+        self.threes = [0] * num_rows
+        self.empty_masks = bytearray(num_rows)
+        self.empty_positions = [
+            [tuple(4 * r + i for i in range(4) if mask & 1 << i)
+             for mask in range(16)]
+            for r in range(4)]
+        for row in range(num_rows):
+            tiles = [(row >> 4 * i) & 0xF for i in range(4)]
+            moved, score = slide_row(tiles)
+            moved_row = pack_row(moved)
+            reversed_row = pack_row(tiles[::-1])
+            self.left[row] = moved_row
+            self.score[row] = score
+            self.changed_left[row] = moved_row != row
+            self.right[reversed_row] = pack_row(moved[::-1])
+            self.score_right[reversed_row] = score
+            self.changed_right[reversed_row] = moved_row != row
+            self.threes[row] = sum(pow(3, tile - 1) - 1 for tile in tiles
+                                   if tile != Game.empty_tile)
+            threes_score = sum(pow(3, tile - 1) - 1 for tile in moved
+                               if tile != Game.empty_tile) - self.threes[row]
+            self.threes_score[row] = threes_score
+            self.threes_score_right[reversed_row] = threes_score
+            self.empty_masks[row] = sum(1 << i for i in range(4)
+                                        if tiles[i] == Game.empty_tile)
+
+
+@lru_cache(maxsize=None)
+def get_row_tables():
+    # the tables are built once on the first use (takes a fraction of a second)
+    return RowTables()
+
+
+def pack_row(tiles):
+    return tiles[0] | tiles[1] << 4 | tiles[2] << 8 | tiles[3] << 12
+
 
+def slide_row(tiles):
+    # slide the row of tiles towards the first tile, returns the moved row and
+    # the 2048 score of the merges
+    tiles = [tile for tile in tiles if tile != Game.empty_tile]
+    moved = []
+    score = 0
+    i = 0
+    while i < len(tiles):
+        tile = tiles[i]
+        if (i + 1 < len(tiles) and tiles[i + 1] == tile and
+                tile < max_bitboard_tile):
+            tile = increment(tile)
+            score += 1 << tile
+            i += 1
+        moved.append(tile)
+        i += 1
+    moved += [Game.empty_tile] * (4 - len(moved))
+    return moved, score
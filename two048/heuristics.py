@@ -0,0 +1,74 @@
+# static board evaluations for the search policies
+#
+# a heuristic takes the state (list of tiles) and the size of the board and
+# returns a value in score units that is added to the game score of the state,
+# all heuristics are invariant to rotations and reflections of the board (so
+# they can be shared through the transposition table)
+
+
+def zero(state, size):
+    # plain score
+    return 0
+
+
+def empty_cells(state, size):
+    return state.count(0)
+
+
+def lines(state, size):
+    # rows and columns of the board
+    for i in range(size):
+        yield state[i * size:(i + 1) * size]
+        yield state[i::size]
+
+
+def merge_potential(state, size):
+    # number of pairs of equal tiles that would merge in a move along a line
+    merges = 0
+    for line in lines(state, size):
+        previous = 0
+        for tile in line:
+            if tile == 0:
+                continue
+            if tile == previous:
+                merges += 1
+                previous = 0
+            else:
+                previous = tile
+    return merges
+
+
+def monotonicity(state, size):
+    # minus the total deviation of the rows and columns from a monotone order
+    # of the tile ranks (0 for a board with all lines monotone)
+    penalty = 0
+    for line in lines(state, size):
+        increase = 0
+        decrease = 0
+        for first, second in zip(line, line[1:]):
+            if first < second:
+                increase += second - first
+            else:
+                decrease += first - second
+        penalty += min(increase, decrease)
+    return -penalty
+
+
+def combined(state, size):
+    # weights are chosen so that a free cell is worth about a merge of two 128
+    # tiles
+    return (256 * empty_cells(state, size) +
+            128 * merge_potential(state, size) +
+            64 * monotonicity(state, size))
+
+
+heuristics = {"score": zero, "empty_cells": empty_cells,
+              "merge_potential": merge_potential,
+              "monotonicity": monotonicity, "combined": combined}
+
+
+def get_heuristic(heuristic):
+    # heuristic function or its name
+    if callable(heuristic):
+        return heuristic
+    return heuristics[heuristic]
@@ -3,6 +3,12 @@ class Model:
 
     def __init__(self, trajectory=None):
         self.trajectory = [] if trajectory is None else trajectory[:]
+        # decision reports of the policy (see agent.interact)
+        self.reports = []
 
-    def update(self, observed_state):
+    def update(self, observed_state, action=None, game=None, report=None):
+        # action and game (after the move) are passed by agent.interact for
+        # the models that record more than the states
         self.trajectory.append(observed_state)
+        if report is not None:
+            self.reports.append(report)
@@ -0,0 +1,210 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from .batch import legal_actions, move_boards, spawn_tiles
+from .game import Game, get_rules, symmetries
+
+
+# n-tuple network - learned value of a board as the sum of the entries of
+# lookup tables indexed by the tiles at fixed tuples of cells, every tuple is
+# applied to all 8 rotations and reflections of the board (the value is
+# symmetric) and the tables are trained by TD(0) on the afterstates (boards
+# after a move, before the new tile) in self-play
+#
+# usage from the repository root:
+#   python -m two048.ntuple --games 100000 --output ntuple.npy
+# the weights are kept in a .npy file that is memory mapped, so a training
+# run can be continued and the policies of many worker processes share the
+# pages of one file
+
+
+# the 4 6-tuples of Szubert and Jaskowski, "Temporal difference learning of
+# n-tuple networks for the game 2048" (two rows, two 2x3 rectangles)
+default_tuples = ((0, 1, 2, 3, 4, 5), (4, 5, 6, 7, 8, 9),
+                  (0, 1, 2, 4, 5, 6), (4, 5, 6, 8, 9, 10))
+
+# tiles above are looked up as this tile (32768)
+max_tile = 15
+
+
+class NTupleNetwork:
+    # tuples - tuples of cell indices of the board, all of the same length
+    # weights - flat float32 array of the tables (numpy array or memmap),
+    #   zeros if None
+
+    def __init__(self, tuples=default_tuples, size=4, weights=None):
+        self.tuples = tuple(tuple(cells) for cells in tuples)
+        self.size = size
+        length = len(self.tuples[0])
+        if any(len(cells) != length for cells in self.tuples):
+            raise ValueError("tuples have to be of the same length")
+        table_size = (max_tile + 1) ** length
+        num_weights = table_size * len(self.tuples)
+        if weights is None:
+            weights = np.zeros(num_weights, dtype=np.float32)
+        elif weights.shape != (num_weights,):
+            raise ValueError("{} weights do not fit {} tuples of length "
+                             "{}".format(weights.shape, len(self.tuples),
+                                         length))
+        self.weights = weights
+
+        # cells and table offsets of the features - every tuple in every
+        # symmetry, the tuple i of a transformed board is read from the cells
+        # permutation[cell] of the board
+        self.cells = np.array([[permutation[cell] for cell in cells]
+                               for permutation in symmetries(size)
+                               for cells in self.tuples], dtype=np.intp)
+        self.offsets = np.tile(np.arange(len(self.tuples)) * table_size,
+                               len(symmetries(size)))
+        self.powers = (max_tile + 1) ** np.arange(length)
+
+    def get_indices(self, boards):
+        # (N, features) indices into the weights of the (N, size * size)
+        # boards
+        tiles = np.minimum(np.asarray(boards), max_tile).astype(np.intp)
+        return tiles[:, self.cells] @ self.powers + self.offsets
+
+    def evaluate(self, boards):
+        # values of the (N, size * size) boards
+        return self.weights[self.get_indices(boards)].sum(axis=1,
+                                                          dtype=np.float64)
+
+    def update(self, boards, steps):
+        # add the steps (one per board) to all the weights of the boards
+        indices = self.get_indices(boards)
+        np.add.at(self.weights, indices.ravel(),
+                  np.repeat(np.asarray(steps, dtype=np.float32),
+                            indices.shape[1]))
+
+    def save(self, path):
+        # weights to the .npy file and the tuples to path + ".json"
+        weights = np.lib.format.open_memmap(path, mode="w+",
+                                            dtype=np.float32,
+                                            shape=self.weights.shape)
+        weights[:] = self.weights
+        weights.flush()
+        with open(path + ".json", "w") as config_file:
+            json.dump({"tuples": self.tuples, "size": self.size}, config_file)
+
+    @classmethod
+    def load(cls, path, mode="r"):
+        # network with the weights memory mapped from the file saved by save,
+        # with mode "r+" the changes of the weights are written to the file
+        with open(path + ".json") as config_file:
+            config = json.load(config_file)
+        return cls(config["tuples"], config["size"],
+                   np.load(path, mmap_mode=mode))
+
+
+def train(network, games_num, batch_size=64, learning_rate=0.0025,
+          probability_of_4=0.1, seed=0, progress=None):
+    # TD(0) learning of the afterstate values in self-play, batch_size games
+    # are played in lockstep by the numpy engine and a finished game is
+    # replaced by a new one until games_num games are played
+    #   the greedy action maximizes the score of the move plus the value of
+    #   the afterstate, the value of the previous afterstate of the game is
+    #   moved towards this maximum (0 after the last move)
+    # progress: function called with (finished games, games_num)
+    # returns the final scores of the games in the order they finished
+    size = network.size
+    num_tiles = size * size
+    rng = np.random.default_rng(seed)
+    lines = np.array([get_rules(Game, size, probability_of_4,
+                                "2048").index_sequences[action]
+                      for action in Game.ActionSpace], dtype=np.intp)
+    actions = np.arange(len(lines))
+
+    slots = min(batch_size, games_num)
+    boards = spawn_tiles(np.zeros((slots, num_tiles), dtype=np.uint8), rng,
+                         probability_of_4)
+    after_boards = np.zeros_like(boards)
+    has_after = np.zeros(slots, dtype=bool)
+    scores = np.zeros(slots, dtype=np.int64)
+    started = slots
+    final_scores = []
+    while len(boards):
+        legal = legal_actions(boards, lines)
+        moved, rewards = move_boards(np.repeat(boards, len(actions), axis=0),
+                                     np.tile(actions, len(boards)), lines)
+        values = rewards + network.evaluate(moved)
+        values = np.where(legal.ravel(), values, -np.inf).reshape(legal.shape)
+        best = values.argmax(axis=1)
+        finished = ~legal.any(axis=1)
+        targets = np.where(finished, 0, values[np.arange(len(boards)), best])
+
+        if has_after.any():
+            previous = after_boards[has_after]
+            errors = targets[has_after] - network.evaluate(previous)
+            network.update(previous, learning_rate * errors)
+
+        chosen = np.arange(len(boards)) * len(actions) + best
+        after_boards = moved[chosen]
+        has_after = ~finished
+        scores += np.where(finished, 0, rewards[chosen])
+        boards = spawn_tiles(after_boards, rng, probability_of_4)
+
+        # finished games are replaced by new ones, the slots of the last games
+        # are dropped
+        dropped = np.zeros(len(boards), dtype=bool)
+        for slot in np.flatnonzero(finished):
+            final_scores.append(int(scores[slot]))
+            if progress is not None:
+                progress(len(final_scores), games_num)
+            if started < games_num:
+                boards[slot] = spawn_tiles(
+                    np.zeros((1, num_tiles), dtype=np.uint8), rng,
+                    probability_of_4)[0]
+                scores[slot] = 0
+                started += 1
+            else:
+                dropped[slot] = True
+        if dropped.any():
+            playing = ~dropped
+            boards = boards[playing]
+            after_boards = after_boards[playing]
+            has_after = has_after[playing]
+            scores = scores[playing]
+    return np.array(final_scores)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m two048.ntuple",
+        description="train an n-tuple network by TD(0) self-play")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--output", required=True,
+                        help="weights file (.npy), an existing file is "
+                        "trained further")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--learning-rate", type=float, default=0.0025)
+    parser.add_argument("--probability-of-4", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        network = NTupleNetwork.load(args.output, mode="r+")
+    except FileNotFoundError:
+        NTupleNetwork().save(args.output)
+        network = NTupleNetwork.load(args.output, mode="r+")
+
+    def progress(finished, games_num):
+        if finished % 100 == 0 or finished == games_num:
+            print("\r{}/{} games finished".format(finished, games_num),
+                  end="", file=sys.stderr, flush=True)
+
+    scores = train(network, args.games, batch_size=args.batch_size,
+                   learning_rate=args.learning_rate,
+                   probability_of_4=args.probability_of_4, seed=args.seed,
+                   progress=progress)
+    network.weights.flush()
+    print(file=sys.stderr)
+    last = scores[-min(len(scores), 1000):]
+    print("average score of the last {} games: {}".format(len(last),
+                                                          np.mean(last)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import os
+
+import numpy as np
+
+from .game import pack_board
+
+
+# trajectories of many games in an append-only binary file
+#
+# the data file is a header followed by fixed size step records, a game of n
+# moves is n + 1 consecutive records: the initial state (action 0) and the
+# states after every move and its new tile
+#   board - tiles packed by 4 bits (tile i in the bits 4 * i .. 4 * i + 3,
+#     the same as two048.game.pack_board) into little endian 64 bit words,
+#     a single word for 4x4 boards, tiles above 15 can not be recorded
+#   action - value of the Game.ActionSpace member (0 - initial state)
+#   spawn_index, spawn_tile - cell and tile placed after the move (no_spawn
+#     if no tile was placed), so the boards have at most no_spawn cells
+#   delta - score gained by the move (the score of the initial state)
+# the index file (path + ".index") holds (first record, number of records)
+# of every game, a game is written to the index only after all its records
+# are written to the data file, so the records of an unfinished game are
+# never read (they and an incomplete index entry are dropped when the file is
+# opened for appending)
+#
+# usage:
+#   with TrajectoryRecorder("games.trj", size=4) as recorder:
+#       game = Game()
+#       recorder.start_game(game)
+#       while not game.is_finished():
+#           agent.interact(policy, game, recorder)
+#       recorder.end_game()
+#   games = TrajectoryReader("games.trj")
+#   games[0]["board"]
+
+
+magic = b"2048TRJ\x01"
+header_size = 16
+no_spawn = 255
+
+
+def get_step_dtype(size):
+    words = (size * size + 15) // 16
+    return np.dtype([("board", "<u8", (words,) if words > 1 else ()),
+                     ("action", "u1"), ("spawn_index", "u1"),
+                     ("spawn_tile", "u1"), ("delta", "<i4")])
+
+
+def get_index_path(path):
+    return path + ".index"
+
+
+class TrajectoryRecorder:
+    # Model that streams the games it observes to the file, see the format
+    # above, an existing file is appended to
+    #   buffer_size - number of records kept in memory before they are written
+
+    def __init__(self, path, size=4, buffer_size=1 << 14):
+        if size * size > no_spawn:
+            raise ValueError("boards of size {} can not be recorded".format(
+                size))
+        self.path = path
+        self.size = size
+        self.words = (size * size + 15) // 16
+        self.dtype = get_step_dtype(size)
+        self.buffer_size = buffer_size
+        self.steps = []
+        self.games = []
+        self.game_start = None
+        self.score = 0
+
+        index_path = get_index_path(path)
+        if os.path.exists(path):
+            read_header(path, size)
+            index = read_index(index_path)
+            self.num_records = int(index[-1].sum()) if len(index) else 0
+            # records of a game that was not finished are dropped, and so is
+            # an index entry that was not completely written
+            with open(path, "r+b") as data_file:
+                data_file.truncate(header_size +
+                                   self.num_records * self.dtype.itemsize)
+            with open(index_path, "r+b") as index_file:
+                index_file.truncate(index.nbytes)
+        else:
+            with open(path, "wb") as data_file:
+                data_file.write(magic + np.array(
+                    [size, 0], dtype="<u4").tobytes())
+            open(index_path, "wb").close()
+            self.num_records = 0
+        self.data_file = open(path, "ab")
+        self.index_file = open(index_path, "ab")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def start_game(self, game):
+        # record the initial state of the game
+        if game.size != self.size:
+            raise ValueError("recorder of size {} boards can not record a "
+                             "game of size {}".format(self.size, game.size))
+        if self.game_start is not None:
+            self.end_game()
+        self.game_start = self.num_records + len(self.steps)
+        self.score = 0
+        self.record(game.get_state(), 0, game)
+
+    def update(self, observed_state, action=None, game=None, report=None):
+        # called by agent.interact after every move (reports are not
+        # recorded)
+        self.record(observed_state, action.value, game)
+
+    def record(self, state, action_value, game):
+        # for the initial state the new tile is the one placed by the game
+        # constructor (none if the game was created from a state)
+        if game.new_tile is None:
+            spawn_index, spawn_tile = no_spawn, 0
+        else:
+            spawn_index, spawn_tile = game.new_tile
+        score = game.get_value()
+        board = pack_board(state)
+        if self.words > 1:
+            board = tuple((board >> 64 * i) & 0xFFFFFFFFFFFFFFFF
+                          for i in range(self.words))
+        self.steps.append((board, action_value, spawn_index, spawn_tile,
+                           score - self.score))
+        self.score = score
+        if len(self.steps) >= self.buffer_size:
+            self.write_steps()
+
+    def end_game(self):
+        # the game is complete, its records and its index entry are written
+        if self.game_start is None:
+            return
+        self.games.append((self.game_start, self.num_records +
+                           len(self.steps) - self.game_start))
+        self.game_start = None
+        self.flush()
+
+    def write_steps(self):
+        if self.steps:
+            self.data_file.write(np.array(self.steps, dtype=self.dtype)
+                                 .tobytes())
+            self.num_records += len(self.steps)
+            self.steps = []
+
+    def flush(self):
+        self.write_steps()
+        self.data_file.flush()
+        if self.games:
+            self.index_file.write(np.array(self.games, dtype="<u8").tobytes())
+            self.index_file.flush()
+            self.games = []
+
+    def close(self):
+        self.end_game()
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+
+
+class TrajectoryReader:
+    # memory mapped trajectories of a file written by TrajectoryRecorder,
+    # games are numpy views of the records (see get_step_dtype) and are not
+    # copied
+
+    def __init__(self, path):
+        self.path = path
+        self.size = read_header(path, None)
+        self.dtype = get_step_dtype(self.size)
+        self.index = read_index(get_index_path(path))
+        num_records = int(self.index[-1].sum()) if len(self.index) else 0
+        if num_records:
+            self.records = np.memmap(path, dtype=self.dtype, mode="r",
+                                     offset=header_size, shape=(num_records,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, game):
+        start, length = self.index[game]
+        return self.records[start:start + length]
+
+    def __iter__(self):
+        for game in range(len(self)):
+            yield self[game]
+
+    def get_states(self, steps):
+        # (len(steps), size * size) uint8 array of the tiles of the boards
+        return unpack_boards(steps["board"], self.size)
+
+
+def unpack_boards(boards, size):
+    # packed boards (array of words, see get_step_dtype) to the tiles
+    boards = np.asarray(boards, dtype=np.uint64).reshape(len(boards), -1)
+    shifts = np.arange(16, dtype=np.uint64) * np.uint64(4)
+    tiles = (boards[:, :, None] >> shifts) & np.uint64(0xF)
+    return tiles.reshape(len(boards), -1)[:, :size * size].astype(np.uint8)
+
+
+def read_header(path, size):
+    # size of the boards of the file, checked against the expected size
+    with open(path, "rb") as data_file:
+        header = data_file.read(header_size)
+    if len(header) != header_size or header[:len(magic)] != magic:
+        raise ValueError("{} is not a trajectory file".format(path))
+    file_size = int(np.frombuffer(header, dtype="<u4", count=1,
+                                  offset=len(magic))[0])
+    if size is not None and file_size != size:
+        raise ValueError("{} holds games of size {}, not {}".format(
+            path, file_size, size))
+    return file_size
+
+
+def read_index(path):
+    # (first record, number of records) of the games, an incomplete entry of
+    # an interrupted write is ignored
+    index = np.fromfile(path, dtype="<u8")
+    return index[:len(index) // 2 * 2].reshape(-1, 2)
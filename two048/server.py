@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import time
+
+import policy
+from .game import (RandomStream, derive_seed, draw_seed, engine_names,
+                   get_engine)
+
+
+# asyncio front end that serves the games of many concurrent sessions (players
+# and bots), the searches of the suggested moves (hints) are pure monte carlo
+# searches (see policy.PureMCTS) whose playouts are played in the shared
+# process pool of policy.get_pool, so the event loop is never blocked by a
+# search
+#
+# every search plays rounds of round_samples playouts per action, a round is
+# one task of the pool and holds its playouts of the global rollout budget
+# until the worker has finished it, the searches waiting for the budget are
+# served in the order they asked for it, so the budget is shared fairly by the
+# sessions however many rounds their searches want
+#
+# a search stops at its deadline (the action is chosen from the playouts
+# finished by then) and is cancelled when its session is closed (the client
+# disconnected) or a new hint of the session is asked for, the rounds that
+# were not started are dropped
+#
+# the network layer is left out, simulate plays the clients in the same event
+# loop and measures the throughput and the latencies of the hints:
+#   python -m two048.server --sessions 32 --moves 20 --workers 4
+
+
+class RolloutBudget:
+    # number of playouts that may be played at the same time by all the
+    # searches, acquire waits in first come, first served order
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = capacity
+        self.waiters = collections.deque()
+        self.played = 0
+
+    async def acquire(self, count):
+        if count > self.capacity:
+            raise ValueError("{} playouts do not fit the budget of {}".format(
+                count, self.capacity))
+        if not self.waiters and count <= self.available:
+            self.available -= count
+            return
+        waiter = (asyncio.get_running_loop().create_future(), count)
+        self.waiters.append(waiter)
+        try:
+            await waiter[0]
+        except asyncio.CancelledError:
+            if waiter[0].cancelled():
+                self.waiters.remove(waiter)
+                # the waiters behind it may fit now
+                self.wake()
+            else:
+                # the budget was granted just before the cancellation
+                self.release(count)
+            raise
+
+    def release(self, count):
+        self.available += count
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.waiters[0][1] <= self.available:
+            future, count = self.waiters.popleft()
+            self.available -= count
+            future.set_result(None)
+
+
+class Session:
+
+    def __init__(self, session_id, game):
+        self.id = session_id
+        self.game = game
+        # task of the running search (None - no search)
+        self.search = None
+
+
+class GameServer:
+    # workers: number of processes of the playouts
+    # rollout_budget: number of playouts in flight over all the sessions
+    # samples, round_samples, batched: playouts per action of a search, of
+    #   one round of an action and their engine (see policy.PureMCTS)
+    # deadline_ms: default deadline of a search (None - no deadline)
+    # seed: the game of the session i is seeded by derive_seed(seed, i)
+    #   unless the session is opened with its own seed
+    # game_kwargs: arguments of the games (size, probability_of_4, scoring)
+
+    def __init__(self, workers=2, rollout_budget=400, samples=100,
+                 round_samples=10, batched=None, deadline_ms=None,
+                 engine="list", seed=0, **game_kwargs):
+        if round_samples > rollout_budget:
+            raise ValueError("round_samples has to fit the rollout budget")
+        self.workers = workers
+        self.budget = RolloutBudget(rollout_budget)
+        self.search_policy = policy.PureMCTS(
+            samples=samples, batched=batched, round_samples=round_samples)
+        self.deadline_ms = deadline_ms
+        self.engine = get_engine(engine)
+        self.seed = seed
+        self.game_kwargs = game_kwargs
+        self.sessions = {}
+        self.session_ids = itertools.count()
+
+    def open_session(self, seed=None):
+        # id of a new session with a new game
+        session_id = next(self.session_ids)
+        if seed is None:
+            seed = derive_seed(self.seed, session_id)
+        self.sessions[session_id] = Session(session_id, self.engine(
+            rng=RandomStream(seed), **self.game_kwargs))
+        return session_id
+
+    def close_session(self, session_id):
+        # the running search of the session is cancelled
+        session = self.sessions.pop(session_id)
+        if session.search is not None:
+            session.search.cancel()
+
+    def get_state(self, session_id):
+        game = self.sessions[session_id].game
+        return {"session": session_id, "state": game.get_state(),
+                "score": game.get_value(),
+                "actions": [action.name
+                            for action in game.get_possible_actions()]}
+
+    def move(self, session_id, action):
+        # plays the action (its name) in the game of the session, the search
+        # of the previous state is cancelled
+        session = self.sessions[session_id]
+        game = session.game
+        action = game.ActionSpace[action]
+        if action not in game.get_possible_actions():
+            raise ValueError("{} is not a legal action".format(action.name))
+        if session.search is not None:
+            session.search.cancel()
+        game.accept(action)
+        return self.get_state(session_id)
+
+    async def hint(self, session_id, deadline_ms=None):
+        # report of the search of the best action of the session:
+        #   action - name of the action (None if the game is finished)
+        #   playouts - number of the playouts played
+        #   time - wall time of the search (seconds)
+        #   timed_out - the search was stopped by the deadline
+        session = self.sessions[session_id]
+        if session.search is not None:
+            session.search.cancel()
+        if deadline_ms is None:
+            deadline_ms = self.deadline_ms
+        search = asyncio.ensure_future(self.search(session.game, deadline_ms))
+        session.search = search
+        try:
+            return await search
+        finally:
+            if session.search is search:
+                session.search = None
+
+    async def search(self, game, deadline_ms):
+        start = time.perf_counter()
+        actions = game.get_possible_actions()
+        if not actions:
+            return {"action": None, "playouts": 0,
+                    "time": time.perf_counter() - start, "timed_out": False}
+        # the seeds of the rounds are drawn from the game, so the hints of a
+        # session are reproducible when its rounds finish in the same order
+        seeds = RandomStream(draw_seed(game.rng))
+        scores = [[] for _ in actions]
+        searches = [asyncio.ensure_future(
+            self.search_action(game, action, action_scores, seeds))
+            for action, action_scores in zip(actions, scores)]
+        timeout = None if deadline_ms is None else deadline_ms / 1000
+        try:
+            _, pending = await asyncio.wait(searches, timeout=timeout)
+        finally:
+            # cancelled by the session, or the deadline
+            for action_search in searches:
+                action_search.cancel()
+        for action_search in searches:
+            if action_search.done() and not action_search.cancelled():
+                action_search.result()
+        action = self.search_policy.choose(game, actions, scores,
+                                           range(len(actions)))
+        playouts = sum(len(action_scores) for action_scores in scores)
+        return {"action": action.name, "playouts": playouts,
+                "time": time.perf_counter() - start,
+                "timed_out": bool(pending)}
+
+    async def search_action(self, game, action, scores, seeds):
+        # rounds of the playouts of the action until it has samples playouts
+        samples = self.search_policy.samples
+        round_samples = self.search_policy.round_samples
+        loop = asyncio.get_running_loop()
+        while len(scores) < samples:
+            count = min(round_samples, samples - len(scores))
+            await self.budget.acquire(count)
+            # the budget is returned when the worker has finished the round,
+            # even if the search is cancelled in the meantime
+            future = policy.get_pool(self.workers).submit(
+                policy.play_shard, type(game), game.get_state(),
+                game.get_value(), game.size, game.p4, game.scoring,
+                [action.value], [count], self.search_policy.is_batched(game),
+                seeds.getrandbits(64))
+            future.add_done_callback(
+                lambda _, count=count: loop.is_closed() or
+                loop.call_soon_threadsafe(self.budget.release, count))
+            round_scores = await asyncio.wrap_future(future)
+            scores += round_scores[0]
+            self.budget.played += count
+
+
+async def play_client(server, moves, deadline_ms, latencies):
+    # bot that asks for a hint and plays it until the game is finished or it
+    # has played the moves, then it disconnects
+    session_id = server.open_session()
+    try:
+        for _ in range(moves):
+            report = await server.hint(session_id, deadline_ms)
+            latencies.append(report["time"])
+            if report["action"] is None:
+                break
+            server.move(session_id, report["action"])
+    finally:
+        server.close_session(session_id)
+
+
+async def simulate(server, sessions_num, moves, deadline_ms=None):
+    # throughput and latencies (seconds) of sessions_num clients playing at
+    # the same time
+    import numpy as np
+
+    latencies = []
+    played = server.budget.played
+    start = time.perf_counter()
+    await asyncio.gather(*(play_client(server, moves, deadline_ms, latencies)
+                           for _ in range(sessions_num)))
+    elapsed = time.perf_counter() - start
+    percentiles = np.percentile(latencies, [50, 90, 99]) if latencies else [
+        None] * 3
+    return {"sessions": sessions_num, "hints": len(latencies),
+            "time": elapsed, "hints_per_second": len(latencies) / elapsed,
+            "playouts_per_second": (server.budget.played - played) / elapsed,
+            "latency_p50": percentiles[0], "latency_p90": percentiles[1],
+            "latency_p99": percentiles[2],
+            "latency_max": max(latencies) if latencies else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m two048.server",
+        description="measure the throughput and the latencies of the hints "
+        "of simultaneous sessions")
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--moves", type=int, default=10,
+                        help="hints and moves of every session")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--rollout-budget", type=int, default=400)
+    parser.add_argument("--samples", type=int, default=100,
+                        help="playouts per action of a search")
+    parser.add_argument("--round-samples", type=int, default=10)
+    parser.add_argument("--batched", action="store_true", default=None,
+                        help="batch the playouts (the default on large "
+                        "boards)")
+    parser.add_argument("--deadline-ms", type=float, default=None)
+    parser.add_argument("--engine", choices=engine_names, default="list")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = GameServer(workers=args.workers,
+                        rollout_budget=args.rollout_budget,
+                        samples=args.samples, round_samples=args.round_samples,
+                        batched=args.batched, engine=args.engine,
+                        seed=args.seed)
+    try:
+        results = asyncio.run(simulate(server, args.sessions, args.moves,
+                                       args.deadline_ms))
+    finally:
+        policy.shutdown_pools()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from time import perf_counter
+
+
+# opt-in instrumentation of the game engines and the decision reports of the
+# search policies
+#
+# the engine classes are never changed: instrument returns a clone of the game
+# whose class is a subclass of the engine that counts and times the engine
+# operations, the clones of the clone are instrumented as well (clone keeps
+# the class), so the games that are not instrumented pay nothing
+#
+# the timers are nested where the operations are: is_finished of the list
+# engine includes the get_possible_actions it calls
+
+
+# engine methods that are counted and timed, by the name in the report
+timed_methods = {"clone": "clone", "move": "change_state",
+                 "spawn": "generate_tile", "score": "update_score",
+                 "legal_actions": "get_possible_actions",
+                 "is_finished": "is_finished"}
+
+
+class Stats:
+    # counters and timers (total seconds) by name
+
+    def __init__(self):
+        self.counts = {}
+        self.times = {}
+        # instrumented subclasses of the engines that report to these stats
+        self.classes = {}
+
+    def add(self, name, elapsed):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.times[name] = self.times.get(name, 0) + elapsed
+
+    def count(self, name, number=1):
+        self.counts[name] = self.counts.get(name, 0) + number
+
+    def clear(self):
+        self.counts = {}
+        self.times = {}
+
+    def get_report(self):
+        return {name: {"count": count, "time": self.times.get(name, 0)}
+                for name, count in self.counts.items()}
+
+
+def timed(name, method):
+    def timed_method(self, *args):
+        start = perf_counter()
+        result = method(self, *args)
+        self.stats.add(name, perf_counter() - start)
+        return result
+    timed_method.__name__ = method.__name__
+    return timed_method
+
+
+def instrument(game, stats):
+    # clone of the game that reports its engine operations (and those of its
+    # clones) to stats
+    engine = type(game)
+    if getattr(engine, "stats", None) is not None:
+        engine = engine.__bases__[0]
+    if engine not in stats.classes:
+        namespace = {method: timed(name, getattr(engine, method))
+                     for name, method in timed_methods.items()}
+        namespace["stats"] = stats
+        stats.classes[engine] = type("Instrumented" + engine.__name__,
+                                     (engine,), namespace)
+    instrumented = engine.clone(game)
+    instrumented.__class__ = stats.classes[engine]
+    return instrumented
+
+
+def sample_statistics(values):
+    # number, mean and variance of the values
+    count = len(values)
+    mean = sum(values) / count if count else None
+    variance = None
+    if count > 1:
+        variance = sum((value - mean) ** 2 for value in values) / (count - 1)
+    return {"samples": count, "value": mean, "variance": variance}
+
+
+def decision_report(policy, action, elapsed, actions, engine_stats=None,
+                    **counts):
+    # report of a decision of the policy:
+    #   action - name of the chosen action
+    #   time - wall time of the decision (seconds)
+    #   actions - statistics of the actions by their names
+    #   engine - counts and times of the engine operations (Stats.get_report)
+    #   counts of the search (playouts, nodes, ...) and their rates per second
+    report = {"policy": type(policy).__name__, "action": action.name,
+              "time": elapsed,
+              "actions": {action.name: statistics
+                          for action, statistics in actions.items()}}
+    if engine_stats is not None:
+        report["engine"] = engine_stats.get_report()
+        counts["moves"] = engine_stats.counts.get("move", 0)
+    for name, count in counts.items():
+        report[name] = count
+        report[name + "_per_second"] = count / elapsed if elapsed else None
+    return report
@@ -0,0 +1,330 @@
+import argparse
+import ast
+import importlib
+import inspect
+import itertools
+import json
+import math
+import sqlite3
+import sys
+from statistics import NormalDist
+
+from .evaluate import play_game
+from .game import Game, derive_seed, engine_names
+
+
+# sweep of a policy over a grid of its arguments and the arguments of the
+# games, the games are played in rounds of round_games games of every config
+# that is still running and the results are kept in a sqlite store, so an
+# interrupted sweep is resumed (and a finished one extended) without playing
+# the stored games again
+#
+# the game i of every config is played with the same seed (derive_seed(seed,
+# i), as in two048.evaluate), so the configs are compared on the same tile
+# draws, after every round a config whose score interval is below the interval
+# of the leader (the best mean score) is stopped, the decisions depend only on
+# the finished rounds, so the results do not depend on the number of workers
+#
+# usage from the repository root:
+#   python -m two048.sweep policy.PureMCTS --policy-grid samples=10,50,100 \
+#       --game-grid scoring=2048,threes probability_of_4=0.1,0.2 \
+#       --games 200 --workers 8 --store sweep.sqlite
+
+
+def make_grid(policy, policy_grid=None, game_grid=None, engine="list"):
+    # configs of all the combinations of the values of the grids (dicts of
+    # argument name -> list of values), several grids (e.g. of different
+    # policies) can be swept together by joining their configs
+    policy_grid = policy_grid or {}
+    game_grid = game_grid or {}
+    configs = []
+    for policy_values in itertools.product(*policy_grid.values()):
+        for game_values in itertools.product(*game_grid.values()):
+            configs.append({
+                "policy": policy,
+                "policy_kwargs": dict(zip(policy_grid, policy_values)),
+                "engine": engine,
+                "game_kwargs": dict(zip(game_grid, game_values))})
+    return configs
+
+
+def get_label(config):
+    # short name of the config in the reports
+    kwargs = dict(config["policy_kwargs"], **config["game_kwargs"])
+    return "{}({})".format(config["policy"].rsplit(".", 1)[-1], ", ".join(
+        "{}={!r}".format(name, value) for name, value in kwargs.items()))
+
+
+class ResultStore:
+    # results of the games of the configs in a sqlite database (":memory:" -
+    # not kept on disk), a config is identified by its json (with the seed of
+    # the sweep) and the game by its index (the seed of the game is derived
+    # from them)
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            create table if not exists configs (
+                id integer primary key, key text unique not null);
+            create table if not exists results (
+                config integer not null references configs(id),
+                game integer not null, score integer not null,
+                largest_tile integer not null, move_count integer not null,
+                primary key (config, game));
+        """)
+
+    def get_config_id(self, config, seed):
+        key = json.dumps(dict(config, seed=seed), sort_keys=True)
+        self.connection.execute(
+            "insert or ignore into configs (key) values (?)", (key,))
+        return self.connection.execute(
+            "select id from configs where key = ?", (key,)).fetchone()[0]
+
+    def get_games(self, config_id):
+        # indices of the stored games of the config
+        return {game for game, in self.connection.execute(
+            "select game from results where config = ?", (config_id,))}
+
+    def add(self, config_id, result):
+        self.connection.execute(
+            "insert or replace into results values (?, ?, ?, ?, ?)",
+            (config_id, result["game"], result["score"],
+             result["largest_tile"], result["move_count"]))
+
+    def get_results(self, config_ids, games_num=None):
+        # arrays of the position of the config in config_ids, score, largest
+        # tile and move count of the stored games (the games below games_num)
+        import numpy as np
+
+        positions = {config_id: i for i, config_id in enumerate(config_ids)}
+        query = "select config, score, largest_tile, move_count from " \
+            "results where config in ({})".format(
+                ", ".join("?" * len(config_ids)))
+        parameters = list(config_ids)
+        if games_num is not None:
+            query += " and game < ?"
+            parameters.append(games_num)
+        rows = self.connection.execute(query, parameters).fetchall()
+        results = np.array(rows, dtype=float).reshape(len(rows), 4)
+        config = np.array([positions[config_id]
+                           for config_id in results[:, 0].astype(int)],
+                          dtype=int)
+        return config, results[:, 1], results[:, 2], results[:, 3]
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def summarize(config, score, largest_tile, move_count, configs_num,
+              confidence=0.95):
+    # statistics of the configs (arrays by the position of the config) from
+    # the results of all the configs at once (the arrays of
+    # ResultStore.get_results):
+    #   games, score (mean), std (sample standard deviation of the score),
+    #   low, high - normal confidence interval of the mean score,
+    #   largest_tile, move_count - means
+    # the statistics of the configs without games (or std and the interval
+    # with one game) are nan
+    import numpy as np
+
+    games = np.bincount(config, minlength=configs_num)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(config, score, configs_num) / games
+        squares = np.bincount(config, (score - mean[config]) ** 2,
+                              configs_num)
+        std = np.sqrt(squares / (games - 1))
+        half = NormalDist().inv_cdf((1 + confidence) / 2) * std / np.sqrt(
+            games)
+        return {"games": games, "score": mean, "std": std,
+                "low": mean - half, "high": mean + half,
+                "largest_tile": np.bincount(config, largest_tile,
+                                            configs_num) / games,
+                "move_count": np.bincount(config, move_count,
+                                          configs_num) / games}
+
+
+def get_stopped(summary, min_games):
+    # mask of the configs whose score interval is entirely below the interval
+    # of the leader, only the configs with at least min_games games are
+    # compared
+    import numpy as np
+
+    compared = summary["games"] >= max(min_games, 2)
+    if not compared.any():
+        return np.zeros(len(compared), dtype=bool)
+    leader = np.flatnonzero(compared)[np.argmax(summary["score"][compared])]
+    return compared & (summary["high"] < summary["low"][leader])
+
+
+def run_sweep(configs, games_num, store, seed=42, workers=None,
+              round_games=10, min_games=20, confidence=0.95, early_stop=True,
+              progress=None):
+    # configs: configs of make_grid
+    # games_num: number of games of a config that is not stopped
+    # store: ResultStore, the stored games are not played again
+    # workers: number of processes to play the games in (None - play in this
+    #   process), the games of a round are played in parallel
+    # min_games, confidence: a config is compared with the leader after
+    #   min_games games by the confidence intervals of their mean scores
+    # progress: function called with (played games, games to play in the
+    #   round) after every game
+    #
+    # returns the summary of the configs (see summarize) with the mask of the
+    # stopped configs (stopped)
+    import numpy as np
+
+    config_ids = [store.get_config_id(config, seed) for config in configs]
+    seeds = [derive_seed(seed, i) for i in range(games_num)]
+    stopped = np.zeros(len(configs), dtype=bool)
+    pool = None
+    if workers is not None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            summary = summarize(*store.get_results(config_ids, games_num),
+                                len(configs), confidence)
+            if early_stop:
+                stopped |= get_stopped(summary, min_games)
+            # the next games of the running configs, the games missing below
+            # the round are played first
+            played = min(summary["games"][~stopped], default=games_num)
+            end = min(played + round_games, games_num)
+            jobs = []
+            for i, config in enumerate(configs):
+                if stopped[i] or summary["games"][i] >= end:
+                    continue
+                games = store.get_games(config_ids[i])
+                jobs += [(i, game) for game in range(end) if game not in games]
+            if not jobs:
+                break
+            play_round(configs, config_ids, jobs, seeds, store, pool,
+                       progress)
+    finally:
+        store.commit()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    summary["stopped"] = stopped
+    return summary
+
+
+def play_round(configs, config_ids, jobs, seeds, store, pool, progress):
+    def get_arguments(i, game):
+        config = configs[i]
+        return (config["policy"], config["policy_kwargs"], config["engine"],
+                config["game_kwargs"], game, seeds[game])
+
+    if pool is None:
+        results = ((i, play_game(*get_arguments(i, game))) for i, game in jobs)
+    else:
+        from concurrent.futures import as_completed
+
+        futures = {pool.submit(play_game, *get_arguments(i, game)): i
+                   for i, game in jobs}
+        results = ((futures[future], future.result())
+                   for future in as_completed(futures))
+    for played, (i, result) in enumerate(results, 1):
+        store.add(config_ids[i], result)
+        if progress is not None:
+            progress(played, len(jobs))
+    store.commit()
+
+
+def parse_grid(items, target=None):
+    # name=value,value,... pairs, values are python literals or strings, the
+    # values of the arguments of the target (class or function) whose
+    # defaults are strings are kept as strings (scoring=2048 is "2048")
+    defaults = {}
+    if target is not None:
+        defaults = {name: parameter.default for name, parameter
+                    in inspect.signature(target).parameters.items()}
+    grid = {}
+    for item in items:
+        name, values = item.split("=", 1)
+        grid[name] = []
+        for value in values.split(","):
+            if isinstance(defaults.get(name), str):
+                grid[name].append(value)
+                continue
+            try:
+                grid[name].append(ast.literal_eval(value))
+            except (ValueError, SyntaxError):
+                grid[name].append(value)
+    return grid
+
+
+def format_summary(configs, summary):
+    # table of the configs from the best mean score
+    lines = ["{:>8} {:>10} {:>21} {:>7} {:>7}  {}".format(
+        "games", "score", "interval", "tile", "moves", "config")]
+    for i in sorted(range(len(configs)), key=lambda i: -summary["score"][i]
+                    if not math.isnan(summary["score"][i]) else math.inf):
+        lines.append("{:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>7.2f} {:>7.1f}"
+                     "  {}{}".format(
+                         summary["games"][i], summary["score"][i],
+                         summary["low"][i], summary["high"][i],
+                         summary["largest_tile"][i], summary["move_count"][i],
+                         get_label(configs[i]),
+                         " (stopped)" if summary["stopped"][i] else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m two048.sweep",
+        description="evaluate a policy over a grid of its arguments and of "
+        "the arguments of the games")
+    parser.add_argument("policy", help="import path of the policy class, "
+                        "e.g. policy.PureMCTS")
+    parser.add_argument("--policy-grid", nargs="*", default=[],
+                        metavar="NAME=VALUE,...")
+    parser.add_argument("--game-grid", nargs="*", default=[],
+                        metavar="NAME=VALUE,...",
+                        help="e.g. scoring=2048,threes probability_of_4=0.1")
+    parser.add_argument("--engine", choices=engine_names, default="list")
+    parser.add_argument("--games", type=int, default=100,
+                        help="games of a config that is not stopped")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--store", default="sweep.sqlite",
+                        help="sqlite file of the results, the stored games "
+                        "are not played again")
+    parser.add_argument("--round-games", type=int, default=10)
+    parser.add_argument("--min-games", type=int, default=20)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--no-early-stop", action="store_true")
+    args = parser.parse_args(argv)
+
+    module_name, class_name = args.policy.rsplit(".", 1)
+    policy_class = getattr(importlib.import_module(module_name), class_name)
+    configs = make_grid(args.policy,
+                        parse_grid(args.policy_grid, policy_class),
+                        parse_grid(args.game_grid, Game), args.engine)
+
+    def progress(played, jobs_num):
+        print("\r{}/{} games of the round played".format(played, jobs_num),
+              end="", file=sys.stderr, flush=True)
+
+    with ResultStore(args.store) as store:
+        summary = run_sweep(
+            configs, args.games, store, seed=args.seed, workers=args.workers,
+            round_games=args.round_games, min_games=args.min_games,
+            confidence=args.confidence, early_stop=not args.no_early_stop,
+            progress=progress)
+    print(file=sys.stderr)
+    print(format_summary(configs, summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+import pytest
+
+from two048.batch import BatchGame
+from two048.game import Game
+
+
+def random_states(size, num_states, seed=3):
+    # boards with random tiles (and random number of empty positions)
+    rng = np.random.default_rng(seed)
+    tiles = rng.integers(1, 6, size=(num_states, size * size))
+    empty = rng.random((num_states, size * size)) < rng.random((num_states, 1))
+    tiles[empty] = Game.empty_tile
+    return tiles.astype(np.uint8)
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 5, 8, 16])
+@pytest.mark.parametrize("scoring", ["2048", "threes"])
+def test_step_matches_game(size, scoring):
+    # every action on every board has to give the same state and the same score
+    # as the list engine
+    states = random_states(size, 200)
+    for action in Game.ActionSpace:
+        batch = BatchGame(states, size=size, scoring=scoring)
+        changed = batch.step(np.full(len(states), action.value - 1))
+        scores = batch.scores()
+        for i, state in enumerate(states):
+            game = Game(size=size, state=state.tolist(), scoring=scoring)
+            assert changed[i] == game.is_state_changed(action)
+            game.change_state(action)
+            game.update_score()
+            assert batch.boards[i].tolist() == game.get_state()
+            assert scores[i] == game.get_value()
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 5, 8, 16])
+def test_legal_mask_matches_game(size):
+    states = random_states(size, 300)
+    legal = BatchGame(states, size=size).legal_mask()
+    for i, state in enumerate(states):
+        game = Game(size=size, state=state.tolist())
+        assert [Game.ActionSpace(j + 1) for j in np.flatnonzero(legal[i])] == \
+            game.get_possible_actions()
+
+
+def test_spawn_tiles():
+    rng = np.random.default_rng(0)
+    batch = BatchGame(np.zeros((100, 16), dtype=np.uint8))
+    for num_tiles in range(1, 17):
+        batch.spawn_tiles(rng)
+        assert ((batch.boards != 0).sum(axis=1) == num_tiles).all()
+    assert set(np.unique(batch.boards)) <= {1, 2}
+    # tile 4 comes with the probability 0.1
+    assert 0.05 < (batch.boards == 2).mean() < 0.15
+    # full boards do not change
+    boards = batch.boards.copy()
+    batch.spawn_tiles(rng)
+    assert (batch.boards == boards).all()
+
+
+def test_spawn_tiles_mask():
+    rng = np.random.default_rng(0)
+    batch = BatchGame(np.zeros((4, 16), dtype=np.uint8))
+    batch.spawn_tiles(rng, mask=[True, False, True, False])
+    assert (batch.boards != 0).sum(axis=1).tolist() == [1, 0, 1, 0]
+
+
+def test_rollout_until_terminal():
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    game = Game()
+    batch = BatchGame.from_game(game, 50)
+    scores = batch.rollout_until_terminal(rng)
+    assert batch.is_finished().all()
+    assert (batch.move_count > 0).all()
+    assert (scores > 0).all()
+    for board, score in zip(batch.boards, scores):
+        game = Game(state=board.tolist())
+        assert game.is_finished()
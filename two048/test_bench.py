@@ -0,0 +1,38 @@
+import json
+
+from two048 import bench
+
+
+def test_run_benchmarks():
+    results = bench.run_benchmarks(["engine.list.", "playout.batch.size3"],
+                                   quick=True, repeat=1)
+    assert sorted(results["results"]) == [
+        "engine.list.accept", "engine.list.change_state", "engine.list.clone",
+        "engine.list.is_state_changed", "playout.batch.size3"]
+    for result in results["results"].values():
+        assert result["rate"] > 0
+    assert results["results"]["engine.list.clone"]["unit"] == "clones"
+
+
+def test_compare():
+    results = {"results": {"a": {"rate": 85.0}, "b": {"rate": 70.0},
+                           "new": {"rate": 1.0}}}
+    baseline = {"results": {"a": {"rate": 100.0}, "b": {"rate": 100.0},
+                            "removed": {"rate": 1.0}}}
+    comparison, regressions = bench.compare(results, baseline, 0.2)
+    assert [name for name, _, _, _ in comparison] == ["a", "b"]
+    assert regressions == ["b"]
+
+
+def test_main(tmp_path, capsys):
+    output = str(tmp_path / "bench.json")
+    assert bench.main(["engine.list.clone", "--quick", "--repeat", "1",
+                       "--output", output]) == 0
+    with open(output) as output_file:
+        baseline = json.load(output_file)
+    baseline["results"]["engine.list.clone"]["rate"] *= 100
+    with open(output, "w") as output_file:
+        json.dump(baseline, output_file)
+    assert bench.main(["engine.list.clone", "--quick", "--repeat", "1",
+                       "--baseline", output]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("matplotlib")
+
+from two048.display import Renderer, main, save_frames
+from two048.game import Game, RandomStream
+from two048.recorder import TrajectoryRecorder
+
+
+def play_game(size, seed):
+    game = Game(size=size, rng=RandomStream(seed))
+    states = [game.get_state()]
+    while not game.is_finished():
+        game.accept(game.rng.choice(game.get_possible_actions()))
+        states.append(game.get_state())
+    return states
+
+
+@pytest.mark.parametrize("size", [3, 4])
+def test_frames_match_full_draws(size):
+    # the frames pasted from the cells are the same as the frames of the
+    # whole board drawn by matplotlib
+    states = play_game(size, 0) + play_game(size, 1)
+    renderer = Renderer((size, size), text_threshold=10)
+    full_renderer = Renderer((size, size), text_threshold=10, blit=False)
+    frames = list(renderer.render_game(states))
+    assert renderer.draws < len(states)
+    for state, frame in zip(states, frames):
+        full_renderer.display.draw(state)
+        canvas = full_renderer.display.fig.canvas
+        assert (np.asarray(canvas.buffer_rgba())[..., :3] == frame).all()
+    assert frames[0].shape == (200, 200, 3)
+    assert (frames[0] != frames[-1]).any()
+
+
+def test_save_gif(tmp_path):
+    from PIL import Image
+
+    path = str(tmp_path / "game.trj")
+    with TrajectoryRecorder(path, size=3) as recorder:
+        game = Game(size=3, rng=RandomStream(0))
+        recorder.start_game(game)
+        for _ in range(5):
+            action = game.get_possible_actions()[0]
+            recorder.update(game.accept(action), action, game)
+    output = str(tmp_path / "game.gif")
+    main([path, "--output", output, "--dpi", "20"])
+    with Image.open(output) as image:
+        assert image.n_frames == 6
+        assert image.size == (80, 80)
+    renderer = Renderer((3, 3))
+    assert save_frames(output, renderer.render_game(play_game(3, 1)[:4])) == 4
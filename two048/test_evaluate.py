@@ -0,0 +1,109 @@
+import json
+
+import numpy as np
+import pytest
+
+import agent
+from policy import NTupleValue, PureMCTS
+from two048.evaluate import evaluate_policy
+from two048.game import Game, RandomStream
+from two048.model import Model
+from two048.ntuple import NTupleNetwork
+
+
+def test_results_do_not_depend_on_workers():
+    serial = evaluate_policy("policy.Random", 6, seed=1, size=3)
+    parallel = evaluate_policy("policy.Random", 6, seed=1, workers=2, size=3)
+    for serial_values, parallel_values in zip(serial, parallel):
+        assert serial_values.tolist() == parallel_values.tolist()
+
+
+def test_resume(tmp_path):
+    output = tmp_path / "results.jsonl"
+    expected = evaluate_policy("policy.Random", 8, seed=2, size=3)
+
+    evaluate_policy("policy.Random", 5, seed=2, output=str(output), size=3)
+    finished = []
+    resumed = evaluate_policy("policy.Random", 8, seed=2, output=str(output),
+                              progress=lambda i, _: finished.append(i),
+                              size=3)
+    # only the missing games are played
+    assert finished == [6, 7, 8]
+    for expected_values, resumed_values in zip(expected, resumed):
+        assert expected_values.tolist() == resumed_values.tolist()
+    with open(output) as results_file:
+        assert len(results_file.readlines()) == 1 + 8
+    with open(output) as results_file:
+        assert "config" in json.loads(results_file.readline())
+
+
+def test_resume_after_incomplete_line(tmp_path):
+    output = tmp_path / "results.jsonl"
+    expected = evaluate_policy("policy.Random", 4, seed=2, size=3)
+    evaluate_policy("policy.Random", 3, seed=2, output=str(output), size=3)
+    # the run was killed while it was writing a result
+    with open(output, "a") as results_file:
+        results_file.write('{"game": 3, "sco')
+    resumed = evaluate_policy("policy.Random", 4, seed=2, output=str(output),
+                              size=3)
+    for expected_values, resumed_values in zip(expected, resumed):
+        assert expected_values.tolist() == resumed_values.tolist()
+    with open(output) as results_file:
+        lines = results_file.readlines()
+    assert len(lines) == 1 + 4
+    assert [json.loads(line)["game"] for line in lines[1:]] == [0, 1, 2, 3]
+
+
+def test_resume_policy_instance(tmp_path):
+    output = str(tmp_path / "results.jsonl")
+    expected = evaluate_policy(PureMCTS(samples=2), 4, seed=2, size=3)
+    evaluate_policy(PureMCTS(samples=2), 2, seed=2, output=output, size=3)
+    finished = []
+    resumed = evaluate_policy(PureMCTS(samples=2), 4, seed=2, output=output,
+                              progress=lambda i, _: finished.append(i),
+                              size=3)
+    assert finished == [3, 4]
+    for expected_values, resumed_values in zip(expected, resumed):
+        assert expected_values.tolist() == resumed_values.tolist()
+    # other arguments are another configuration
+    with pytest.raises(ValueError, match="different configuration"):
+        evaluate_policy(PureMCTS(samples=3), 4, seed=2, output=output,
+                        size=3)
+    # the state of an rng can not be recorded
+    with pytest.raises(ValueError, match="import path"):
+        evaluate_policy(PureMCTS(samples=2, rng=RandomStream(0)), 4,
+                        output=str(tmp_path / "rng.jsonl"), size=3)
+
+
+def test_results_do_not_depend_on_pool_size():
+    serial = evaluate_policy("policy.Random", 6, seed=1, size=3)
+    for pool_size, workers in ((1, None), (4, None), (4, 2)):
+        pooled = evaluate_policy("policy.Random", 6, seed=1, size=3,
+                                 pool_size=pool_size, workers=workers)
+        for serial_values, pooled_values in zip(serial, pooled):
+            assert serial_values.tolist() == pooled_values.tolist()
+
+
+def test_play_many():
+    network = NTupleNetwork(tuples=((0, 1), (1, 2)), size=3)
+    network.weights[:] = np.random.default_rng(0).random(
+        len(network.weights))
+    for play_policy in (NTupleValue(network),
+                        PureMCTS(samples=2, batched=True)):
+        finished = list(agent.play_many(
+            play_policy, lambda i: Game(size=3, rng=RandomStream(i)), 5,
+            pool_size=2, make_model=lambda _: Model()))
+        assert sorted(index for index, _, _ in finished) == list(range(5))
+        for _, game, model in finished:
+            assert game.is_finished()
+            assert len(model.trajectory) > 0
+            assert play_policy.get_actions([game]) == [None]
+
+
+def test_get_actions():
+    games = [Game(size=3, rng=RandomStream(i)) for i in range(3)]
+    for play_policy in (NTupleValue(NTupleNetwork(tuples=((0, 1),), size=3)),
+                        PureMCTS(samples=2, batched=True)):
+        actions = play_policy.get_actions(games)
+        for game, action in zip(games, actions):
+            assert action in game.get_possible_actions()
@@ -1,5 +1,9 @@
+import random
+
 import pytest
-from game import Game, init_randomness
+from two048.game import (AfterstateCache, Game, BitboardGame, RandomStream,
+                         derive_seed, has_empty_tile, init_randomness,
+                         pack_board)
 
 
 def rotate(state, size, num_rotations=1):
@@ -24,10 +28,14 @@ def test_rotate(input_state, rotated_state, size):
     assert rotate(input_state, size) == rotated_state
 
 
-@pytest.fixture
-def game_instance():
+# every test runs against the reference list engine and the bitboard engine
+engines = [Game, BitboardGame]
+
+
+@pytest.fixture(params=engines)
+def game_instance(request):
     init_randomness()
-    return Game()
+    return request.param()
 
 
 interact_state_examples = [
@@ -228,7 +236,9 @@ update_score_2048_state_examples = [
 
 @pytest.mark.parametrize("state, score", update_score_2048_state_examples)
 def test_score_2048(game_instance, state, score):
-    game_instance.set_state(state)
+    # accept changes the state in place, keep the example intact for the
+    # other engine
+    game_instance.set_state(state[:])
     game_instance.set_value()
     game_instance.accept(game_instance.ActionSpace.RIGHT)
     assert game_instance.get_value() == score
@@ -260,9 +270,230 @@ update_score_threes_state_examples = [
 ]
 
 
+@pytest.mark.parametrize("engine", engines)
 @pytest.mark.parametrize("state, score", update_score_threes_state_examples)
-def test_score_threes(state, score):
-    game_instance = Game(state=state, scoring="threes")
+def test_score_threes(engine, state, score):
+    game_instance = engine(state=state, scoring="threes")
     game_instance.update_score()
     assert game_instance.get_value() == score
 
+
+def test_engines_play_the_same_game():
+    # both engines consume the same random draws, so with the same seed they
+    # have to produce identical games
+    trajectories = []
+    for engine in engines:
+        init_randomness(7)
+        game = engine()
+        trajectory = [(game.get_state(), game.get_value())]
+        while not game.is_finished():
+            actions = game.get_possible_actions()
+            assert actions == [action for action in game.actions()
+                               if game.is_state_changed(action)]
+            game.accept(actions[len(trajectory) % len(actions)])
+            trajectory.append((game.get_state(), game.get_value()))
+        trajectories.append(trajectory)
+    assert trajectories[0] == trajectories[1]
+
+
+@pytest.mark.parametrize("scoring", ["2048", "threes"])
+def test_engines_have_the_same_deltas(scoring):
+    # delta is the score of the move in the scoring of the game
+    for engine in engines:
+        game = engine(state=[3, 3] + [0] * 14, scoring=scoring)
+        game.change_state(game.ActionSpace.LEFT)
+        assert game.delta == (16 if scoring == "2048" else 10)
+    trajectories = []
+    for engine in engines:
+        game = engine(scoring=scoring, rng=RandomStream(8))
+        trajectory = []
+        while not game.is_finished():
+            actions = game.get_possible_actions()
+            game.change_state(actions[len(trajectory) % len(actions)])
+            trajectory.append(game.delta)
+            score = game.get_value()
+            game.update_score()
+            if scoring == "2048":
+                assert game.get_value() == score + trajectory[-1]
+            game.generate_tile()
+        trajectories.append(trajectory)
+    assert trajectories[0] == trajectories[1]
+    assert any(trajectories[0])
+
+
+def play_seeded_game(engine, seed):
+    game = engine(rng=RandomStream(seed))
+    trajectory = [game.get_state()]
+    while not game.is_finished():
+        # draws from the global random module do not change the game
+        random.random()
+        game.accept(game.rng.choice(game.get_possible_actions()))
+        trajectory.append(game.get_state())
+    return trajectory
+
+
+@pytest.mark.parametrize("engine", engines)
+def test_rng_streams_are_reproducible(engine):
+    assert play_seeded_game(engine, 3) == play_seeded_game(engine, 3)
+    assert play_seeded_game(engine, 3) != play_seeded_game(engine, 4)
+    assert play_seeded_game(engine, 3) == play_seeded_game(engines[0], 3)
+
+
+@pytest.mark.parametrize("engine", engines)
+@pytest.mark.parametrize("probability_of_4", [0.1, 0.5])
+def test_new_tiles(engine, probability_of_4):
+    game = engine(probability_of_4=probability_of_4, rng=RandomStream(0))
+    tiles = []
+    for _ in range(2000):
+        game.set_state([0] * 16)
+        game.generate_tile()
+        tiles += [tile for tile in game.get_state() if tile]
+    assert 0.8 < tiles.count(2) / len(tiles) / probability_of_4 < 1.2
+    assert dict(game.get_new_tiles())[2] == probability_of_4
+
+
+@pytest.mark.parametrize("engine, size",
+                         [(Game, 2), (Game, 4), (Game, 6), (BitboardGame, 4)])
+def test_tracked_empty_cells_and_actions(engine, size):
+    # the empty cells and the legal actions kept by the moves are the same as
+    # those of a fresh game with the same state
+    game = engine(size=size, rng=RandomStream(5))
+    while True:
+        fresh = engine(size=size, state=game.get_state())
+        assert game.get_empty_indices() == fresh.get_empty_indices()
+        assert list(game.get_empty_indices()) == [
+            i for i, tile in enumerate(game.get_state()) if tile == 0]
+        actions = game.get_possible_actions()
+        assert actions == fresh.get_possible_actions()
+        assert actions == [action for action in fresh.actions()
+                           if fresh.is_state_changed(action)]
+        assert game.is_finished() == (not actions)
+        if not actions:
+            break
+        clone = game.clone()
+        game.accept(actions[len(game.get_empty_indices()) % len(actions)])
+        # the clone keeps the caches of its own state
+        assert clone.get_possible_actions() == actions
+
+
+@pytest.mark.parametrize("engine, size, scoring",
+                         [(Game, 3, "2048"), (Game, 4, "threes"),
+                          (BitboardGame, 4, "2048"),
+                          (BitboardGame, 4, "threes")])
+def test_afterstate_cache(engine, size, scoring):
+    # games that consult a (small, shared) cache play the same as the games
+    # without one, every game is played twice to hit the cache
+    afterstates = AfterstateCache(capacity=100)
+    for seed in [seed // 2 for seed in range(20)]:
+        games = [engine(size=size, scoring=scoring, rng=RandomStream(seed),
+                        afterstates=cache) for cache in (None, afterstates)]
+        while not games[0].is_finished():
+            assert not games[1].is_finished()
+            actions = games[0].get_possible_actions()
+            assert games[1].get_possible_actions() == actions
+            for action in games[0].actions():
+                assert (games[1].clone().is_state_changed(action) ==
+                        (action in actions))
+            action = games[0].rng.choice(actions)
+            for game in games:
+                game.rng = RandomStream(len(actions))
+                game.accept(action)
+            assert games[1].get_state() == games[0].get_state()
+            assert games[1].get_value() == games[0].get_value()
+            assert (list(games[1].get_empty_indices()) ==
+                    list(games[0].get_empty_indices()))
+        assert games[1].is_finished()
+    assert afterstates.hits > 0
+    assert len(afterstates) == 100
+    assert afterstates.evictions > 0
+    assert afterstates.get_report()["misses"] == afterstates.misses
+
+
+def test_afterstate_cache_is_shared_by_clones():
+    afterstates = AfterstateCache()
+    game = Game(state=[1, 1, 0, 0] + [0] * 12, afterstates=afterstates)
+    game.clone().change_state(Game.ActionSpace.LEFT)
+    assert (afterstates.hits, afterstates.misses) == (0, 1)
+    clone = game.clone()
+    clone.change_state(Game.ActionSpace.LEFT)
+    assert (afterstates.hits, afterstates.misses) == (1, 1)
+    assert clone.get_state() == [2] + [0] * 15
+    assert clone.delta == 4
+    # the cached tiles are copied into the state
+    assert game.get_state() == [1, 1] + [0] * 14
+
+
+def test_has_empty_tile():
+    assert has_empty_tile(0)
+    assert not has_empty_tile(pack_board([1] + list(range(1, 16))))
+    for i in range(16):
+        state = [15] * 16
+        state[i] = 0
+        assert has_empty_tile(pack_board(state))
+
+
+def test_derive_seed():
+    assert derive_seed(42, 0) == derive_seed(42, 0)
+    assert len({derive_seed(42, 0), derive_seed(42, 1), derive_seed(43, 0),
+                derive_seed(42, 0, 0)}) == 4
+
+
+def test_clone(game_instance):
+    game_instance.set_state([0, 1, 2, 0, 0, 4, 0, 0, 5, 2, 1, 0, 6, 0, 3, 0])
+    game_instance.set_value(12)
+    cloned_game = game_instance.clone()
+    assert type(cloned_game) is type(game_instance)
+    assert cloned_game.rules is game_instance.rules
+    assert cloned_game.get_state() == game_instance.get_state()
+    assert cloned_game.get_value() == 12
+
+    # moves in the clone do not change the original game and vice versa
+    cloned_game.accept(game_instance.ActionSpace.RIGHT)
+    assert game_instance.get_state() == [0, 1, 2, 0, 0, 4, 0, 0,
+                                         5, 2, 1, 0, 6, 0, 3, 0]
+    assert game_instance.get_value() == 12
+    game_instance.accept(game_instance.ActionSpace.LEFT)
+    assert cloned_game.get_state()[:4] != game_instance.get_state()[:4]
+
+
+def test_rules_are_shared():
+    assert Game().rules is Game(state=[0] * 16).rules
+    assert Game().rules is not Game(scoring="threes").rules
+    assert Game().rules is not Game(size=3).rules
+    assert Game().rules is not BitboardGame().rules
+
+
+def merge_score(prev_state, state):
+    # 2048 score of a move found from the tiles before and after the move
+    prev_tiles = sorted(tile for tile in prev_state if tile > 1)
+    tiles = sorted((tile for tile in state if tile > 1), reverse=True)
+    delta = 0
+    for tile in tiles:
+        if prev_tiles and tile == prev_tiles[-1]:
+            prev_tiles.pop()
+        else:
+            delta += 1 << tile
+            if prev_tiles:
+                prev_tiles.pop()
+                prev_tiles.pop()
+    return delta
+
+
+@pytest.mark.parametrize("scoring", ["2048", "threes"])
+def test_incremental_score(scoring):
+    # the score kept up to date during the moves is the same as the score
+    # counted from the states before and after every move
+    init_randomness(11)
+    game = Game(scoring=scoring, keep_prev_state=True)
+    score = 0
+    while not game.is_finished():
+        action = game.get_possible_actions()[-1]
+        game.accept(action)
+        moved = Game(state=game.prev_state[:])
+        moved.change_state(action)
+        if scoring == "2048":
+            score += merge_score(game.prev_state, moved.get_state())
+        else:
+            score = sum(pow(3, tile - 1) - 1 for tile in moved.get_state()
+                        if tile)
+        assert game.get_value() == score
@@ -0,0 +1,270 @@
+import pytest
+
+import agent
+import mcts
+from two048.game import Game, BitboardGame, RandomStream
+from two048.heuristics import combined
+from two048.ntuple import NTupleNetwork
+from two048.transposition import TranspositionTable
+
+full_state = [1, 2, 1, 2, 2, 1, 2, 1, 1, 2, 1, 2, 2, 1, 2, 1]
+state = [1, 2, 0, 0, 0, 3, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0]
+
+
+def leaves(states, score=100, compact=True):
+    if not compact:
+        return [mcts.Tree(state, score) for state in states]
+    store = mcts.TreeStore(16, Game.ActionSpace)
+    return [mcts.Node(store, store.add_node(state, score))
+            for state in states]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_heuristic_evaluator(compact):
+    values = mcts.HeuristicEvaluator().evaluate(
+        leaves([state, full_state], compact=compact), Game())
+    # no heuristic value of the final state
+    assert values == [100 + combined(state, 4), 100]
+
+
+def test_truncated_rollout_evaluator():
+    game = Game(rng=RandomStream(0))
+    evaluator = mcts.TruncatedRolloutEvaluator(depth=3, heuristic="score")
+    value, = evaluator.evaluate(leaves([state]), game)
+    # the scratch game is left at the cut off state
+    assert value == game.get_value() >= 100
+    full_game = Game(rng=RandomStream(0))
+    values = mcts.RolloutEvaluator().evaluate(leaves([state]), full_game)
+    assert full_game.is_finished() and values == [full_game.get_value()]
+
+
+def test_value_evaluator():
+    network = NTupleNetwork(((0, 1, 2, 3),))
+    network.weights[:] = 1
+    values = mcts.ValueEvaluator(network).evaluate(
+        leaves([[1, 1] + [0] * 14, full_state]), Game())
+    # 8 symmetric features of value 1 after the best move (merge of the two
+    # tiles 2 for 4 points) and nothing after the last state
+    assert values == [100 + 4 + 8, 100]
+
+
+@pytest.mark.parametrize("evaluator", [
+    None, mcts.HeuristicEvaluator(), mcts.TruncatedRolloutEvaluator(depth=5),
+    mcts.ValueEvaluator(NTupleNetwork(((0, 1, 2, 3),)))])
+@pytest.mark.parametrize("batch_size", [1, 8, 64])
+def test_batched_search(evaluator, batch_size):
+    policy = mcts.MCTS(iterations=64, evaluator=evaluator,
+                       batch_size=batch_size,
+                       transpositions=TranspositionTable())
+    game = BitboardGame(rng=RandomStream(1))
+    for _ in range(5):
+        agent.interact(policy, game)
+        assert not game.is_finished()
+
+
+def get_children(node):
+    # children of the chance nodes of Tree are kept by their states
+    children = node.children or ()
+    return list(children.values() if isinstance(children, dict)
+                else children)
+
+
+def test_terminal_root():
+    for compact in (False, True):
+        policy = mcts.MCTS(iterations=5, compact=compact)
+        assert policy.get_action(Game(state=full_state[:]), None) is None
+        assert policy.root is None
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("selection", ["ucb1", "puct"])
+def test_visits(compact, selection):
+    policy = mcts.MCTS(iterations=50, compact=compact, selection=selection)
+    game = Game(rng=RandomStream(2))
+    action = policy.get_action(game, None)
+    assert action in game.get_possible_actions()
+    # every iteration passes the root and one of its chance nodes
+    root = policy.root.parent
+    assert root.visits == 50
+    assert sum(child.visits for child in root.children) == 50
+    assert policy.root.action == action
+    assert policy.root.visits == max(child.visits for child in root.children)
+    for child in root.children:
+        assert child.visits == sum(grandchild.visits
+                                   for grandchild in get_children(child))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_tree_reuse(compact):
+    policy = mcts.MCTS(iterations=200, compact=compact)
+    game = Game(rng=RandomStream(3))
+    # the moves are played until the new tile is one that was sampled
+    while True:
+        game.accept(policy.get_action(game, None))
+        observed = policy.root.find_child(game.get_state())
+        if observed is not None:
+            break
+    visits = observed.visits
+    children_visits = [child.visits for child in get_children(observed)]
+    policy.get_action(game, None)
+    root = policy.root.parent
+    assert root.state == game.get_state() and root.parent is None
+    assert root.visits == visits + 200
+    assert sum(child.visits for child in root.children) == (
+        sum(children_visits) + 200)
+    # a tree that is not reused starts from scratch
+    fresh = mcts.MCTS(iterations=200, compact=compact, reuse_tree=False)
+    fresh.get_action(game, None)
+    fresh.get_action(game, None)
+    assert fresh.root.parent.visits == 200
+
+
+def test_selection_rules():
+    root = mcts.Tree(state, 0)
+    root.children = [mcts.Tree(state, 0, root, is_chance=True)
+                     for _ in range(3)]
+    for child, (visits, value_sum) in zip(root.children,
+                                          [(10, 900), (2, 100), (0, 0)]):
+        child.visits = visits
+        child.value_sum = value_sum
+    root.visits = 12
+    bounds = (0, 100)
+    # an unvisited child is tried first by ucb1, not by puct
+    assert mcts.select(root, 0.0, bounds, mcts.ucb1) is root.children[2]
+    assert mcts.select(root, 0.0, bounds, mcts.puct) is root.children[0]
+    root.children[2].visits = 1
+    root.visits = 13
+    # without exploration the best value wins
+    assert mcts.select(root, 0.0, bounds, mcts.ucb1) is root.children[0]
+    # both rules explore the least visited child
+    assert mcts.select(root, 100.0, bounds, mcts.ucb1) is root.children[2]
+    assert mcts.select(root, 100.0, bounds, mcts.puct) is root.children[2]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_chance_sampling(compact):
+    game = Game(rng=RandomStream(4))
+    root, = leaves([state], score=8, compact=compact)
+    root.generate_children(game)
+    chance = root.children[0]
+    assert chance.is_chance and chance.score >= 8
+    sampled = {}
+    for _ in range(100):
+        child, is_new = chance.sample_child(game)
+        child_state = child.state
+        key = tuple(child_state)
+        assert is_new == (key not in sampled)
+        sampled.setdefault(key, child)
+        assert sampled[key] == child and child.parent == chance
+        # one new tile of 2 or 4 in an empty cell of the afterstate
+        changes = [(old, new) for old, new in zip(chance.state, child_state)
+                   if old != new]
+        assert len(changes) == 1 and changes[0][0] == 0
+        assert changes[0][1] in (1, 2)
+        assert child.score == chance.score
+    assert len(get_children(chance)) == len(sampled)
+    assert chance.find_child(list(next(iter(sampled)))) is not None
+
+
+def test_store_grow_and_find_child():
+    store = mcts.TreeStore(16, Game.ActionSpace, capacity=2)
+    root = store.add_node(state, 10)
+    store.flags[root] = mcts.CHANCE
+    children = []
+    for i in range(5):
+        child_state = state[:]
+        child_state[15] = i + 1
+        child = store.add_node(child_state, 10 + i, root)
+        store.next_sibling[child] = store.first_child[root]
+        store.first_child[root] = child
+        children.append((child, child_state))
+    assert store.size == 6 and store.capacity == 8
+    assert store.get_state(root) == state and store.score[5] == 14
+    for child, child_state in children:
+        assert store.find_child(root, child_state) == child
+        assert store.parent[child] == root
+    assert store.find_child(root, full_state) == -1
+    assert list(store.children(root)) == [5, 4, 3, 2, 1]
+
+
+@pytest.mark.parametrize("reuse", [False, True])
+def test_compact_tree_plays_the_same_game(reuse):
+    # the store and the node objects consume the rng in the same order
+    results = []
+    for compact in (False, True):
+        policy = mcts.MCTS(iterations=40, compact=compact, reuse_tree=reuse)
+        game = Game(rng=RandomStream(5))
+        visits = []
+        for _ in range(8):
+            agent.interact(policy, game)
+            root = policy.root.parent
+            visits.append(sorted((child.action.value, child.visits)
+                                 for child in root.children))
+        results.append((game.get_state(), game.get_value(), visits))
+    assert results[0] == results[1]
+
+
+def test_extract():
+    policy = mcts.MCTS(iterations=100)
+    game = Game(rng=RandomStream(6))
+    policy.get_action(game, None)
+    chance = policy.root
+    child = get_children(chance)[0]
+    subtree = child.store.extract(child.index)
+    root = mcts.Node(subtree, 0)
+
+    def describe(node):
+        return (node.state, node.score, node.visits, node.get_value(),
+                node.max_value, node.is_chance, node.action,
+                [describe(child) for child in get_children(node)])
+    def count(node):
+        return 1 + sum(count(child) for child in get_children(node))
+    assert root.parent is None
+    assert describe(root) == describe(child)
+    assert subtree.size == count(root) < child.store.size
+
+
+def make_chain(compact):
+    # root -> chance -> two leaves
+    if compact:
+        store = mcts.TreeStore(16, Game.ActionSpace)
+        root = store.add_node(state, 0)
+        chance = store.add_node(state, 0, root, 1, mcts.CHANCE)
+        return store, [mcts.Node(store, store.add_node(state, 0, chance)),
+                       mcts.Node(store, store.add_node(state, 0, chance))]
+    root = mcts.Tree(state, 0)
+    chance = mcts.Tree(state, 0, root, is_chance=True)
+    return None, [mcts.Tree(state, 0, chance), mcts.Tree(state, 0, chance)]
+
+
+def test_backpropagate_many():
+    # a batch that repeats the leaves gives the statistics of the scalar
+    # backpropagation
+    indices = [0, 1, 1, 0, 1] * 10
+    values = [float(3 * i % 17) for i in range(len(indices))]
+    statistics = []
+    for vectorized in (False, True):
+        store, leaves = make_chain(compact=True)
+        batch = [leaves[i] for i in indices]
+        if vectorized:
+            mcts.backpropagate_many(batch, values)
+        else:
+            for leaf, value in zip(batch, values):
+                mcts.backpropagate(leaf, value)
+        statistics.append([(store.visits[i], store.value_sum[i],
+                            store.max_value[i]) for i in range(store.size)])
+    assert statistics[0] == statistics[1]
+    assert statistics[0][0] == (50, sum(values), max(values))
+
+
+def test_large_tiles():
+    # tiles above 15 do not fit into the packed boards of the store
+    game = Game(state=[16, 1] + [0] * 14, rng=RandomStream(7))
+    for compact in (False, True):
+        policy = mcts.MCTS(iterations=30, compact=compact,
+                           transpositions=TranspositionTable())
+        assert policy.get_action(game.clone(), None) is not None
+    store = policy.root.store
+    assert not store.packed
+    assert store.get_state(0) == game.get_state()
+    assert mcts.Node(store, 0).find_child(game.get_state()) is None
@@ -0,0 +1,81 @@
+import numpy as np
+
+import agent
+from policy import NTupleValue
+from two048.game import Game, BitboardGame, RandomStream, symmetries
+from two048.ntuple import NTupleNetwork, train
+
+small_tuples = ((0, 1, 2, 3), (4, 5, 6, 7), (0, 1, 4, 5), (5, 6, 9, 10))
+
+
+def random_network():
+    network = NTupleNetwork(small_tuples)
+    network.weights[:] = np.random.default_rng(0).random(
+        network.weights.shape)
+    return network
+
+
+def test_value_is_symmetric():
+    network = random_network()
+    board = np.random.default_rng(1).integers(0, 12, 16)
+    boards = np.array([[board[i] for i in permutation]
+                       for permutation in symmetries(4)], dtype=np.uint8)
+    values = network.evaluate(boards)
+    assert np.allclose(values, values[0])
+
+
+def test_value_is_sum_of_tuples():
+    network = random_network()
+    board = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 17]
+    value = 0
+    for permutation in symmetries(4):
+        state = [min(board[i], 15) for i in permutation]
+        for i, cells in enumerate(small_tuples):
+            index = sum(state[cell] << 4 * j for j, cell in enumerate(cells))
+            value += network.weights[i * 16 ** 4 + index]
+    assert np.isclose(network.evaluate(np.array([board], dtype=np.uint8))[0],
+                      value)
+
+
+def test_update():
+    network = NTupleNetwork(small_tuples)
+    boards = np.array([[1] * 16, [2] * 16], dtype=np.uint8)
+    network.update(boards, [1.0, -0.5])
+    # every feature of a board gets the step, a board of equal tiles has the
+    # same feature in every symmetry
+    assert network.evaluate(boards).tolist() == [32 * 8, -16 * 8]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "ntuple.npy")
+    network = random_network()
+    network.save(path)
+    loaded = NTupleNetwork.load(path, mode="r+")
+    assert isinstance(loaded.weights, np.memmap)
+    assert loaded.tuples == small_tuples
+    assert (loaded.weights == network.weights).all()
+    # training of the mapped weights changes the file
+    train(loaded, 4, batch_size=2)
+    loaded.weights.flush()
+    assert not (NTupleNetwork.load(path).weights == network.weights).all()
+
+
+def test_train():
+    network = NTupleNetwork(small_tuples)
+    finished = []
+    scores = train(network, 10, batch_size=4,
+                   progress=lambda i, _: finished.append(i))
+    assert finished == list(range(1, 11))
+    assert len(scores) == 10 and (scores > 0).all()
+    assert network.weights.any()
+
+
+def test_policy():
+    network = NTupleNetwork(small_tuples)
+    train(network, 20)
+    ntuple_policy = NTupleValue(network)
+    for engine in (Game, BitboardGame):
+        game = engine(rng=RandomStream(0))
+        while not game.is_finished():
+            agent.interact(ntuple_policy, game)
+        assert game.get_value() > 0
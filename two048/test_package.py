@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import two048
+
+
+def test_lazy_exports():
+    assert two048.Game is two048.game.Game
+    assert two048.get_engine("bitboard") is two048.BitboardGame
+    assert "Renderer" in dir(two048) and "display" in dir(two048)
+    with pytest.raises(AttributeError):
+        two048.missing
+
+
+def test_get_engine():
+    assert two048.get_engine("list") is two048.Game
+    with pytest.raises(ValueError):
+        two048.get_engine("missing")
+
+
+@pytest.mark.parametrize("modules", [
+    "two048", "two048.evaluate, policy", "two048.server, mcts",
+    "two048.display"])
+def test_startup_imports(modules):
+    # the modules of the worker processes import neither numpy (but
+    # two048.display) nor matplotlib nor the process pool
+    heavy = ["matplotlib", "concurrent.futures.process"]
+    if modules != "two048.display":
+        heavy.append("numpy")
+    code = ("import sys\nimport {}\n"
+            "print(' '.join(name for name in {!r} if name in sys.modules))"
+            ).format(modules, heavy)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(two048.__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root,
+                            check=True, capture_output=True, text=True).stdout
+    assert output.split() == []
@@ -0,0 +1,202 @@
+import time
+
+import pytest
+
+import agent
+import mcts
+import policy
+from two048.game import Game, RandomStream
+
+
+@pytest.fixture
+def pools():
+    yield
+    policy.shutdown_pools()
+
+
+@pytest.mark.parametrize("samples", [[10, 10, 10], [7, 0, 3, 1], [1], [2, 5]])
+@pytest.mark.parametrize("num_shards", [1, 2, 3, 8])
+def test_split_samples(samples, num_shards):
+    shards = policy.split_samples(samples, num_shards)
+    assert len(shards) == num_shards
+    # every playout is in exactly one shard and the shards are balanced
+    assert [sum(column) for column in zip(*shards)] == samples
+    sizes = [sum(shard) for shard in shards]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def play_moves(decision_policy, seed, moves):
+    game = Game(rng=RandomStream(seed))
+    for _ in range(moves):
+        agent.interact(decision_policy, game)
+    return game.get_state(), game.get_value()
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_workers_are_reproducible(pools, batched):
+    if batched:
+        pytest.importorskip("numpy")
+    results = [play_moves(policy.PureMCTS(samples=4, batched=batched,
+                                          workers=2), 5, 4)
+               for _ in range(2)]
+    assert results[0] == results[1]
+    # every action gets all its playouts from the shards
+    game = Game(rng=RandomStream(5))
+    actions = game.get_possible_actions()
+    scores = policy.PureMCTS(samples=3, batched=batched, workers=2).play(
+        game, actions, [3, 1] + [2] * (len(actions) - 2))
+    assert [len(action_scores) for action_scores in scores] == [
+        3, 1] + [2] * (len(actions) - 2)
+
+
+def test_large_boards_are_batched(monkeypatch):
+    # the playouts are batched by default from batched_size up
+    batched = []
+
+    def play(game, actions, samples, is_batched, rng):
+        batched.append(is_batched)
+        return [[0] * count for count in samples]
+    monkeypatch.setattr(policy, "play", play)
+    for size, option in ((4, None), (8, None), (8, False), (4, True)):
+        policy.PureMCTS(samples=1, batched=option).get_action(
+            Game(size=size, rng=RandomStream(0)), None)
+    assert batched == [False, True, False, True]
+
+
+# 1024 tiles over each other, the vertical moves merge them and the
+# horizontal moves merge nothing
+obvious_state = [10, 1, 2, 3, 10, 2, 3, 1, 0, 0, 0, 0, 0, 0, 0, 0]
+
+
+def test_expectimax_obvious_move():
+    for depth in (1, 2):
+        search = policy.Expectimax(depth=depth, heuristic="score")
+        game = Game(state=obvious_state[:])
+        assert search.get_action(game, None).name in ("UP", "DOWN")
+        assert game.get_state() == obvious_state
+    assert policy.Expectimax().get_action(
+        Game(state=[1, 2, 1, 2, 2, 1, 2, 1, 1, 2, 1, 2, 2, 1, 2, 1]),
+        None) is None
+
+
+def expectimax_values(search, state, depth):
+    # values of the chance nodes after the actions of the state
+    search.game = Game(state=state[:])
+    search.memo = {}
+    values = {}
+    for action in search.game.get_possible_actions():
+        after_state, after_score = search.move(state, 0, action)
+        values[action.name] = search.chance_value(after_state, after_score,
+                                                  depth - 1, 1)
+    return values
+
+
+def test_expectimax_memo(monkeypatch):
+    state = [1, 2, 0, 0, 0, 3, 0, 0, 0, 0, 1, 0, 0, 0, 2, 0]
+    memoized = expectimax_values(policy.Expectimax(), state, 3)
+    # every chance node gets its own key, nothing is shared
+    keys = iter(range(1 << 30))
+    monkeypatch.setattr(policy, "canonical_key", lambda _: next(keys))
+    plain = expectimax_values(policy.Expectimax(), state, 3)
+    assert memoized == pytest.approx(plain)
+
+
+def test_expectimax_min_probability():
+    # with min_probability 1 only the chance nodes after the first move are
+    # expanded
+    state = [1, 2, 0, 0, 0, 3, 0, 0, 0, 0, 1, 0, 0, 0, 2, 0]
+    pruned = expectimax_values(policy.Expectimax(min_probability=1), state, 3)
+    assert pruned == pytest.approx(expectimax_values(
+        policy.Expectimax(min_probability=0), state, 2))
+
+
+def test_expectimax_time_budget(monkeypatch):
+    completed = []
+    search = policy.Expectimax.search
+
+    def record_depth(self, state, score, actions, depth):
+        action = search(self, state, score, actions, depth)
+        completed.append(depth)
+        return action
+    monkeypatch.setattr(policy.Expectimax, "search", record_depth)
+    state = [1, 2, 0, 0, 0, 3, 0, 0, 0, 0, 1, 0, 0, 0, 2, 0]
+    # depth 1 needs no expansion and always completes, the budget runs out
+    # before depth 2
+    policy.Expectimax(depth=3, time_budget_ms=1e-6).get_action(
+        Game(state=state[:]), None)
+    assert completed == [1]
+    completed.clear()
+    policy.Expectimax(depth=2, time_budget_ms=60000).get_action(
+        Game(state=state[:]), None)
+    assert completed == [1, 2]
+
+
+def test_expectimax_large_tiles():
+    state = [16, 1] + [0] * 14
+    assert policy.Expectimax(depth=2).get_action(Game(state=state),
+                                                 None) is not None
+
+
+def count_playouts(search):
+    # number of the playouts played by the search
+    counts = []
+    play = search.play
+
+    def counted_play(game, actions, samples):
+        counts.append(sum(samples))
+        return play(game, actions, samples)
+    search.play = counted_play
+    return counts
+
+
+def test_time_budget():
+    game = Game(rng=RandomStream(1))
+    # time of one round of playouts
+    start = time.perf_counter()
+    policy.PureMCTS(samples=2).get_action(game.clone(), None)
+    round_time = time.perf_counter() - start
+    search = policy.PureMCTS(samples=10 ** 6, time_budget_ms=50,
+                             round_samples=2)
+    counts = count_playouts(search)
+    start = time.perf_counter()
+    assert search.get_action(game.clone(), None) is not None
+    # slack for a slow machine
+    assert time.perf_counter() - start < 0.05 + round_time + 0.05
+    assert 0 < sum(counts) < 10 ** 6
+
+    tree_search = mcts.MCTS(iterations=10 ** 6, time_budget_ms=50)
+    start = time.perf_counter()
+    assert tree_search.get_action(game.clone(), None) is not None
+    assert time.perf_counter() - start < 0.05 + 0.05
+    assert 0 < tree_search.root.parent.visits < 10 ** 6
+
+
+def test_eliminate():
+    search = policy.PureMCTS(racing=True)
+    scores = [[100, 101, 99, 100], [10, 11, 9, 10], [98, 102, 100, 99], [5]]
+    assert search.eliminate(scores, [0, 1, 2]) == [0, 2]
+    # an action needs two playouts to be compared
+    assert search.eliminate(scores, [0, 1, 3]) == [0, 1, 3]
+
+
+def test_racing():
+    # the first action is clearly better, the others are dropped after the
+    # first round
+    def play(game, actions, samples):
+        return [[(1000 if action == first else 10) + i % 3 for i in
+                 range(count)] for action, count in zip(actions, samples)]
+
+    game = Game(rng=RandomStream(1))
+    first = game.get_possible_actions()[0]
+    search = policy.PureMCTS(samples=1000, racing=True, round_samples=5)
+    search.play = play
+    counts = count_playouts(search)
+    assert search.get_action(game, None) == first
+    assert sum(counts) == 5 * len(game.get_possible_actions())
+    # without racing all the samples are played
+    search = policy.PureMCTS(samples=20, round_samples=5,
+                             time_budget_ms=60000)
+    search.play = play
+    counts = count_playouts(search)
+    assert search.get_action(game, None) == first
+    assert sum(counts) == 20 * len(game.get_possible_actions())
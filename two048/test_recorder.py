@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import agent
+import policy
+from two048.game import Game, BitboardGame, RandomStream
+from two048.recorder import TrajectoryReader, TrajectoryRecorder, no_spawn
+
+
+def record_games(path, engine, seeds, size=4):
+    states = []
+    with TrajectoryRecorder(path, size=size, buffer_size=64) as recorder:
+        for seed in seeds:
+            game = engine(size=size, rng=RandomStream(seed))
+            recorder.start_game(game)
+            game_states = [(game.get_state(), None, game.get_value())]
+            while not game.is_finished():
+                agent.interact(policy.Random(), game, recorder)
+                game_states.append((game.get_state(),
+                                    game.new_tile, game.get_value()))
+            recorder.end_game()
+            states.append(game_states)
+    return states
+
+
+@pytest.mark.parametrize("engine, size",
+                         [(Game, 4), (BitboardGame, 4), (Game, 3), (Game, 5)])
+def test_replay(tmp_path, engine, size):
+    path = str(tmp_path / "games.trj")
+    states = record_games(path, engine, [1, 2, 3], size)
+    games = TrajectoryReader(path)
+    assert len(games) == 3
+    assert isinstance(games.records, np.memmap)
+    for steps, game_states in zip(games, states):
+        assert len(steps) == len(game_states)
+        assert games.get_states(steps).tolist() == [
+            state for state, _, _ in game_states]
+        assert steps["action"][0] == 0
+        assert (steps["action"][1:] > 0).all()
+        assert np.cumsum(steps["delta"]).tolist() == [
+            score for _, _, score in game_states]
+        for step, (_, new_tile, _) in zip(steps[1:], game_states[1:]):
+            assert (step["spawn_index"], step["spawn_tile"]) == new_tile
+    # the games are views of the mapped file
+    assert np.shares_memory(games[1], games.records)
+
+
+def test_append_drops_unfinished_game(tmp_path):
+    path = str(tmp_path / "games.trj")
+    states = record_games(path, Game, [1])
+    recorder = TrajectoryRecorder(path, buffer_size=1)
+    game = Game(state=[0] * 15 + [1])
+    recorder.start_game(game)
+    agent.interact(policy.Random(), game, recorder)
+    # the records of the game are written, but the game is not finished
+    recorder.flush()
+    assert len(TrajectoryReader(path)) == 1
+    states += record_games(path, Game, [2])
+    games = TrajectoryReader(path)
+    assert [len(steps) for steps in games] == [len(game_states)
+                                               for game_states in states]
+    assert games.get_states(games[1])[0].tolist() == states[1][0][0]
+
+
+def test_initial_state_without_new_tile(tmp_path):
+    path = str(tmp_path / "games.trj")
+    with TrajectoryRecorder(path) as recorder:
+        recorder.start_game(Game(state=[1] * 16))
+    steps = TrajectoryReader(path)[0]
+    assert steps["spawn_index"].tolist() == [no_spawn]
+    with pytest.raises(ValueError):
+        TrajectoryRecorder(path, size=3)
+
+
+def test_append_drops_incomplete_index_entry(tmp_path):
+    path = str(tmp_path / "games.trj")
+    states = record_games(path, Game, [1])
+    # an interrupted write of the index entry of the next game
+    with open(path + ".index", "ab") as index_file:
+        index_file.write(b"\x00" * 8)
+    states += record_games(path, Game, [2])
+    games = TrajectoryReader(path)
+    assert [len(steps) for steps in games] == [len(game_states)
+                                               for game_states in states]
+    assert games.get_states(games[1])[0].tolist() == states[1][0][0]
+
+
+def test_spawn_index_fits_the_board(tmp_path):
+    # every cell index has to differ from no_spawn
+    TrajectoryRecorder(str(tmp_path / "games15.trj"), size=15).close()
+    with pytest.raises(ValueError):
+        TrajectoryRecorder(str(tmp_path / "games16.trj"), size=16)
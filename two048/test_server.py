@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from two048.game import Game, RandomStream
+from two048.server import GameServer, RolloutBudget, Session, simulate
+
+
+def test_budget_is_first_come_first_served():
+    async def run():
+        budget = RolloutBudget(10)
+        await budget.acquire(6)
+        served = []
+
+        async def acquire(name, count):
+            await budget.acquire(count)
+            served.append(name)
+
+        large = asyncio.ensure_future(acquire("large", 6))
+        small = asyncio.ensure_future(acquire("small", 2))
+        await asyncio.sleep(0)
+        # the small request fits, but it has to wait behind the large one
+        assert served == []
+        budget.release(6)
+        await asyncio.gather(large, small)
+        assert served == ["large", "small"]
+        assert budget.available == 2
+
+        cancelled = asyncio.ensure_future(budget.acquire(4))
+        waiting = asyncio.ensure_future(budget.acquire(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await waiting
+        assert budget.available == 0
+        with pytest.raises(ValueError):
+            await budget.acquire(11)
+    asyncio.run(run())
+
+
+def test_hint_and_move():
+    async def run():
+        server = GameServer(workers=2, rollout_budget=4, samples=4,
+                            round_samples=2, size=3)
+        # the tiles are pushed to the right, so RIGHT is not legal
+        server.sessions[0] = Session(0, Game(size=3, state=[0, 0, 1] * 3,
+                                             rng=RandomStream(0)))
+        session_id = 0
+        state = server.get_state(session_id)
+        assert "RIGHT" not in state["actions"]
+        report = await server.hint(session_id)
+        assert report["action"] in state["actions"]
+        assert report["playouts"] == 4 * len(state["actions"])
+        assert not report["timed_out"]
+        with pytest.raises(ValueError):
+            server.move(session_id, "RIGHT")
+        server.move(session_id, report["action"])
+        server.close_session(session_id)
+        assert server.sessions == {}
+        assert server.budget.available == 4
+    asyncio.run(run())
+
+
+def test_deadline():
+    async def run():
+        server = GameServer(workers=1, rollout_budget=10, samples=10 ** 6,
+                            round_samples=10)
+        session_id = server.open_session()
+        report = await server.hint(session_id, deadline_ms=50)
+        assert report["timed_out"]
+        assert report["action"] in server.get_state(session_id)["actions"]
+        assert report["playouts"] < 10 ** 6
+        server.close_session(session_id)
+    asyncio.run(run())
+
+
+def test_close_session_cancels_search():
+    async def run():
+        server = GameServer(workers=1, rollout_budget=10, samples=10 ** 6,
+                            round_samples=10)
+        session_id = server.open_session()
+        hint = asyncio.ensure_future(server.hint(session_id))
+        await asyncio.sleep(0.05)
+        server.close_session(session_id)
+        with pytest.raises(asyncio.CancelledError):
+            await hint
+        # the running rounds return their playouts to the budget
+        for _ in range(100):
+            if server.budget.available == 10:
+                break
+            await asyncio.sleep(0.05)
+        assert server.budget.available == 10
+        assert not server.budget.waiters
+    asyncio.run(run())
+
+
+def test_simulate():
+    server = GameServer(workers=2, rollout_budget=8, samples=4,
+                        round_samples=2, size=3)
+    results = asyncio.run(simulate(server, 5, 3))
+    assert results["sessions"] == 5
+    assert 5 <= results["hints"] <= 15
+    assert results["playouts_per_second"] > 0
+    assert results["latency_p50"] <= results["latency_max"]
+    assert server.sessions == {}
+    assert server.budget.available == 8
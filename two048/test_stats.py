@@ -0,0 +1,92 @@
+import pytest
+
+import agent
+import mcts
+import policy
+from two048.game import Game, BitboardGame, RandomStream
+from two048.model import Model
+from two048.stats import Stats, instrument
+
+
+@pytest.mark.parametrize("engine", [Game, BitboardGame])
+def test_instrument(engine):
+    game = engine(rng=RandomStream(0))
+    stats = Stats()
+    instrumented = instrument(game, stats)
+    assert isinstance(instrumented, engine)
+    assert instrumented.get_state() == game.get_state()
+    clone = instrumented.clone()
+    actions = clone.get_possible_actions()
+    clone.accept(actions[0])
+    report = stats.get_report()
+    assert {name: values["count"] for name, values in report.items()} == {
+        "clone": 1, "legal_actions": 1, "move": 1, "score": 1, "spawn": 1}
+    assert all(values["time"] >= 0 for values in report.values())
+    # the engine and the original game are not instrumented
+    assert not hasattr(game, "stats") and not hasattr(engine, "stats")
+    # instrumenting an instrumented game does not nest the timers
+    instrument(clone, stats).clone()
+    assert stats.counts["clone"] == 2
+
+
+@pytest.mark.parametrize("decision_policy, counts", [
+    (policy.PureMCTS(samples=3, stats=True), ["playouts", "moves"]),
+    (policy.PureMCTS(samples=3, batched=True, stats=True), ["playouts"]),
+    (policy.Expectimax(depth=2, stats=True), ["nodes", "moves"]),
+    (mcts.MCTS(iterations=20, stats=True), ["iterations", "nodes", "moves"])])
+def test_decision_reports(decision_policy, counts):
+    game = Game(rng=RandomStream(0))
+    model = Model()
+    logged = []
+    for _ in range(3):
+        agent.interact(decision_policy, game, model, logged.append)
+    assert len(model.reports) == 3 and model.reports == logged
+    report = model.reports[-1]
+    assert report["policy"] == type(decision_policy).__name__
+    assert report["action"] in report["actions"]
+    assert report["time"] > 0
+    for name in counts:
+        assert report[name] > 0 and report[name + "_per_second"] > 0
+    if "playouts" in counts:
+        assert sum(action["samples"] for action in
+                   report["actions"].values()) == report["playouts"]
+    if "moves" in counts:
+        assert report["engine"]["move"]["count"] == report["moves"]
+
+
+def test_reports_are_off_by_default():
+    game = Game(rng=RandomStream(0))
+    model = Model()
+    agent.interact(policy.PureMCTS(samples=2), game, model)
+    assert model.reports == []
+
+
+@pytest.mark.parametrize("engine", [Game, BitboardGame])
+def test_afterstate_cache_report(engine):
+    # the cache of the playouts does not change the decisions
+    states = []
+    for afterstates in (None, 1000):
+        game = engine(rng=RandomStream(0))
+        decision_policy = policy.PureMCTS(samples=5, stats=True,
+                                          afterstates=afterstates)
+        for _ in range(5):
+            agent.interact(decision_policy, game)
+        states.append(game.get_state())
+    assert states[0] == states[1]
+    assert game.afterstates is None
+    report = decision_policy.report["afterstates"]
+    assert report["hits"] > 0 and report["size"] <= 1000
+
+
+@pytest.mark.parametrize("decision_policy", [
+    policy.PureMCTS(samples=2, stats=True),
+    policy.Expectimax(depth=1, stats=True),
+    mcts.MCTS(iterations=10, stats=True)])
+def test_reports_stop_with_stats(decision_policy):
+    game = Game(rng=RandomStream(0))
+    model = Model()
+    agent.interact(decision_policy, game, model)
+    decision_policy.configure(stats=False)
+    for _ in range(3):
+        agent.interact(decision_policy, game, model)
+    assert len(model.reports) == 1 and decision_policy.report is None
@@ -0,0 +1,93 @@
+import statistics
+
+import numpy as np
+
+from two048.evaluate import evaluate_policy
+from two048.game import Game
+from two048.sweep import (ResultStore, format_summary, get_stopped, main,
+                          make_grid, parse_grid, run_sweep, summarize)
+
+
+def test_make_grid():
+    grid = parse_grid(["samples=1,10", "scoring=2048,threes"], Game)
+    # scoring is a string argument of the game
+    assert grid == {"samples": [1, 10], "scoring": ["2048", "threes"]}
+    assert parse_grid(["scoring=2048", "x=a"]) == {"scoring": [2048],
+                                                   "x": ["a"]}
+    configs = make_grid("policy.PureMCTS", {"samples": grid["samples"]},
+                        {"scoring": grid["scoring"], "size": [3]})
+    assert len(configs) == 4
+    assert configs[1] == {"policy": "policy.PureMCTS",
+                          "policy_kwargs": {"samples": 1}, "engine": "list",
+                          "game_kwargs": {"scoring": "threes", "size": 3}}
+
+
+def test_summarize():
+    rng = np.random.default_rng(0)
+    config = rng.integers(3, size=50)
+    score = rng.integers(1000, size=50).astype(float)
+    summary = summarize(config, score, score, score, 4)
+    for i in range(3):
+        values = score[config == i].tolist()
+        assert summary["games"][i] == len(values)
+        assert np.isclose(summary["score"][i], statistics.mean(values))
+        assert np.isclose(summary["std"][i], statistics.stdev(values))
+        assert summary["low"][i] < summary["score"][i] < summary["high"][i]
+    assert summary["games"][3] == 0 and np.isnan(summary["score"][3])
+    summary["score"][:3] = [100, 50, 10]
+    summary["low"][:3] = [90, 40, 0]
+    summary["high"][:3] = [110, 95, 20]
+    assert get_stopped(summary, 1).tolist() == [False, False, True, False]
+
+
+def test_results_match_evaluate():
+    score, _, _ = evaluate_policy("policy.Random", 6, seed=1, size=3)
+    configs = make_grid("policy.Random", game_grid={"size": [3]})
+    for workers in (None, 2):
+        with ResultStore(":memory:") as store:
+            summary = run_sweep(configs, 6, store, seed=1, workers=workers,
+                                round_games=4)
+        assert summary["games"].tolist() == [6]
+        assert np.isclose(summary["score"][0], np.mean(score))
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "sweep.sqlite")
+    configs = make_grid("policy.Random", game_grid={"size": [3],
+                                                    "scoring": ["2048",
+                                                                "threes"]})
+    with ResultStore(path) as store:
+        run_sweep(configs, 4, store, seed=2)
+    played = []
+    with ResultStore(path) as store:
+        summary = run_sweep(configs, 8, store, seed=2,
+                            progress=lambda i, _: played.append(i))
+        assert summary["games"].tolist() == [8, 8]
+        # a different seed is a different sweep
+        assert run_sweep(configs, 1, store, seed=3)["games"].tolist() == [1, 1]
+    assert len(played) == 2 * 4
+
+
+def test_early_stop():
+    configs = make_grid("policy.Random", game_grid={"size": [4, 3]})
+    with ResultStore(":memory:") as store:
+        summary = run_sweep(configs, 100, store, seed=3, round_games=10,
+                            min_games=10)
+    assert summary["stopped"].tolist() == [False, True]
+    assert summary["games"][0] == 100 and summary["games"][1] < 100
+    assert "(stopped)" in format_summary(configs, summary).splitlines()[2]
+
+
+def test_main(tmp_path, capsys):
+    path = str(tmp_path / "sweep.sqlite")
+    main(["policy.Random", "--game-grid", "size=3", "scoring=2048,threes",
+          "--games", "4", "--store", path])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and all(line.split()[0] == "4"
+                                   for line in lines[1:])
+    with ResultStore(path) as store:
+        # the games are stored under the string scoring of the game
+        config = make_grid("policy.Random", game_grid={
+            "size": [3], "scoring": ["2048"]})[0]
+        assert store.get_games(store.get_config_id(config, 42)) == {
+            0, 1, 2, 3}
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from two048.game import board_symmetries, pack_board, symmetries
+from two048.transposition import TranspositionTable, canonical_key
+
+
+def test_board_symmetries_match_permutations():
+    rng = random.Random(0)
+    for _ in range(100):
+        state = [rng.randrange(16) for _ in range(16)]
+        assert list(board_symmetries(pack_board(state))) == [
+            pack_board([state[i] for i in permutation])
+            for permutation in symmetries(4)]
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 5])
+@pytest.mark.parametrize("tiles", [8, 20])
+def test_canonical_key_is_symmetry_invariant(size, tiles):
+    # tiles above 15 are not packed
+    rng = random.Random(size)
+    for _ in range(20):
+        state = [rng.randrange(tiles) for _ in range(size * size)]
+        keys = {canonical_key([state[i] for i in permutation])
+                for permutation in symmetries(size)}
+        assert keys == {canonical_key(state)}
+
+
+def test_symmetries_are_distinct():
+    # asymmetric board has 8 different rotations and reflections
+    state = list(range(16))
+    assert len(set(board_symmetries(pack_board(state)))) == 8
+
+
+def test_lru_replacement():
+    table = TranspositionTable(capacity=2)
+    table.put(1, 10)
+    table.put(2, 20)
+    assert table.get(1) == [1, 10, 0]
+    table.put(3, 30)
+    # 2 is the least recently used entry
+    assert table.get(2) is None
+    assert table.get(1) is not None and table.get(3) is not None
+    assert table.get_statistics()["evictions"] == 1
+    assert (table.hits, table.misses) == (3, 1)
+    assert table.hit_rate() == 0.75
+
+
+def test_depth_replacement():
+    table = TranspositionTable(capacity=1, replacement="depth")
+    table.put(1, 10, depth=2)
+    # shallower result does not replace the deeper one
+    table.put(2, 20, depth=1)
+    assert table.get(2) is None
+    assert table.get(1) == [1, 10, 2]
+    table.put(2, 20, depth=3)
+    assert table.get(1) is None
+    assert table.get(2) == [1, 20, 3]
+    assert len(table) == 1
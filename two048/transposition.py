@@ -0,0 +1,112 @@
+import math
+from collections import OrderedDict
+
+from .game import board_symmetries, pack_board, symmetries
+
+
+# transposition table - search results shared between the positions that are
+# reached by different move orders or that are rotations or reflections of
+# each other (they have the same future moves and merges)
+
+
+def canonical_key(state):
+    # the smallest packed board among the 8 rotations and reflections of the
+    # state (list state or packed 4x4 board), the states with tiles that do
+    # not fit into 4 bits are keyed by the smallest tuple of the tiles
+    try:
+        if isinstance(state, int) or len(state) == 16:
+            return min(board_symmetries(pack_board(state)))
+        size = math.isqrt(len(state))
+        return min(pack_board([state[i] for i in permutation])
+                   for permutation in symmetries(size))
+    except ValueError:
+        return min(tuple(state[i] for i in permutation)
+                   for permutation in symmetries(math.isqrt(len(state))))
+
+
+class TranspositionTable:
+    # bounded table of entries [visits, value, depth] by canonical key
+    #
+    # replacement:
+    #   "lru" - the least recently used entry is evicted when the table is full
+    #   "depth" - entries are stored in capacity slots by the hash of the key,
+    #     an occupied slot is taken over only by an entry of at least the same
+    #     depth (results of deeper searches are kept)
+    # value is the sum of the values of visits samples (monte carlo searches)
+    # or the value of a search of the given depth with visits = 1 (expectimax)
+
+    def __init__(self, capacity=1 << 20, replacement="lru"):
+        if replacement not in ("lru", "depth"):
+            raise ValueError("unknown replacement {}".format(replacement))
+        self.capacity = capacity
+        self.replacement = replacement
+        if replacement == "lru":
+            self.entries = OrderedDict()
+        else:
+            self.keys = [None] * capacity
+            self.slots = [None] * capacity
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def __len__(self):
+        if self.replacement == "lru":
+            return len(self.entries)
+        return self.capacity - self.keys.count(None)
+
+    def get_slot(self, key):
+        # canonical keys have the empty tiles in the lowest bits, the hash is
+        # mixed (fibonacci hashing) before it is reduced to the slot
+        return ((hash(key) * 0x9E3779B97F4A7C15) >> 32) % self.capacity
+
+    def get(self, key):
+        # entry of the key or None, the entry can be updated in place
+        if self.replacement == "lru":
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        else:
+            slot = self.get_slot(key)
+            entry = self.slots[slot] if self.keys[slot] == key else None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, value, visits=1, depth=0):
+        # store (or replace) the entry of the key, returns the stored entry
+        # (None if a deeper entry was kept)
+        self.stores += 1
+        entry = [visits, value, depth]
+        if self.replacement == "lru":
+            entries = self.entries
+            if key in entries:
+                entries.move_to_end(key)
+            elif len(entries) >= self.capacity:
+                entries.popitem(last=False)
+                self.evictions += 1
+            entries[key] = entry
+        else:
+            slot = self.get_slot(key)
+            old_key = self.keys[slot]
+            if old_key is not None and old_key != key:
+                if self.slots[slot][2] > depth:
+                    return None
+                self.evictions += 1
+            self.keys[slot] = key
+            self.slots[slot] = entry
+        return entry
+
+    def clear(self):
+        self.__init__(self.capacity, self.replacement)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def get_statistics(self):
+        return {"entries": len(self), "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate(),
+                "stores": self.stores, "evictions": self.evictions}